@@ -0,0 +1,137 @@
+"""
+Module for saving and loading the state of an alignment run.
+
+An alignment run over many files is expensive mostly because of the dataset
+pair comparisons. The state file keeps everything an incremental run
+(main.py --append) needs to add new files without redoing that work: the
+feature table of all aligned datasets, the uncleaned edge store, the last
+community partition, the cliques and the settings they were computed with.
+
+Main functions/classes:
+    - save_alignment_state: Writes the state of a finished run
+    - load_alignment_state: Reads it back, or returns None if there is none
+
+Inputs:
+    - FeatureTable, uncleaned EdgeGraph, partition, cliques and matching settings
+
+Outputs:
+    - <output_dir>/alignment_state.npz (plain arrays plus a JSON manifest, no pickle)
+
+Important arguments:
+    - settings: mz_tolerance, rt_tolerance, cosine_threshold, min_shared_peaks;
+      an incremental run must use the same values
+"""
+import os
+import json
+import logging
+import numpy as np
+from typing import Any, Dict, List, Optional
+from spectral_similarity import SpectrumStore
+from feature_table import FeatureTable
+from feature_cache import encode_labels, decode_labels
+from edge_graph import EdgeGraph, EDGE_COLUMNS
+
+# Configure logger for this module
+logger = logging.getLogger(__name__)
+
+STATE_FILE_NAME = "alignment_state.npz"
+
+# Bumped whenever the layout of the state file changes
+STATE_VERSION = 1
+
+
+def save_alignment_state(state_path: str, features: FeatureTable, graph: EdgeGraph,
+                         partition: Dict[str, int], cliques: List[List[str]],
+                         settings: Dict[str, Any]) -> None:
+    """
+    Write the state of an alignment run.
+
+    Inputs:
+        state_path (str): Path of the state file
+        features (FeatureTable): Features of all aligned datasets
+        graph (EdgeGraph): Graph before clean_multiple_connections
+        partition (Dict[str, int]): Community of every node key
+        cliques (List[List[str]]): Node keys of every clique
+        settings (Dict[str, Any]): Matching settings of the run
+    """
+    spectra = SpectrumStore.concat(features.spectra)
+    arrays = {
+        'dataset_offsets': features.dataset_offsets,
+        'mz': features.mz,
+        'rt': features.rt,
+        'intensity': features.intensity,
+        'spectra_indptr': spectra.indptr,
+        'spectra_mz_bin': spectra.mz_bin,
+        'spectra_intensity': spectra.intensity,
+        'partition_nodes': np.array([graph.node_index(key) for key in partition], dtype=np.int64),
+        'partition_communities': np.array(list(partition.values()), dtype=np.int64),
+        'clique_nodes': np.array([graph.node_index(key) for clique in cliques for key in clique],
+                                 dtype=np.int64),
+        'clique_offsets': np.cumsum([0] + [len(clique) for clique in cliques], dtype=np.int64),
+    }
+    for name in EDGE_COLUMNS:
+        arrays[f"edge_{name}"] = getattr(graph, name)
+
+    kinds = encode_labels(features.labels, arrays)
+    arrays['__manifest__'] = np.array(json.dumps({
+        'version': STATE_VERSION,
+        'filenames': [os.path.abspath(filename) for filename in features.filenames],
+        'settings': settings,
+        'labels': kinds,
+    }))
+
+    tmp_path = str(state_path) + ".tmp.npz"
+    np.savez(tmp_path, **arrays)
+    os.replace(tmp_path, state_path)
+    logger.info(f"Saved alignment state of {features.n_datasets} datasets to {state_path}")
+
+
+def load_alignment_state(state_path: str) -> Optional[Dict[str, Any]]:
+    """
+    Read the state written by save_alignment_state.
+
+    Inputs:
+        state_path (str): Path of the state file
+
+    Outputs:
+        Optional[Dict[str, Any]]: 'features' (FeatureTable), 'graph' (uncleaned
+        EdgeGraph), 'partition', 'cliques' and 'settings', or None if there is
+        no usable state file
+    """
+    if not os.path.exists(state_path):
+        return None
+
+    try:
+        with np.load(state_path, allow_pickle=False) as data:
+            manifest = json.loads(str(data['__manifest__']))
+            if manifest.get('version') != STATE_VERSION:
+                logger.warning(f"Ignoring alignment state {state_path} with version {manifest.get('version')}")
+                return None
+
+            offsets = data['dataset_offsets']
+            spectra = SpectrumStore(data['spectra_indptr'], data['spectra_mz_bin'],
+                                    data['spectra_intensity'])
+            stores = [spectra.take(np.arange(offsets[d], offsets[d + 1]))
+                      for d in range(len(offsets) - 1)]
+            features = FeatureTable(manifest['filenames'], offsets, data['mz'], data['rt'],
+                                    data['intensity'], stores,
+                                    decode_labels(manifest['labels'], data))
+            graph = EdgeGraph(features, **{name: data[f"edge_{name}"] for name in EDGE_COLUMNS})
+
+            partition = dict(zip(graph.node_keys(data['partition_nodes']),
+                                 data['partition_communities'].tolist()))
+            clique_keys = graph.node_keys(data['clique_nodes'])
+            clique_offsets = data['clique_offsets'].tolist()
+            cliques = [clique_keys[start:end] for start, end in zip(clique_offsets, clique_offsets[1:])]
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable alignment state {state_path}: {e}")
+        return None
+
+    logger.info(f"Loaded alignment state of {features.n_datasets} datasets from {state_path}")
+    return {
+        'features': features,
+        'graph': graph,
+        'partition': partition,
+        'cliques': cliques,
+        'settings': manifest['settings'],
+    }
@@ -0,0 +1,384 @@
+"""
+Module for benchmarking the alignment pipeline on synthetic datasets.
+
+For every scale (number of datasets x number of compounds) synthetic files
+are generated (see synthetic_data) and the pipeline stages are timed one by
+one: reading the .xlsx (and optionally .mgf/.msp) files, build_graph,
+clean_multiple_connections, Louvain community detection, clique finding and
+write_aligned_features_tsv. Stage records come from StageProfiler (without
+allocation tracing), and the community groups are scored against the true
+groups of the generator. Results are written as JSON and can be compared
+with an earlier result file to catch regressions. The cold import time of
+main.py is checked against a budget, and the plotting and Louvain libraries
+must not be loaded by the import alone.
+
+Main functions/classes:
+    - parse_scale: Parses a scale such as "6x2000"
+    - run_benchmark: Generates one scale and times every stage
+    - pair_scores: Pairwise precision/recall of groups against the true groups
+    - compare_results: Stages that became slower than in a baseline result file
+    - measure_import_time: Cold import time of a module in a fresh interpreter
+    - main: Command-line entry point (python benchmark.py)
+
+Inputs:
+    - Scales, generator seed and number of workers
+
+Outputs:
+    - <output> (default: benchmark_results.json): environment, settings and one
+      entry per scale with stage records, counters and accuracy
+
+Important arguments:
+    --scales: Scales to run (default: DEFAULT_SCALES)
+    --formats: Input formats to generate and time (default: xlsx)
+    --baseline: Earlier result file to compare with
+    --tolerance: Relative slowdown reported as a regression (default: 0.25)
+    --import-budget: Seconds allowed for importing main.py (default: IMPORT_BUDGET_SECONDS)
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import logging
+import platform
+import tempfile
+import subprocess
+from typing import Any, Dict, List, Tuple
+import numpy as np
+import pandas as pd
+from read_files import read_feature_table
+from feature_table import FeatureTable
+from graph_construction import GraphBuilder
+from community_detection import detect_communities, group_features_by_community
+from clique_detection import find_kpartite_cliques, group_features_by_clique
+from mass_feature_aligner import write_aligned_features_tsv, filter_aligned_features, calculate_average_mz
+from profiling import StageProfiler
+from synthetic_data import generate_datasets, write_datasets, read_ground_truth
+
+# Configure logger for this module
+logger = logging.getLogger(__name__)
+
+RESULTS_FILE_NAME = "benchmark_results.json"
+
+# Bumped whenever the layout of the result file changes
+RESULTS_VERSION = 2
+
+# Number of datasets x number of compounds
+DEFAULT_SCALES = ('4x500', '6x2000', '10x5000')
+
+# Seconds allowed for a cold "import main" (python main.py --help pays the same)
+IMPORT_BUDGET_SECONDS = 1.0
+
+# Modules main.py must only import in the stage that uses them
+DEFERRED_MODULES = ('matplotlib', 'seaborn', 'scipy', 'networkx', 'community')
+
+# Stages whose wall time is compared with a baseline
+TIMED_STAGES = ('read_excel', 'read_mgf', 'read_msp', 'build_graph', 'clean_multiple_connections',
+                'communities', 'cliques', 'write_output')
+
+
+def parse_scale(scale: str) -> Tuple[int, int]:
+    """
+    Parse a scale of the form "<datasets>x<features>".
+
+    Parameters:
+    -----------
+    scale : str
+        For example "6x2000"
+
+    Returns:
+    --------
+    n_datasets, n_features : int
+    """
+    try:
+        n_datasets, n_features = (int(value) for value in scale.lower().split('x'))
+    except ValueError:
+        raise ValueError(f"Invalid scale {scale!r}; expected <datasets>x<features>, e.g. 6x2000")
+    return n_datasets, n_features
+
+
+def pair_scores(predicted: np.ndarray, truth: np.ndarray) -> Dict[str, float]:
+    """
+    Pairwise precision and recall of predicted groups against true groups.
+
+    Two features form a predicted pair if they share a predicted group and a
+    true pair if they share a true group; -1 means "no group" on either side.
+
+    Parameters:
+    -----------
+    predicted : numpy.ndarray
+        Predicted group of every feature (-1 for ungrouped features)
+    truth : numpy.ndarray
+        True group of every feature (-1 for noise features)
+
+    Returns:
+    --------
+    scores : dict
+        'precision', 'recall' and 'f1'
+    """
+    def n_pairs(counts):
+        counts = np.asarray(counts, dtype=np.int64)
+        return int((counts * (counts - 1) // 2).sum())
+
+    frame = pd.DataFrame({'predicted': predicted, 'truth': truth})
+    predicted_pairs = n_pairs(frame.loc[frame['predicted'] >= 0, 'predicted'].value_counts())
+    true_pairs = n_pairs(frame.loc[frame['truth'] >= 0, 'truth'].value_counts())
+    both = frame[(frame['predicted'] >= 0) & (frame['truth'] >= 0)]
+    shared_pairs = n_pairs(both.groupby(['predicted', 'truth']).size())
+
+    precision = shared_pairs / predicted_pairs if predicted_pairs else 0.0
+    recall = shared_pairs / true_pairs if true_pairs else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {'precision': precision, 'recall': recall, 'f1': f1}
+
+
+def _group_labels(groups: Dict[Any, list], features: FeatureTable) -> np.ndarray:
+    """Group number of every FeatureTable row (-1 for rows in no group)."""
+    labels = np.full(len(features), -1, dtype=np.int64)
+    for number, members in enumerate(groups.values()):
+        rows = [features.row(member['dataset_id'], member['feature_id']) for member in members]
+        labels[rows] = number
+    return labels
+
+
+def run_benchmark(n_datasets: int, n_features: int, data_dir: str, formats=('xlsx',), workers: int = 1,
+                  seed: int = 0) -> Dict[str, Any]:
+    """
+    Generate one scale and time every pipeline stage on it.
+
+    Parameters:
+    -----------
+    n_datasets : int
+        Number of datasets
+    n_features : int
+        Number of compounds
+    data_dir : str
+        Directory for the generated files and the aligned output
+    formats : list
+        Input formats to generate and time; 'xlsx' is always included and feeds the pipeline
+    workers : int
+        Number of processes for graph construction, Louvain and cliques (default: 1)
+    seed : int
+        Generator seed (default: 0)
+
+    Returns:
+    --------
+    result : dict
+        'scale', 'n_datasets', 'n_features', 'generate_seconds', 'features',
+        'stages' (StageProfiler records) and 'accuracy' (pair_scores of the
+        community groups)
+    """
+    formats = ['xlsx'] + [file_format for file_format in formats if file_format != 'xlsx']
+    start = time.perf_counter()
+    datasets = generate_datasets(n_datasets, n_features, seed=seed)
+    files = write_datasets(datasets, data_dir, formats=formats)
+    generate_seconds = time.perf_counter() - start
+
+    profiler = StageProfiler(enabled=True, output_dir=data_dir, trace_memory=False)
+    for file_format in formats:
+        with profiler.stage(f"read_{'excel' if file_format == 'xlsx' else file_format}") as counters:
+            tables = [read_feature_table(file_path, use_cache=False) for file_path in files[file_format]]
+            counters.update(files=len(tables), features=sum(len(table) for table in tables))
+        if file_format == 'xlsx':
+            features = FeatureTable.concat(tables)
+
+    builder = GraphBuilder(workers=workers)
+    with profiler.stage('build_graph') as counters:
+        builder.build_graph(features)
+        counters.update(builder.stats)
+    with profiler.stage('clean_multiple_connections') as counters:
+        G = builder.clean_multiple_connections()
+        counters.update(builder.stats)
+
+    with profiler.stage('communities') as counters:
+        partition = detect_communities(G, workers=workers)
+        community_groups = filter_aligned_features(group_features_by_community(G, partition))
+        counters.update(communities=len(set(partition.values())), groups_kept=len(community_groups))
+
+    with profiler.stage('cliques') as counters:
+        cliques = find_kpartite_cliques(G, G.connected_components(), min_size=3, workers=workers)
+        clique_groups = filter_aligned_features(group_features_by_clique(cliques, G))
+        counters.update(cliques=len(cliques), groups_kept=len(clique_groups))
+
+    with profiler.stage('write_output') as counters:
+        output_file = os.path.join(data_dir, "aligned_features_community.tsv")
+        write_aligned_features_tsv(community_groups, calculate_average_mz(community_groups, {}),
+                                   features, output_file, G)
+        counters.update(groups_written=len(community_groups), bytes=os.path.getsize(output_file))
+
+    # True group of every FeatureTable row, matched by file name and row within the file
+    truth = read_ground_truth(data_dir).set_index(['filename', 'feature_index'])['true_group']
+    keys = [(os.path.splitext(features.basename(dataset_id))[0], feature_index)
+            for dataset_id in range(features.n_datasets)
+            for feature_index in range(features.dataset_size(dataset_id))]
+    truth = truth.reindex(keys, fill_value=-1).to_numpy()
+    return {
+        'scale': f"{n_datasets}x{n_features}",
+        'n_datasets': n_datasets,
+        'n_features': n_features,
+        'generate_seconds': generate_seconds,
+        'features': len(features),
+        'stages': profiler.stages,
+        'accuracy': pair_scores(_group_labels(community_groups, features), truth),
+    }
+
+
+def compare_results(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float = 0.25,
+                    min_seconds: float = 0.05) -> List[Dict[str, Any]]:
+    """
+    Find stages that became slower than in a baseline result file.
+
+    Parameters:
+    -----------
+    results, baseline : dict
+        Result files written by main
+    tolerance : float
+        Relative slowdown above which a stage is reported (default: 0.25)
+    min_seconds : float
+        Stages faster than this in both runs are ignored (timer noise)
+
+    Returns:
+    --------
+    regressions : list
+        One dict per slower stage: scale, stage, baseline and current seconds, ratio
+    """
+    def wall_times(result_file):
+        return {(entry['scale'], stage['stage']): stage['wall_seconds']
+                for entry in result_file['results'] for stage in entry['stages']
+                if stage['stage'] in TIMED_STAGES}
+
+    current, previous = wall_times(results), wall_times(baseline)
+    regressions = []
+    for key in sorted(current.keys() & previous.keys()):
+        seconds, baseline_seconds = current[key], previous[key]
+        if max(seconds, baseline_seconds) < min_seconds:
+            continue
+        ratio = seconds / max(baseline_seconds, 1e-9)
+        if ratio > 1.0 + tolerance:
+            regressions.append({'scale': key[0], 'stage': key[1], 'baseline_seconds': baseline_seconds,
+                                'seconds': seconds, 'ratio': ratio})
+    return regressions
+
+
+def measure_import_time(module: str = 'main', repeats: int = 3) -> Dict[str, Any]:
+    """
+    Time importing a module in fresh interpreters.
+
+    Parameters:
+    -----------
+    module : str
+        Module of this directory to import (default: 'main')
+    repeats : int
+        Number of interpreters started; the fastest import is reported (default: 3)
+
+    Returns:
+    --------
+    result : dict
+        'module', 'seconds' and 'deferred_loaded' (DEFERRED_MODULES loaded by the import)
+    """
+    script = (
+        "import json, sys, time\n"
+        "start = time.perf_counter()\n"
+        f"import {module}\n"
+        "seconds = time.perf_counter() - start\n"
+        f"print(json.dumps({{'seconds': seconds, 'deferred_loaded': [name for name in {DEFERRED_MODULES!r} "
+        "if name in sys.modules]}))\n"
+    )
+    runs = []
+    for _ in range(repeats):
+        completed = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True,
+                                   cwd=os.path.dirname(os.path.abspath(__file__)))
+        runs.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+    fastest = min(runs, key=lambda run: run['seconds'])
+    return {'module': module, 'seconds': fastest['seconds'], 'deferred_loaded': fastest['deferred_loaded']}
+
+
+def main():
+    """
+    Run the benchmark from the command line.
+
+    Exits with status 1 if importing main.py exceeds --import-budget or loads a
+    deferred module, or if --baseline is given and a stage regressed.
+    """
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    parser = argparse.ArgumentParser(description='Benchmark the alignment pipeline on synthetic datasets')
+    parser.add_argument('--scales', nargs='+', default=list(DEFAULT_SCALES),
+                        help='Scales to run as <datasets>x<features>, e.g. 6x2000')
+    parser.add_argument('--formats', nargs='+', choices=['xlsx', 'mgf', 'msp'], default=['xlsx'],
+                        help='Input formats to generate and time (the pipeline always runs on xlsx)')
+    parser.add_argument('--workers', type=int, default=1, help='Number of worker processes')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic data generator')
+    parser.add_argument('--data-dir', type=str, default=None,
+                        help='Keep the generated files in this directory (default: a temporary directory)')
+    parser.add_argument('--output', type=str, default=RESULTS_FILE_NAME, help='Result file (JSON)')
+    parser.add_argument('--baseline', type=str, default=None, help='Earlier result file to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Relative slowdown reported as a regression')
+    parser.add_argument('--import-budget', type=float, default=IMPORT_BUDGET_SECONDS,
+                        help='Seconds allowed for importing main.py')
+    args = parser.parse_args()
+
+    scales = [parse_scale(scale) for scale in args.scales]
+    failed = False
+
+    import_time = measure_import_time('main')
+    logger.info(f"Importing main took {import_time['seconds']:.2f} s (budget {args.import_budget:.2f} s)")
+    if import_time['seconds'] > args.import_budget:
+        logger.warning(f"Importing main exceeds the budget of {args.import_budget:.2f} s")
+        failed = True
+    if import_time['deferred_loaded']:
+        logger.warning(f"Importing main loads {', '.join(import_time['deferred_loaded'])}; "
+                       f"these should be imported by the stage that uses them")
+        failed = True
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix='ms_align_benchmark_') as tmp_dir:
+        for n_datasets, n_features in scales:
+            data_dir = os.path.join(args.data_dir or tmp_dir, f"{n_datasets}x{n_features}")
+            logger.info(f"Benchmarking {n_datasets} datasets x {n_features} features...")
+            result = run_benchmark(n_datasets, n_features, data_dir, formats=args.formats,
+                                   workers=args.workers, seed=args.seed)
+            results.append(result)
+            stages = ', '.join(f"{stage['stage']} {stage['wall_seconds']:.2f} s" for stage in result['stages'])
+            logger.info(f"{result['scale']}: {stages}; F1 {result['accuracy']['f1']:.3f}")
+
+    output = {
+        'version': RESULTS_VERSION,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'environment': {
+            'python': sys.version.split()[0],
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'settings': {'scales': args.scales, 'formats': args.formats, 'workers': args.workers, 'seed': args.seed,
+                     'import_budget': args.import_budget},
+        'import': import_time,
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(output, f, indent=2)
+    logger.info(f"Wrote benchmark results of {len(results)} scales to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_results(output, baseline, tolerance=args.tolerance)
+        for regression in regressions:
+            logger.warning(f"{regression['scale']} {regression['stage']}: {regression['baseline_seconds']:.2f} s -> "
+                           f"{regression['seconds']:.2f} s ({regression['ratio']:.2f}x)")
+        if regressions:
+            failed = True
+        else:
+            logger.info(f"No stage is more than {100 * args.tolerance:.0f}% slower than in {args.baseline}")
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,11 +7,12 @@ a 'hard' grouping approach with strict all-to-all connectivity requirements.
 
 Main functions/classes:
     - find_cliques: Finds all maximal cliques in the graph
+    - find_kpartite_cliques: Maximal cliques of a dataset-partite EdgeGraph, per component in a process pool
     - generate_clique_tables: Creates structured output tables from clique results
     - filter_cliques_by_dataset: Ensures cliques span multiple datasets
 
 Inputs:
-    - NetworkX graph with features as nodes and similarities as edges
+    - EdgeGraph (or NetworkX graph) with features as nodes and similarities as edges
     - Minimum clique size and dataset requirements
 
 Outputs:
@@ -22,11 +23,151 @@ Important arguments:
     - G: NetworkX graph from graph_construction module
     - min_size: Minimum number of nodes required for valid clique
     - min_datasets: Minimum number of datasets required in each clique
+    - time_budget: Seconds after which the clique search stops (default: no limit)
 """
-import pandas as pd
-import networkx as nx
+import time
 import numpy as np
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from feature_table import node_feature
+from edge_graph import EdgeGraph
+
+class _TimeBudgetExceeded(Exception):
+    pass
+
+def _kpartite_cliques(n_nodes, u, v, colour, min_size, deadline):
+    """
+    Maximal cliques with at least min_size nodes of one component (local node ids).
+    
+    Bron-Kerbosch with pivoting, specialised for graphs without edges inside a
+    dataset (``colour``): a clique holds at most one node per dataset, so a
+    branch is cut as soon as the clique so far plus the number of datasets
+    left among the candidates cannot reach min_size. Nodes with fewer than
+    min_size - 1 neighbours are removed first (they cannot be in such a clique).
+    
+    Returns the cliques found and False if the deadline stopped the search.
+    """
+    adjacency = [set() for _ in range(n_nodes)]
+    for a, b in zip(u.tolist(), v.tolist()):
+        adjacency[a].add(b)
+        adjacency[b].add(a)
+    colour = colour.tolist()
+    
+    # Degree pruning (min_size - 1 core)
+    removed = set()
+    queue = [node for node in range(n_nodes) if len(adjacency[node]) < min_size - 1]
+    while queue:
+        node = queue.pop()
+        if node in removed:
+            continue
+        removed.add(node)
+        for neighbor in adjacency[node]:
+            adjacency[neighbor].discard(node)
+            if neighbor not in removed and len(adjacency[neighbor]) < min_size - 1:
+                queue.append(neighbor)
+        adjacency[node] = set()
+    
+    cliques = []
+    calls = [0]
+    
+    def expand(clique, candidates, excluded):
+        if not candidates:
+            if not excluded and len(clique) >= min_size:
+                cliques.append(sorted(clique))
+            return
+        # Colour bound: one more node per dataset at most
+        if len(clique) + len({colour[node] for node in candidates}) < min_size:
+            return
+        calls[0] += 1
+        if deadline is not None and calls[0] % 1000 == 0 and time.time() > deadline:
+            raise _TimeBudgetExceeded()
+        pivot = max(candidates | excluded, key=lambda node: len(candidates & adjacency[node]))
+        for node in list(candidates - adjacency[pivot]):
+            clique.append(node)
+            expand(clique, candidates & adjacency[node], excluded & adjacency[node])
+            clique.pop()
+            candidates.remove(node)
+            excluded.add(node)
+    
+    try:
+        expand([], set(range(n_nodes)) - removed, set())
+    except _TimeBudgetExceeded:
+        return cliques, False
+    return cliques, True
+
+def _kpartite_cliques_task(task):
+    """Worker entry point: cliques of one component given as local edge arrays."""
+    return _kpartite_cliques(*task)
+
+def find_kpartite_cliques(G, components=None, min_size=3, workers=1, time_budget=None):
+    """
+    Find all maximal cliques of at least min_size nodes in an EdgeGraph.
+    
+    The feature graph never has edges between features of the same dataset,
+    so every clique holds at most one feature per dataset and is a valid
+    group as-is. Components are searched independently (complete components
+    directly, the others with _kpartite_cliques), in a process pool if
+    workers > 1. Unlike the former capped search, no component, clique size or
+    clique count is skipped.
+    
+    Parameters:
+    -----------
+    G : EdgeGraph
+        Feature graph
+    components : list of numpy.ndarray, optional
+        Connected components to search (default: all)
+    min_size : int
+        Minimum number of nodes of a clique (default: 3)
+    workers : int
+        Number of worker processes (default: 1, no pool)
+    time_budget : float, optional
+        Seconds after which unfinished components are abandoned (their
+        cliques found so far are kept)
+        
+    Returns:
+    --------
+    cliques : list
+        Node IDs ("{dataset_id}_{feature_id}") of every clique, in component order
+    """
+    if components is None:
+        components = G.connected_components()
+    components = [component for component in components if len(component) >= min_size]
+    edge_lists = G.component_edges(components)
+    deadline = time.time() + time_budget if time_budget else None
+    
+    results = [None] * len(components)
+    tasks = []
+    for c, (component, edges) in enumerate(zip(components, edge_lists)):
+        n_nodes = len(component)
+        if len(edges) == n_nodes * (n_nodes - 1) // 2:
+            # Complete component: a single clique
+            results[c] = ([list(range(n_nodes))], True)
+        else:
+            tasks.append((c, (n_nodes, np.searchsorted(component, G.u[edges]),
+                              np.searchsorted(component, G.v[edges]),
+                              G.features.dataset_id[component], min_size, deadline)))
+    
+    print(f"Searching cliques in {len(components)} components "
+          f"({len(components) - len(tasks)} complete)")
+    if workers <= 1 or len(tasks) <= 1:
+        for c, task in tasks:
+            results[c] = _kpartite_cliques_task(task)
+    else:
+        n_workers = min(workers, len(tasks))
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            for (c, _), result in zip(tasks, executor.map(_kpartite_cliques_task, [task for _, task in tasks],
+                                                          chunksize=max(1, len(tasks) // (n_workers * 4)))):
+                results[c] = result
+    
+    cliques = []
+    unfinished = 0
+    for component, (local_cliques, complete) in zip(components, results):
+        cliques.extend(G.node_keys(component[clique]) for clique in local_cliques)
+        unfinished += not complete
+    if unfinished:
+        print(f"Warning: clique search stopped after {time_budget} s; "
+              f"{unfinished} components are incomplete")
+    return cliques
 
 def find_cliques(G):
     """
@@ -47,7 +188,11 @@ def find_cliques(G):
     print("Finding maximal cliques...")
     
     # Find all maximal cliques
-    all_cliques = list(nx.find_cliques(G))
+    if isinstance(G, EdgeGraph):
+        all_cliques = find_kpartite_cliques(G)
+    else:
+        import networkx as nx
+        all_cliques = list(nx.find_cliques(G))
     
     # Filter cliques to only include those with at least 3 nodes
     filtered_cliques = [clique for clique in all_cliques if len(clique) >= 3]
@@ -86,8 +231,8 @@ def group_features_by_clique(cliques, G):
         # Group nodes by dataset
         datasets = defaultdict(list)
         for node in nodes:
-            # Get node attributes from the graph
-            node_attrs = G.nodes[node]
+            # Get feature data from the graph's feature table
+            node_attrs = node_feature(G, node)
             dataset_id = node_attrs.get('dataset_id')
             feature_id = node_attrs.get('feature_id')
             intensity = node_attrs.get('intensity', 0)
@@ -113,7 +258,7 @@ def group_features_by_clique(cliques, G):
     print(f"Created {len(aligned_features)} aligned feature groups from cliques")
     return aligned_features
 
-def generate_clique_tables(G, cliques, all_list_features):
+def generate_clique_tables(G, cliques, features_table):
     """
     Generate tables of aligned features by clique.
     
@@ -123,8 +268,8 @@ def generate_clique_tables(G, cliques, all_list_features):
         Graph with nodes representing features and edges representing similarity
     cliques : list
         List of lists of node IDs for cliques
-    all_list_features : list of tuples
-        List of (filename, features) tuples
+    features_table : FeatureTable
+        Features of all datasets
         
     Returns:
     --------
@@ -140,12 +285,9 @@ def generate_clique_tables(G, cliques, all_list_features):
     feature_mzs = {}
     for clique_id, aligned_group in aligned_features.items():
         for dataset_id, feature_id in aligned_group.items():
-            # Get feature data
-            _, features = all_list_features[dataset_id]
-            feature = features[feature_id]
-            
             # Store m/z value
-            feature_mzs[(clique_id, dataset_id, feature_id)] = feature.get('mz', 0)
+            table_row = features_table.row(dataset_id, feature_id)
+            feature_mzs[(clique_id, dataset_id, feature_id)] = float(features_table.mz[table_row])
     
     return aligned_features, feature_mzs
 
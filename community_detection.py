@@ -8,12 +8,14 @@ grouping approach that allows flexible feature associations.
 
 Main functions/classes:
     - detect_communities: Applies Louvain algorithm to find feature communities
+    - changed_components: Connected components touched by new nodes (incremental runs)
+    - partition_components: Louvain per connected component, in a process pool
     - group_features_by_community: Groups features based on detected communities
     - detect_cliques: Finds maximal cliques for stricter grouping (deprecated, use clique_detection.py)
     - group_features_by_clique: Groups features based on clique membership
 
 Inputs:
-    - NetworkX graph with features as nodes and similarities as edges
+    - EdgeGraph (or NetworkX graph) with features as nodes and similarities as edges
     - Optional parameters for community detection algorithm
 
 Outputs:
@@ -23,35 +25,194 @@ Outputs:
 Important arguments:
     - G: NetworkX graph from graph_construction module
     - resolution: Resolution parameter for Louvain algorithm (higher = smaller communities)
+    - workers: Number of processes running Louvain on separate components (default: 1)
 """
-import networkx as nx
-import community as community_louvain
-import pandas as pd
 import numpy as np
 from collections import defaultdict
 import random
 import logging
+from concurrent.futures import ProcessPoolExecutor
+from feature_table import node_feature
+from edge_graph import EdgeGraph
 
 # Configure logger for this module
 logger = logging.getLogger(__name__)
 
-def detect_communities(G, resolution=1.0, hard_separation=False):
+# Components with fewer edges run in the parent process (a pool round trip costs more)
+LOUVAIN_POOL_MIN_EDGES = 2000
+
+def changed_components(G, changed_nodes, known_nodes=None):
+    """
+    Split the connected components of an EdgeGraph into changed and unchanged ones.
+    
+    Parameters:
+    -----------
+    G : EdgeGraph
+        Graph after the new datasets were added
+    changed_nodes : array-like
+        Node ids whose edges changed (e.g. the features of the new datasets)
+    known_nodes : set, optional
+        Node keys covered by the previous results; components with other
+        nodes are treated as changed too
+        
+    Returns:
+    --------
+    changed, unchanged : list of numpy.ndarray
+        Node ids of each component
+    """
+    is_changed = np.zeros(len(G.degree), dtype=bool)
+    is_changed[np.asarray(changed_nodes, dtype=np.int64)] = True
+    changed, unchanged = [], []
+    for component in G.connected_components():
+        if is_changed[component].any() or (
+                known_nodes is not None and not all(key in known_nodes for key in G.node_keys(component))):
+            changed.append(component)
+        else:
+            unchanged.append(component)
+    return changed, unchanged
+
+def _louvain_component_task(task):
+    """Worker entry point: Louvain on one component given as local edge arrays."""
+    n_nodes, u, v, weight, other_weight, resolution, initial = task
+    # python-louvain (and networkx, which it requires) load on the first Louvain run
+    import networkx as nx
+    import community as community_louvain
+    graph = nx.Graph()
+    graph.add_nodes_from(range(n_nodes))
+    graph.add_weighted_edges_from(zip(u.tolist(), v.tolist(), weight.tolist()))
+    if initial is not None:
+        initial = dict(enumerate(initial.tolist()))
+    if other_weight > 0:
+        # A disconnected edge carrying the weight of the rest of the graph keeps
+        # the modularity terms equal to those of a run on the whole graph
+        graph.add_edge(n_nodes, n_nodes + 1, weight=other_weight)
+        if initial is not None:
+            initial[n_nodes] = initial[n_nodes + 1] = max(initial.values(), default=-1) + 1
+    node_partition = community_louvain.best_partition(graph, partition=initial, resolution=resolution)
+    return np.array([node_partition[node] for node in range(n_nodes)], dtype=np.int64)
+
+def _first_seen_ids(communities):
+    """Renumber community labels 0, 1, ... in order of first appearance."""
+    _, first, inverse = np.unique(communities, return_index=True, return_inverse=True)
+    rank = np.empty(len(first), dtype=np.int64)
+    rank[np.argsort(first)] = np.arange(len(first))
+    return rank[inverse]
+
+def partition_components(G, components, resolution=1.0, workers=1, initial=None):
+    """
+    Run Louvain separately on connected components of an EdgeGraph.
+    
+    Louvain never merges disconnected nodes, so the components are optimized
+    independently. Each run also gets a disconnected edge holding the weight
+    of the rest of the graph, so modularity is computed against the total
+    edge weight as in a run on the whole graph. Components of at most two nodes and
+    components that are already a complete graph with one feature per dataset
+    are assigned one community directly; the others are sent to a process pool.
+    
+    Parameters:
+    -----------
+    G : EdgeGraph
+        Feature graph
+    components : list of numpy.ndarray
+        Connected components (ascending node ids), e.g. from G.connected_components()
+    resolution : float
+        Resolution parameter for the Louvain algorithm
+    workers : int
+        Number of worker processes (default: 1, no pool)
+    initial : dict, optional
+        Starting community of every node id of the components (incremental runs)
+        
+    Returns:
+    --------
+    partition : dict
+        Node key -> community ID; IDs are numbered 0, 1, ... by component order
+        and, within a component, by the smallest node id of each community
+    """
+    if not components:
+        return {}
+    sizes = np.array([len(component) for component in components], dtype=np.int64)
+    nodes = np.concatenate(components)
+    edge_lists = G.component_edges(components)
+    edge_counts = np.array([len(edges) for edges in edge_lists], dtype=np.int64)
+    component_weight = np.array([G.weight[edges].sum() for edges in edge_lists])
+    total_weight = float(G.weight.sum())
+    
+    # Trivial components: at most two nodes, or a complete one-feature-per-dataset clique
+    n_datasets = max(G.features.n_datasets, 1)
+    component_of = np.repeat(np.arange(len(components)), sizes)
+    node_datasets = np.unique(component_of * n_datasets + G.features.dataset_id[nodes])
+    distinct_datasets = np.bincount(node_datasets // n_datasets, minlength=len(components))
+    trivial = (sizes <= 2) | ((edge_counts == sizes * (sizes - 1) // 2) & (distinct_datasets == sizes))
+    
+    tasks = []
+    for c in np.flatnonzero(~trivial).tolist():
+        component = components[c]
+        component_edges = edge_lists[c]
+        start = None
+        if initial is not None:
+            start = np.array([initial[node] for node in component.tolist()], dtype=np.int64)
+        tasks.append((len(component),
+                      np.searchsorted(component, G.u[component_edges]),
+                      np.searchsorted(component, G.v[component_edges]),
+                      G.weight[component_edges], max(total_weight - component_weight[c], 0.0),
+                      resolution, start))
+    logger.info(f"Partitioning {len(components)} components: {int(trivial.sum())} resolved directly, "
+                f"{len(tasks)} with Louvain")
+    
+    large = [k for k, task in enumerate(tasks) if len(task[1]) >= LOUVAIN_POOL_MIN_EDGES]
+    results = [None] * len(tasks)
+    if workers <= 1 or not large:
+        results = [_louvain_component_task(task) for task in tasks]
+    else:
+        # Large components go to the pool while the small ones run here
+        with ProcessPoolExecutor(max_workers=min(workers, len(large))) as executor:
+            futures = {k: executor.submit(_louvain_component_task, tasks[k]) for k in large}
+            for k, task in enumerate(tasks):
+                if k not in futures:
+                    results[k] = _louvain_component_task(task)
+            for k, future in futures.items():
+                results[k] = future.result()
+    
+    results = iter(results)
+    communities = [np.zeros(size, dtype=np.int64) if is_trivial else _first_seen_ids(next(results))
+                   for size, is_trivial in zip(sizes.tolist(), trivial.tolist())]
+    
+    # Stable global IDs: offset every component by the communities before it
+    counts = np.array([community.max() + 1 for community in communities], dtype=np.int64)
+    offsets = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    community_ids = np.concatenate([community + offset
+                                    for community, offset in zip(communities, offsets)])
+    return dict(zip(G.node_keys(nodes), community_ids.tolist()))
+
+def detect_communities(G, resolution=1.0, hard_separation=False, previous_partition=None,
+                       changed_nodes=None, workers=1):
     """
     Detect communities in the graph using the Louvain algorithm.
     
+    With previous_partition and changed_nodes (an incremental run), communities
+    of unchanged connected components are taken over from the previous
+    partition and Louvain only runs on the changed components, starting from
+    the previous communities of their nodes.
+    
     Parameters:
     -----------
-    G : networkx.Graph
+    G : EdgeGraph or networkx.Graph
         Graph to detect communities in
     resolution : float
         Resolution parameter for the Louvain algorithm. Higher values lead to smaller communities.
     hard_separation : bool
         If True, use a higher resolution and post-process communities to ensure hard separation
+    previous_partition : dict, optional
+        Partition of the previous run (EdgeGraph only)
+    changed_nodes : array-like, optional
+        Node ids whose edges changed since the previous run
+    workers : int
+        Number of processes running Louvain on separate components (EdgeGraph only)
         
     Returns:
     --------
     partition : dict
-        Dictionary mapping node IDs to community IDs
+        Dictionary mapping node IDs ("{dataset_id}_{feature_id}") to community IDs
     """
     if G.number_of_nodes() == 0:
         logger.warning("Empty graph, no communities to detect")
@@ -63,8 +224,15 @@ def detect_communities(G, resolution=1.0, hard_separation=False):
     
     logger.info(f"Detecting communities with resolution={resolution}...")
     
-    # Apply Louvain algorithm
-    partition = community_louvain.best_partition(G, resolution=resolution)
+    # Apply Louvain algorithm; python-louvain only accepts networkx graphs, so an
+    # EdgeGraph is handed over as integer nodes with edge weights only
+    if isinstance(G, EdgeGraph) and previous_partition is not None:
+        partition = _update_communities(G, resolution, previous_partition, changed_nodes, workers)
+    elif isinstance(G, EdgeGraph):
+        partition = partition_components(G, G.connected_components(), resolution, workers)
+    else:
+        import community as community_louvain
+        partition = community_louvain.best_partition(G, resolution=resolution)
     
     # Post-process communities if hard separation is requested
     if hard_separation:
@@ -87,6 +255,37 @@ def detect_communities(G, resolution=1.0, hard_separation=False):
     
     return partition
 
+def _update_communities(G, resolution, previous_partition, changed_nodes, workers=1):
+    """Incremental part of detect_communities: rerun Louvain on the changed components only."""
+    changed, unchanged = changed_components(G, changed_nodes, known_nodes=previous_partition)
+    logger.info(f"Updating communities of {len(changed)} changed components "
+                f"(keeping {len(unchanged)} unchanged components)")
+    
+    partition = {}
+    for component in unchanged:
+        for key in G.node_keys(component):
+            partition[key] = previous_partition[key]
+    if not changed:
+        return partition
+    
+    # Start from the previous communities; new nodes start in their own community
+    nodes = np.concatenate(changed)
+    next_id = max(previous_partition.values(), default=-1) + 1
+    initial = {}
+    for node, key in zip(nodes.tolist(), G.node_keys(nodes)):
+        if key in previous_partition:
+            initial[node] = previous_partition[key]
+        else:
+            initial[node] = next_id
+            next_id += 1
+    
+    # Number the updated communities after the kept ones
+    offset = max(partition.values(), default=-1) + 1
+    updated = partition_components(G, changed, resolution, workers, initial=initial)
+    for key, comm_id in updated.items():
+        partition[key] = offset + comm_id
+    return partition
+
 def refine_communities_by_mz_rt(G, partition, mz_tolerance=0.01, rt_tolerance=0.5):
     """
     Refine communities based on m/z and RT values to ensure they represent distinct chemical entities.
@@ -203,8 +402,8 @@ def group_features_by_community(G, partition):
     # Group features by community
     grouped_features = defaultdict(list)
     for node, comm_id in partition.items():
-        # Get feature data from node attributes
-        feature_data = G.nodes[node]
+        # Get feature data from the graph's feature table
+        feature_data = node_feature(G, node)
         
         # Create a feature dictionary with all relevant information
         feature = {
@@ -253,7 +452,7 @@ def group_features_by_community(G, partition):
     
     return result
 
-def generate_community_tables(G, partition, all_list_features):
+def generate_community_tables(G, partition, features_table):
     """
     Generate tables of aligned features by community.
     
@@ -263,8 +462,8 @@ def generate_community_tables(G, partition, all_list_features):
         Graph with nodes representing features and edges representing similarity
     partition : dict
         Dictionary mapping node IDs to community IDs
-    all_list_features : list of tuples
-        List of (filename, features) tuples
+    features_table : FeatureTable
+        Features of all datasets
         
     Returns:
     --------
@@ -280,12 +479,9 @@ def generate_community_tables(G, partition, all_list_features):
     feature_mzs = {}
     for comm_id, features in aligned_features.items():
         for feature in features:
-            # Get feature data
-            _, features = all_list_features[feature['dataset_id']]
-            feature_data = features[feature['feature_id']]
-            
             # Store m/z value
-            feature_mzs[(comm_id, feature['dataset_id'], feature['feature_id'])] = feature_data.get('mz', 0)
+            table_row = features_table.row(feature['dataset_id'], feature['feature_id'])
+            feature_mzs[(comm_id, feature['dataset_id'], feature['feature_id'])] = float(features_table.mz[table_row])
     
     return aligned_features, feature_mzs
 
@@ -340,7 +536,11 @@ def detect_cliques(G, min_size=3):
         return []
     
     # Find all cliques of size at least min_size
-    cliques = list(nx.find_cliques(G))
+    if isinstance(G, EdgeGraph):
+        cliques = [G.node_keys(clique) for clique in G.find_cliques()]
+    else:
+        import networkx as nx
+        cliques = list(nx.find_cliques(G))
     
     # Filter cliques by size
     cliques = [clique for clique in cliques if len(clique) >= min_size]
@@ -397,8 +597,8 @@ def group_features_by_clique(G, cliques):
         if clique_id not in grouped_features:
             grouped_features[clique_id] = []
         
-        # Get feature data from node attributes
-        feature_data = G.nodes[node]
+        # Get feature data from the graph's feature table
+        feature_data = node_feature(G, node)
         
         # Create a feature dictionary with all relevant information
         feature = {
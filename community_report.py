@@ -14,6 +14,7 @@ Main functions/classes:
     - create_summary_tables: Generates summary statistics tables
 
 Inputs:
+    - Result bundle (results/) of an alignment run, or graph.pkl/partition.pkl of older runs
     - TSV files from community detection alignment
     - Original feature data for detailed analysis
     - Report parameters and thresholds
@@ -34,11 +35,17 @@ import argparse
 import pandas as pd
 import networkx as nx
 from collections import defaultdict
+from feature_table import node_feature
+from result_bundle import BUNDLE_DIR_NAME, load_result_bundle
 
 def load_graph_and_partition(output_dir):
     """
     Load the graph and partition from the output directory.
     
+    The result bundle (results/) is memory-mapped and only the node table and
+    partition are read; output directories of older versions fall back to
+    graph.pkl and partition.pkl.
+    
     Parameters:
     -----------
     output_dir : str
@@ -46,11 +53,21 @@ def load_graph_and_partition(output_dir):
         
     Returns:
     --------
-    G : networkx.Graph
-        The graph
+    G : EdgeGraph or networkx.Graph
+        The graph (from the result bundle: nodes only, without edges)
     partition : dict
         Dictionary mapping node IDs to community IDs
     """
+    bundle_dir = os.path.join(output_dir, BUNDLE_DIR_NAME)
+    bundle = load_result_bundle(bundle_dir)
+    if bundle is not None:
+        print(f"Loading graph and partition from {bundle_dir}")
+        G = bundle.graph(with_edges=False)
+        partition = bundle.partition()
+        if partition is None:
+            print(f"Result bundle has no partition: {bundle_dir}")
+        return G, partition
+    
     # Try to load the graph from a pickle file if it exists
     import pickle
     graph_file = os.path.join(output_dir, "graph.pkl")
@@ -124,10 +141,10 @@ def generate_community_report(G, partition, output_file):
             f.write("-" * 50 + "\n")
             
             # Sort nodes by dataset_id and then by intensity (descending)
-            sorted_nodes = sorted(nodes, key=lambda n: (G.nodes[n].get('dataset_id', 0), -G.nodes[n].get('intensity', 0)))
+            sorted_nodes = sorted(nodes, key=lambda n: (G.nodes[n].get('dataset_id', 0), -node_feature(G, n).get('intensity', 0)))
             
             for node in sorted_nodes:
-                node_data = G.nodes[node]
+                node_data = node_feature(G, node)
                 filename = node_data.get('filename', 'Unknown')
                 if isinstance(filename, str) and os.path.basename(filename):
                     filename = os.path.basename(filename)
@@ -170,7 +187,7 @@ def generate_community_csv(G, partition, output_file):
     data = []
     for comm_id, nodes in communities.items():
         for node in nodes:
-            node_data = G.nodes[node]
+            node_data = node_feature(G, node)
             filename = node_data.get('filename', 'Unknown')
             if isinstance(filename, str) and os.path.basename(filename):
                 filename = os.path.basename(filename)
@@ -233,7 +250,7 @@ def generate_simple_community_report(G, partition, output_file):
             sorted_nodes = sorted(nodes, key=lambda n: G.nodes[n].get('dataset_id', 0))
             
             for node in sorted_nodes:
-                node_data = G.nodes[node]
+                node_data = node_feature(G, node)
                 filename = node_data.get('filename', 'Unknown')
                 if isinstance(filename, str) and os.path.basename(filename):
                     filename = os.path.basename(filename)
@@ -336,7 +353,7 @@ def generate_markdown_community_report(G, partition, output_file):
             mz_values = []
             rt_values = []
             for node in nodes:
-                node_data = G.nodes[node]
+                node_data = node_feature(G, node)
                 mz = node_data.get('mz', node_data.get('precursor_mz', None))
                 rt = node_data.get('rt', node_data.get('retention_time', None))
                 if isinstance(mz, (int, float)):
@@ -367,13 +384,13 @@ def generate_markdown_community_report(G, partition, output_file):
             for dataset_id in sorted_datasets:
                 # Sort nodes by intensity (descending)
                 sorted_nodes = sorted(nodes_by_dataset[dataset_id], 
-                                     key=lambda n: -G.nodes[n].get('intensity', 0))
+                                     key=lambda n: -node_feature(G, n).get('intensity', 0))
                 
                 # Check if this dataset has multiple features
                 has_multiple_in_dataset = len(sorted_nodes) > 1
                 
                 for i, node in enumerate(sorted_nodes):
-                    node_data = G.nodes[node]
+                    node_data = node_feature(G, node)
                     filename = node_data.get('filename', 'Unknown')
                     if isinstance(filename, str) and os.path.basename(filename):
                         filename = os.path.basename(filename)
@@ -0,0 +1,419 @@
+"""
+Module for the array-backed feature similarity graph.
+
+EdgeGraph stores the feature graph as flat edge arrays instead of a networkx
+graph. Node ids are int32 rows of the FeatureTable, and edge attributes (weight,
+edge type, cosine similarity, shared peaks) are NumPy columns. Adjacency is
+derived on demand as a CSR structure. Graph construction, multiple-connection
+cleaning, community detection and clique detection all run on it; a networkx
+copy is only built for visualization.
+
+Main functions/classes:
+    - EdgeGraph: Edge-list/CSR graph with columnar edge attributes
+    - EdgeGraph.from_pair_edges: Assembles the graph from per-dataset-pair edge arrays
+    - EdgeGraph.connected_components: Components as arrays of node ids
+    - EdgeGraph.component_edges: Edge ids inside each component
+    - EdgeGraph.find_cliques: Maximal cliques (Bron-Kerbosch with pivoting)
+    - EdgeGraph.to_networkx: Conversion for visualization and networkx-only algorithms
+
+Inputs:
+    - FeatureTable of all datasets
+    - Edge arrays from graph_construction.compare_dataset_pair
+
+Outputs:
+    - EdgeGraph; nodes are the features that had at least one edge when the graph was built
+
+Important arguments:
+    - node ids: Global FeatureTable rows; node keys "{dataset_id}_{feature_id}" are
+      only produced for output and compatibility (see node_key/node_index)
+"""
+import numpy as np
+from typing import Any, Dict, Iterator, List, Optional
+
+# Edge type codes of EdgeGraph.edge_type
+EDGE_MZ_RT = 0
+EDGE_MSMS = 1
+EDGE_TYPE_NAMES = ('mz_rt', 'msms')
+
+# Per-edge arrays of an EdgeGraph (constructor arguments, stored as-is by
+# alignment_state and result_bundle)
+EDGE_COLUMNS = ('u', 'v', 'weight', 'edge_type', 'cosine', 'shared_peaks')
+
+
+class _NodeView:
+    """
+    Read-only networkx-style view of the nodes of an EdgeGraph.
+
+    Iterates over node keys ("{dataset_id}_{feature_id}"); ``view[key]`` returns
+    the node's dataset_id and feature_id, as the attributes of a networkx graph
+    built by GraphBuilder did.
+    """
+
+    def __init__(self, graph: 'EdgeGraph'):
+        self._graph = graph
+
+    def __call__(self, data: bool = False):
+        if data:
+            return [(key, self[key]) for key in self]
+        return self
+
+    def __iter__(self) -> Iterator[str]:
+        graph = self._graph
+        return iter(graph.node_keys(graph.node_ids()))
+
+    def __len__(self) -> int:
+        return self._graph.number_of_nodes()
+
+    def __contains__(self, key) -> bool:
+        try:
+            node = self._graph.node_index(key)
+        except (ValueError, TypeError, IndexError):
+            return False
+        return 0 <= node < len(self._graph.node_mask) and bool(self._graph.node_mask[node])
+
+    def __getitem__(self, key) -> Dict[str, int]:
+        if key not in self:
+            raise KeyError(key)
+        node = self._graph.node_index(key)
+        features = self._graph.features
+        return {'dataset_id': int(features.dataset_id[node]),
+                'feature_id': int(features.feature_id[node])}
+
+
+class EdgeGraph:
+    """
+    Undirected feature graph stored as edge arrays.
+
+    Edge ``e`` connects nodes ``u[e]`` and ``v[e]`` (FeatureTable rows, u from
+    the lower dataset id). Edges keep the order in which they were added, so the
+    CSR adjacency lists neighbors in the same order as the networkx graph used
+    before.
+    """
+
+    def __init__(self, features, u, v, weight, edge_type, cosine, shared_peaks, node_mask=None):
+        """
+        Wrap existing edge arrays.
+
+        Parameters:
+        -----------
+        features : FeatureTable
+            Features of all datasets; node id = table row
+        u, v : array-like
+            Endpoints of every edge
+        weight : array-like
+            Edge weight (m/z/RT score or cosine similarity)
+        edge_type : array-like
+            EDGE_MZ_RT or EDGE_MSMS per edge
+        cosine, shared_peaks : array-like
+            MS/MS cosine similarity and shared peak count (0 for m/z/RT edges)
+        node_mask : numpy.ndarray, optional
+            Boolean mask of the rows that are graph nodes (default: rows with an edge)
+        """
+        self.features = features
+        self.graph = {'features': features}
+        self.u = np.asarray(u, dtype=np.int32)
+        self.v = np.asarray(v, dtype=np.int32)
+        self.weight = np.asarray(weight, dtype=np.float64)
+        self.edge_type = np.asarray(edge_type, dtype=np.uint8)
+        self.cosine = np.asarray(cosine, dtype=np.float64)
+        self.shared_peaks = np.asarray(shared_peaks, dtype=np.int32)
+        self.degree = np.bincount(np.concatenate((self.u, self.v)),
+                                  minlength=len(features)).astype(np.int32)
+        self.node_mask = self.degree > 0 if node_mask is None else np.asarray(node_mask, dtype=bool)
+        self._adjacency = None
+
+    @classmethod
+    def from_pair_edges(cls, features, pair_edges, base: Optional['EdgeGraph'] = None) -> 'EdgeGraph':
+        """
+        Assemble the graph from the edge arrays of each dataset pair.
+
+        Parameters:
+        -----------
+        features : FeatureTable
+            Features of all datasets
+        pair_edges : iterable
+            ((i, j), edges) with edges as returned by compare_dataset_pair, in
+            the order the edges should be added
+        base : EdgeGraph, optional
+            Graph whose edges come first (e.g. from a previous run); its node
+            ids must be rows of ``features``
+
+        Returns:
+        --------
+        graph : EdgeGraph
+        """
+        columns = {name: [] for name in EDGE_COLUMNS}
+        if base is not None:
+            for name, parts in columns.items():
+                parts.append(getattr(base, name))
+        for (i, j), edges in pair_edges:
+            columns['u'].append(edges['idx_i'] + features.dataset_offsets[i])
+            columns['v'].append(edges['idx_j'] + features.dataset_offsets[j])
+            columns['weight'].append(edges['weight'])
+            columns['edge_type'].append(np.where(edges['is_msms'], EDGE_MSMS, EDGE_MZ_RT))
+            columns['cosine'].append(edges['cosine'])
+            columns['shared_peaks'].append(edges['shared_peaks'])
+        arrays = {name: np.concatenate(parts) if parts else np.empty(0)
+                  for name, parts in columns.items()}
+        return cls(features, **arrays)
+
+    def __getstate__(self):
+        # The adjacency is a cache; rebuild it after unpickling
+        state = self.__dict__.copy()
+        state['_adjacency'] = None
+        return state
+
+    @property
+    def is_msms(self) -> np.ndarray:
+        """Boolean array, True for MS/MS edges."""
+        return self.edge_type == EDGE_MSMS
+
+    def number_of_edges(self) -> int:
+        return len(self.u)
+
+    def number_of_nodes(self) -> int:
+        return int(np.count_nonzero(self.node_mask))
+
+    def node_ids(self) -> np.ndarray:
+        """Ids of the graph's nodes, ascending."""
+        return np.flatnonzero(self.node_mask).astype(np.int32)
+
+    @property
+    def nodes(self) -> _NodeView:
+        """networkx-style node view keyed by "{dataset_id}_{feature_id}"."""
+        return _NodeView(self)
+
+    def node_key(self, node: int) -> str:
+        """Return the "{dataset_id}_{feature_id}" key of a node id."""
+        return f"{self.features.dataset_id[node]}_{self.features.feature_id[node]}"
+
+    def node_keys(self, nodes) -> List[str]:
+        """node_key() for many node ids."""
+        nodes = np.asarray(nodes, dtype=np.int64)
+        return [f"{d}_{f}" for d, f in zip(self.features.dataset_id[nodes].tolist(),
+                                           self.features.feature_id[nodes].tolist())]
+
+    def node_index(self, node) -> int:
+        """Return the node id of a node key (node ids are passed through)."""
+        if isinstance(node, (int, np.integer)):
+            return int(node)
+        dataset_id, feature_id = str(node).split('_', 1)
+        return self.features.row(int(dataset_id), int(feature_id))
+
+    def adjacency(self):
+        """
+        CSR adjacency of the graph.
+
+        Returns:
+        --------
+        indptr, neighbors, edge_ids : numpy.ndarray
+            Neighbors of node n are ``neighbors[indptr[n]:indptr[n + 1]]``,
+            connected by ``edge_ids[...]``, ordered by edge id
+        """
+        if self._adjacency is None:
+            n_edges = self.number_of_edges()
+            sources = np.concatenate((self.u, self.v))
+            targets = np.concatenate((self.v, self.u))
+            edge_ids = np.concatenate((np.arange(n_edges), np.arange(n_edges))).astype(np.int64)
+            order = np.lexsort((edge_ids, sources))
+            indptr = np.zeros(len(self.degree) + 1, dtype=np.int64)
+            np.cumsum(self.degree, out=indptr[1:])
+            self._adjacency = (indptr, targets[order], edge_ids[order])
+        return self._adjacency
+
+    def neighbors(self, node) -> np.ndarray:
+        """Neighbor ids of a node (id or key), in edge order."""
+        node = self.node_index(node)
+        indptr, neighbors, _ = self.adjacency()
+        return neighbors[indptr[node]:indptr[node + 1]]
+
+    def _edge_id(self, a, b) -> Optional[int]:
+        a, b = self.node_index(a), self.node_index(b)
+        if not (0 <= a < len(self.degree) and 0 <= b < len(self.degree)):
+            return None
+        indptr, neighbors, edge_ids = self.adjacency()
+        start = indptr[a]
+        hits = np.flatnonzero(neighbors[start:indptr[a + 1]] == b)
+        return int(edge_ids[start + hits[0]]) if len(hits) else None
+
+    def has_edge(self, a, b) -> bool:
+        return self._edge_id(a, b) is not None
+
+    def edge_attributes(self, edge: int) -> Dict[str, Any]:
+        """Attributes of one edge, with the keys used by the networkx graph."""
+        attributes = {'weight': float(self.weight[edge]),
+                      'edge_type': EDGE_TYPE_NAMES[self.edge_type[edge]]}
+        if self.edge_type[edge] == EDGE_MSMS:
+            attributes['cosine_similarity'] = float(self.cosine[edge])
+            attributes['shared_peaks'] = int(self.shared_peaks[edge])
+        return attributes
+
+    def get_edge_data(self, a, b, default=None):
+        """Attributes of the edge between two nodes (ids or keys), or default."""
+        edge = self._edge_id(a, b)
+        return default if edge is None else self.edge_attributes(edge)
+
+    def edge_subgraph(self, keep: np.ndarray) -> 'EdgeGraph':
+        """
+        New graph with the edges selected by a boolean mask (order preserved).
+
+        All nodes are kept, including those left without edges, like
+        removing edges from a networkx graph.
+        """
+        return EdgeGraph(self.features, self.u[keep], self.v[keep], self.weight[keep],
+                         self.edge_type[keep], self.cosine[keep], self.shared_peaks[keep],
+                         node_mask=self.node_mask)
+
+    def connected_components(self) -> List[np.ndarray]:
+        """
+        Connected components of the graph (nodes without edges are singletons).
+
+        Returns:
+        --------
+        components : list of numpy.ndarray
+            Node ids of each component, ascending; components are ordered by
+            their smallest node id (the order networkx reports them in)
+        """
+        labels = np.arange(len(self.degree), dtype=np.int64)
+        u, v = self.u.astype(np.int64), self.v.astype(np.int64)
+        while True:
+            # Hook the larger root under the smaller one, then compress paths
+            root_u, root_v = labels[u], labels[v]
+            differ = root_u != root_v
+            if not differ.any():
+                break
+            np.minimum.at(labels, np.maximum(root_u, root_v)[differ], np.minimum(root_u, root_v)[differ])
+            while True:
+                compressed = labels[labels]
+                if np.array_equal(compressed, labels):
+                    break
+                labels = compressed
+
+        nodes = self.node_ids()
+        node_labels = labels[nodes]
+        order = np.argsort(node_labels, kind='stable')
+        boundaries = np.flatnonzero(np.diff(node_labels[order])) + 1
+        return np.split(nodes[order], boundaries) if len(nodes) else []
+
+    def component_edges(self, components: List[np.ndarray]) -> List[np.ndarray]:
+        """
+        Ids of the edges inside each of the given components.
+
+        Parameters:
+        -----------
+        components : list of numpy.ndarray
+            Disjoint node id sets, e.g. from connected_components()
+
+        Returns:
+        --------
+        edges : list of numpy.ndarray
+            Edge ids of every component, ascending
+        """
+        component_of = np.full(len(self.degree), -1, dtype=np.int64)
+        if components:
+            sizes = [len(component) for component in components]
+            component_of[np.concatenate(components)] = np.repeat(np.arange(len(components)), sizes)
+        edge_component = component_of[self.u]
+        edges = np.flatnonzero((edge_component >= 0) & (edge_component == component_of[self.v]))
+        edges = edges[np.argsort(edge_component[edges], kind='stable')]
+        counts = np.bincount(edge_component[edges], minlength=len(components))
+        return np.split(edges, np.cumsum(counts)[:-1]) if components else []
+
+    def find_cliques(self, nodes=None) -> Iterator[List[int]]:
+        """
+        Enumerate maximal cliques (Bron-Kerbosch with pivoting).
+
+        Parameters:
+        -----------
+        nodes : array-like, optional
+            Restrict the search to the subgraph induced by these node ids
+            (e.g. one connected component); default: the whole graph
+
+        Yields:
+        -------
+        clique : list
+            Node ids of one maximal clique
+        """
+        if nodes is None:
+            nodes = self.node_ids()
+        nodes = np.asarray(nodes, dtype=np.int64)
+        if len(nodes) == 0:
+            return
+        members = set(nodes.tolist())
+        indptr, neighbors, _ = self.adjacency()
+        adjacency = {node: {neighbor for neighbor in neighbors[indptr[node]:indptr[node + 1]].tolist()
+                            if neighbor in members and neighbor != node}
+                     for node in nodes.tolist()}
+
+        candidates = set(adjacency)
+        subgraph = set(adjacency)
+        clique = [None]
+        pivot = max(subgraph, key=lambda node: len(candidates & adjacency[node]))
+        extensions = candidates - adjacency[pivot]
+        stack = []
+        while True:
+            if extensions:
+                node = extensions.pop()
+                candidates.remove(node)
+                clique[-1] = node
+                node_adjacency = adjacency[node]
+                subgraph_q = subgraph & node_adjacency
+                if not subgraph_q:
+                    yield clique[:]
+                    continue
+                candidates_q = candidates & node_adjacency
+                if candidates_q:
+                    stack.append((subgraph, candidates, extensions))
+                    clique.append(None)
+                    subgraph, candidates = subgraph_q, candidates_q
+                    pivot = max(subgraph, key=lambda node: len(candidates & adjacency[node]))
+                    extensions = candidates - adjacency[pivot]
+            else:
+                if not stack:
+                    return
+                clique.pop()
+                subgraph, candidates, extensions = stack.pop()
+
+    def to_networkx(self, nodes=None, weight_only: bool = False) -> 'nx.Graph':
+        """
+        Build a networkx copy of the graph (or of the subgraph induced by nodes).
+
+        Parameters:
+        -----------
+        nodes : array-like, optional
+            Node ids to include (default: all nodes)
+        weight_only : bool
+            If True, use integer node ids and keep only the 'weight' edge
+            attribute (enough for python-louvain); otherwise use node keys with
+            the dataset_id/feature_id and edge attributes of the former graph
+
+        Returns:
+        --------
+        G : networkx.Graph
+        """
+        import networkx as nx  # only needed for visualization and python-louvain
+
+        if nodes is None:
+            nodes = self.node_ids()
+            edges = np.arange(self.number_of_edges())
+        else:
+            nodes = np.sort(np.asarray(nodes, dtype=np.int64))
+            selected = np.zeros(len(self.degree), dtype=bool)
+            selected[nodes] = True
+            edges = np.flatnonzero(selected[self.u] & selected[self.v])
+
+        if weight_only:
+            G = nx.Graph()
+            G.add_nodes_from(nodes.tolist())
+            G.add_weighted_edges_from(zip(self.u[edges].tolist(), self.v[edges].tolist(),
+                                          self.weight[edges].tolist()))
+            return G
+
+        G = nx.Graph(features=self.features)
+        keys = self.node_keys(nodes)
+        G.add_nodes_from((key, {'dataset_id': int(d), 'feature_id': int(f)})
+                         for key, d, f in zip(keys, self.features.dataset_id[nodes].tolist(),
+                                              self.features.feature_id[nodes].tolist()))
+        G.add_edges_from((self.node_key(self.u[edge]), self.node_key(self.v[edge]),
+                          self.edge_attributes(edge)) for edge in edges.tolist())
+        return G
@@ -0,0 +1,348 @@
+"""
+Module for caching parsed input files on disk.
+
+Parsing Excel, MGF and MSP files (and their MS/MS strings) dominates the
+start-up time of repeated runs over the same inputs. This module stores the
+FeatureTable columns and the sparse spectrum arrays of each input file as an
+.npz file in a cache directory next to the inputs, keyed by the file's content
+hash, size and the parser version, so unchanged files load in milliseconds.
+
+Main functions/classes:
+    - cache_entry_path: Path of the cache entry of a file (hashes the file once)
+    - load_cached_table: Returns the cached FeatureTable of a file, or None
+    - save_cached_table: Writes the parsed FeatureTable of a file
+    - evict_cache: Removes least recently used entries above the size budget
+    - file_digest: Content hash used as part of the cache key
+    - encode_labels / decode_labels: Store FeatureTable label columns as plain arrays
+
+Inputs:
+    - Path of the input file and the name/version of the reader that parsed it
+    - The file's single-dataset FeatureTable (columns, labels and SpectrumStore;
+      a LazySpectrumStore is stored as its raw MS/MS strings)
+
+Outputs:
+    - <input_dir>/.feature_cache/<file>.<reader>.<size>-<hash>-v<version>.npz
+
+Important arguments:
+    - reader: Name of the parser ('excel', 'mgf', 'msp'), part of the cache key
+    - parser_version: Bumped whenever parsing changes; older entries become stale
+    - max_bytes: Size budget of a cache directory (default: MAX_CACHE_BYTES)
+"""
+import os
+import glob
+import json
+import hashlib
+import logging
+import numpy as np
+from typing import Any, Dict, List, Optional
+from spectral_similarity import SpectrumStore, LazySpectrumStore
+from feature_table import FeatureTable
+
+# Configure logger for this module
+logger = logging.getLogger(__name__)
+
+CACHE_DIR_NAME = ".feature_cache"
+MAX_CACHE_BYTES = int(os.environ.get("MS_ALIGN_CACHE_MAX_BYTES", 2 * 1024 ** 3))
+
+# Numeric FeatureTable columns stored as-is
+_COLUMNS = ('mz', 'rt', 'intensity')
+
+
+def file_digest(file_path: str, chunk_size: int = 1 << 20) -> str:
+    """
+    Compute the SHA-256 hex digest of a file's content.
+
+    Inputs:
+        file_path (str): File to hash
+        chunk_size (int): Read size in bytes
+
+    Outputs:
+        str: Hex digest
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _cache_dir(file_path: str) -> str:
+    return os.path.join(os.path.dirname(os.path.abspath(file_path)), CACHE_DIR_NAME)
+
+
+def _cache_prefix(file_path: str, reader: str) -> str:
+    return os.path.join(_cache_dir(file_path), f"{os.path.basename(file_path)}.{reader}.")
+
+
+def _cache_path(file_path: str, reader: str, parser_version: int) -> str:
+    size = os.path.getsize(file_path)
+    digest = file_digest(file_path)[:32]
+    return f"{_cache_prefix(file_path, reader)}{size}-{digest}-v{parser_version}.npz"
+
+
+def cache_entry_path(file_path: str, reader: str, parser_version: int) -> Optional[str]:
+    """
+    Path of the cache entry of a file, or None if the file cannot be read.
+
+    Hashes the whole file; callers that both load and save pass the result to
+    load_cached_table and save_cached_table so the file is hashed only once.
+
+    Inputs:
+        file_path (str): Input file
+        reader (str): Name of the reader that parses it
+        parser_version (int): Current parser version
+
+    Outputs:
+        Optional[str]: Path of the .npz entry (which may not exist yet)
+    """
+    try:
+        return _cache_path(file_path, reader, parser_version)
+    except OSError:
+        return None
+
+
+def _encode_column(name: str, values: List[Any], arrays: Dict[str, np.ndarray]) -> str:
+    """Store one object label column as arrays; returns its kind for the manifest."""
+    present = np.array([value is not None for value in values], dtype=bool)
+    arrays[f"{name}__present"] = present
+    sample = [value for value in values if value is not None]
+
+    if sample and all(isinstance(value, (bool, np.bool_)) for value in sample):
+        arrays[name] = np.array([bool(value) if value is not None else False for value in values])
+        return 'bool'
+    if sample and all(isinstance(value, (int, np.integer)) and not isinstance(value, (bool, np.bool_))
+                      for value in sample):
+        arrays[name] = np.array([value if value is not None else 0 for value in values], dtype=np.int64)
+        return 'int'
+    if all(isinstance(value, (int, float, np.integer, np.floating)) for value in sample):
+        arrays[name] = np.array([value if value is not None else np.nan for value in values],
+                                dtype=np.float64)
+        return 'float'
+
+    # Strings (and anything else) as one UTF-8 buffer plus offsets
+    encoded = [str(value).encode('utf-8') if value is not None else b'' for value in values]
+    lengths = np.array([len(value) for value in encoded], dtype=np.int64)
+    arrays[f"{name}__offsets"] = np.concatenate(([0], np.cumsum(lengths)))
+    arrays[f"{name}__buffer"] = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+    return 'str'
+
+
+def _decode_column(name: str, kind: str, data) -> List[Any]:
+    """Inverse of _encode_column: one Python value per feature (None if absent)."""
+    present = data[f"{name}__present"].tolist()
+    if kind == 'str':
+        offsets = data[f"{name}__offsets"].tolist()
+        buffer = data[f"{name}__buffer"].tobytes()
+        values = [buffer[offsets[k]:offsets[k + 1]].decode('utf-8') for k in range(len(present))]
+    else:
+        values = data[name].tolist()
+    return [value if flag else None for value, flag in zip(values, present)]
+
+
+def encode_labels(labels: Dict[str, np.ndarray], arrays: Dict[str, np.ndarray]) -> Dict[str, str]:
+    """
+    Add FeatureTable label columns to a dictionary of arrays for np.savez.
+
+    Inputs:
+        labels (Dict[str, np.ndarray]): Label columns of a FeatureTable
+        arrays (Dict[str, np.ndarray]): Arrays to save, extended in place
+
+    Outputs:
+        Dict[str, str]: Kind of every label column, for the manifest
+    """
+    kinds = {}
+    for name, values in labels.items():
+        key = f"label__{name}"
+        if values.dtype == object:
+            kinds[name] = _encode_column(key, values.tolist(), arrays)
+        else:
+            arrays[key] = values
+            kinds[name] = 'array'
+    return kinds
+
+
+def decode_labels(kinds: Dict[str, str], data) -> Dict[str, np.ndarray]:
+    """
+    Inverse of encode_labels.
+
+    Inputs:
+        kinds (Dict[str, str]): Label kinds from the manifest
+        data: Loaded .npz file
+
+    Outputs:
+        Dict[str, np.ndarray]: Label columns
+    """
+    labels = {}
+    for name, kind in kinds.items():
+        key = f"label__{name}"
+        if kind == 'array':
+            labels[name] = data[key]
+        else:
+            labels[name] = np.array(_decode_column(key, kind, data), dtype=object)
+    return labels
+
+
+def load_cached_table(file_path: str, reader: str, parser_version: int,
+                      cache_path: Optional[str] = None) -> Optional[FeatureTable]:
+    """
+    Load the parsed feature table of a file from the cache.
+
+    Inputs:
+        file_path (str): Input file that was parsed
+        reader (str): Name of the reader that parsed it
+        parser_version (int): Current parser version
+        cache_path (Optional[str]): Entry path from cache_entry_path (computed if omitted)
+
+    Outputs:
+        Optional[FeatureTable]: Single-dataset table of the file, or None on a cache miss
+    """
+    if cache_path is None:
+        cache_path = cache_entry_path(file_path, reader, parser_version)
+    if cache_path is None or not os.path.exists(cache_path):
+        return None
+
+    try:
+        with np.load(cache_path, allow_pickle=False) as data:
+            manifest = json.loads(str(data['__manifest__']))
+            labels = decode_labels(manifest['labels'], data)
+            if 'lazy_spectra' in manifest:
+                store = LazySpectrumStore(data['spectra_buffer'], data['spectra_offsets'],
+                                          data['spectra_has_msms'], **manifest['lazy_spectra'])
+            else:
+                store = SpectrumStore(data['spectra_indptr'], data['spectra_mz_bin'],
+                                      data['spectra_intensity'])
+            table = FeatureTable.from_columns(file_path, data['mz'], data['rt'], data['intensity'],
+                                              store, labels)
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable cache entry {cache_path}: {e}")
+        _remove(cache_path)
+        return None
+
+    # Touch the entry so eviction treats it as recently used; this is only an
+    # LRU hint, so a read-only or foreign cache entry must not fail the load
+    try:
+        os.utime(cache_path)
+    except OSError:
+        pass
+    logger.info(f"Loaded {len(table)} cached features for {os.path.basename(file_path)}")
+    return table
+
+
+def save_cached_table(file_path: str, reader: str, parser_version: int, table: FeatureTable,
+                      max_bytes: int = MAX_CACHE_BYTES, cache_path: Optional[str] = None) -> Optional[str]:
+    """
+    Write the parsed feature table of a file to the cache.
+
+    Older entries for the same file and reader (other content or parser
+    version) are removed, then the cache directory is trimmed to max_bytes.
+
+    Inputs:
+        file_path (str): Input file that was parsed
+        reader (str): Name of the reader that parsed it
+        parser_version (int): Current parser version
+        table (FeatureTable): Single-dataset table of the file
+        max_bytes (int): Size budget of the cache directory
+        cache_path (Optional[str]): Entry path from cache_entry_path (computed if omitted)
+
+    Outputs:
+        Optional[str]: Path of the cache entry, or None if it could not be written
+    """
+    store = table.spectra[0]
+    if isinstance(store, LazySpectrumStore):
+        # Keep the raw MS/MS strings so cached tables decode spectra on demand too
+        arrays = {
+            'spectra_buffer': store.buffer,
+            'spectra_offsets': store.offsets,
+            'spectra_has_msms': store.has_msms,
+        }
+    else:
+        arrays = {
+            'spectra_indptr': store.indptr,
+            'spectra_mz_bin': store.mz_bin,
+            'spectra_intensity': store.intensity,
+        }
+    for name in _COLUMNS:
+        arrays[name] = getattr(table, name)
+
+    kinds = encode_labels(table.labels, arrays)
+    manifest = {
+        'source': os.path.basename(file_path),
+        'reader': reader,
+        'parser_version': parser_version,
+        'n_features': len(table),
+        'labels': kinds,
+    }
+    if isinstance(store, LazySpectrumStore):
+        manifest['lazy_spectra'] = {'max_mz': store.max_mz, 'min_intensity': store.min_intensity}
+    arrays['__manifest__'] = np.array(json.dumps(manifest))
+
+    if cache_path is None:
+        cache_path = cache_entry_path(file_path, reader, parser_version)
+    if cache_path is None:
+        return None
+
+    # Parallel ingest writes into the same directory; the per-process temporary
+    # name does not match the *.npz globs of the stale-entry cleanup and eviction
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+
+        # Drop stale entries of this file before adding the new one
+        for stale in glob.glob(glob.escape(_cache_prefix(file_path, reader)) + "*.npz"):
+            if stale != cache_path:
+                _remove(stale)
+
+        # Written through a handle, so np.savez does not append ".npz"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        logger.warning(f"Could not write feature cache for {file_path}: {e}")
+        _remove(tmp_path)
+        return None
+
+    evict_cache(os.path.dirname(cache_path), max_bytes=max_bytes, keep=cache_path)
+    return cache_path
+
+
+def evict_cache(cache_dir: str, max_bytes: int = MAX_CACHE_BYTES, keep: Optional[str] = None) -> int:
+    """
+    Remove least recently used cache entries until the directory fits max_bytes.
+
+    Inputs:
+        cache_dir (str): Cache directory
+        max_bytes (int): Size budget in bytes
+        keep (Optional[str]): Entry that must not be evicted (e.g. the one just written)
+
+    Outputs:
+        int: Number of entries removed
+    """
+    entries = []
+    for path in glob.glob(os.path.join(cache_dir, "*.npz")):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        if path == keep:
+            continue
+        _remove(path)
+        total -= size
+        removed += 1
+
+    if removed:
+        logger.info(f"Evicted {removed} feature cache entries from {cache_dir}")
+    return removed
+
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,331 @@
+"""
+Module for storing mass features as contiguous NumPy columns.
+
+A FeatureTable holds the features of one or more datasets in typed columns
+indexed by integer dataset and feature ids, instead of one Python dictionary
+per feature plus a copy of its fields in the graph's node attributes. Readers
+produce one table per input file, the tables of all files are concatenated
+once, and graph construction, alignment output and reports all read the same
+arrays.
+
+Main functions/classes:
+    - FeatureTable: Column store for the features of one or more datasets
+    - node_feature: Returns the feature fields (mz, rt, intensity, filename, ...) of a graph node
+
+Inputs:
+    - Parsed columns of an input file (see read_files) or lists of feature dictionaries
+
+Outputs:
+    - FeatureTable with dataset_id, feature_id, mz, rt, intensity and has_msms columns,
+      optional label columns (peak_id, scan, title, ...) and one SpectrumStore per dataset
+
+Important arguments:
+    - dataset_id / feature_id: Integer ids; row = dataset_offsets[dataset_id] + feature_id
+"""
+import os
+import numpy as np
+from typing import Any, Dict, Iterable, List, Optional
+from spectral_similarity import SpectrumStore, spectrum_store_for
+
+# Feature dictionary keys that are stored as dedicated columns or in the spectrum store
+_CORE_KEYS = ('mz', 'rt', 'intensity')
+_SPECTRUM_KEYS = ('msms_store', 'msms_index', 'has_msms', 'ms2', 'msms', 'MSMS spectrum',
+                  'fragment_spectrum')
+
+
+def _label_array(values: List[Any]) -> np.ndarray:
+    """Store a label column compactly: numeric dtype if possible, object otherwise."""
+    sample = [value for value in values if value is not None]
+    if sample and all(isinstance(value, (int, np.integer)) and not isinstance(value, (bool, np.bool_))
+                      for value in sample) and len(sample) == len(values):
+        return np.array(values, dtype=np.int64)
+    if sample and all(isinstance(value, (float, np.floating)) for value in sample):
+        return np.array([np.nan if value is None else value for value in values], dtype=np.float64)
+    return np.array(values, dtype=object)
+
+
+class FeatureTable:
+    """
+    Columnar table of mass features from one or more datasets.
+
+    The features of dataset ``d`` occupy rows
+    ``dataset_offsets[d]:dataset_offsets[d + 1]``, in file order, so a feature
+    is addressed either by its global row or by (dataset_id, feature_id).
+    Spectra stay in one SpectrumStore per dataset (row k = feature k).
+    """
+
+    def __init__(self, filenames: List[str], dataset_offsets: np.ndarray,
+                 mz: np.ndarray, rt: np.ndarray, intensity: np.ndarray,
+                 spectra: List[SpectrumStore], labels: Optional[Dict[str, np.ndarray]] = None):
+        """
+        Wrap existing columns.
+
+        Parameters:
+        -----------
+        filenames : list
+            Source file of every dataset
+        dataset_offsets : numpy.ndarray
+            First row of every dataset, length n_datasets + 1
+        mz, rt, intensity : numpy.ndarray
+            Feature columns, one entry per row
+        spectra : list
+            One SpectrumStore per dataset
+        labels : dict, optional
+            Extra per-row columns such as 'peak_id' or 'title'
+        """
+        self.filenames = list(filenames)
+        self.dataset_offsets = np.asarray(dataset_offsets, dtype=np.int64)
+        self.mz = np.asarray(mz, dtype=np.float64)
+        self.rt = np.asarray(rt, dtype=np.float64)
+        # Integer intensities (e.g. peak heights) keep their dtype so output matches the input
+        intensity = np.asarray(intensity)
+        self.intensity = intensity if intensity.dtype.kind in 'iuf' else intensity.astype(np.float64)
+        self.spectra = list(spectra)
+        self.labels = dict(labels or {})
+
+        sizes = np.diff(self.dataset_offsets)
+        self.dataset_id = np.repeat(np.arange(len(sizes), dtype=np.int32), sizes)
+        self.feature_id = (np.arange(len(self.mz), dtype=np.int64)
+                           - self.dataset_offsets[:-1][self.dataset_id]).astype(np.int32)
+        if self.spectra:
+            self.has_msms = np.concatenate([store.has_msms for store in self.spectra])
+        else:
+            self.has_msms = np.zeros(0, dtype=bool)
+
+    @classmethod
+    def from_columns(cls, filename: str, mz, rt, intensity,
+                     spectra: Optional[SpectrumStore] = None,
+                     labels: Optional[Dict[str, Any]] = None) -> 'FeatureTable':
+        """
+        Build a single-dataset table from column arrays.
+
+        Parameters:
+        -----------
+        filename : str
+            Source file of the dataset
+        mz, rt, intensity : array-like
+            Feature columns
+        spectra : SpectrumStore, optional
+            Spectra of the features (default: no MS/MS)
+        labels : dict, optional
+            Extra per-feature columns
+
+        Returns:
+        --------
+        table : FeatureTable
+        """
+        mz = np.asarray(mz, dtype=np.float64)
+        if spectra is None:
+            spectra = SpectrumStore.empty(len(mz))
+        labels = {name: values if isinstance(values, np.ndarray) else _label_array(list(values))
+                  for name, values in (labels or {}).items()}
+        return cls([filename], [0, len(mz)], mz, rt, intensity, [spectra], labels)
+
+    @classmethod
+    def from_features(cls, features: List[Dict[str, Any]], filename: str = '',
+                      spectra: Optional[SpectrumStore] = None) -> 'FeatureTable':
+        """
+        Build a single-dataset table from feature dictionaries.
+
+        Parameters:
+        -----------
+        features : list
+            Feature dictionaries of one dataset
+        filename : str
+            Source file of the dataset
+        spectra : SpectrumStore, optional
+            Spectra of the features (default: taken from their 'msms_store' references)
+
+        Returns:
+        --------
+        table : FeatureTable
+        """
+        names = []
+        for feature in features:
+            for name in feature:
+                if name not in _CORE_KEYS and name not in _SPECTRUM_KEYS and name not in names:
+                    names.append(name)
+
+        def column(key):
+            return np.array([feature.get(key, 0) for feature in features], dtype=np.float64)
+
+        labels = {name: [feature.get(name) for feature in features] for name in names}
+        if spectra is None:
+            spectra = spectrum_store_for(features)
+        return cls.from_columns(filename, column('mz'), column('rt'), column('intensity'),
+                                spectra, labels)
+
+    @classmethod
+    def concat(cls, tables: Iterable['FeatureTable']) -> 'FeatureTable':
+        """
+        Stack tables into one, renumbering datasets in the given order.
+
+        Label columns missing from some tables are filled with None.
+
+        Parameters:
+        -----------
+        tables : iterable of FeatureTable
+
+        Returns:
+        --------
+        table : FeatureTable
+        """
+        tables = list(tables)
+        offsets = [0]
+        for table in tables:
+            for d in range(table.n_datasets):
+                offsets.append(offsets[-1] + table.dataset_size(d))
+
+        names = []
+        for table in tables:
+            names.extend(name for name in table.labels if name not in names)
+        labels = {}
+        for name in names:
+            parts = [table.labels[name] if name in table.labels
+                     else np.full(len(table), None, dtype=object) for table in tables]
+            kinds = {part.dtype.kind for part in parts}
+            labels[name] = np.concatenate(parts) if len(kinds) == 1 else \
+                np.concatenate([part.astype(object) for part in parts])
+
+        def stack(attribute, dtype):
+            parts = [getattr(table, attribute) for table in tables]
+            return np.concatenate(parts) if parts else np.empty(0, dtype=dtype)
+
+        return cls([filename for table in tables for filename in table.filenames],
+                   np.array(offsets, dtype=np.int64),
+                   stack('mz', np.float64), stack('rt', np.float64), stack('intensity', np.float64),
+                   [store for table in tables for store in table.spectra], labels)
+
+    def __len__(self) -> int:
+        return len(self.mz)
+
+    @property
+    def n_datasets(self) -> int:
+        """Number of datasets in the table."""
+        return len(self.dataset_offsets) - 1
+
+    @property
+    def nbytes(self) -> int:
+        """Memory used by the numeric columns in bytes (spectra and object labels excluded)."""
+        columns = [self.dataset_offsets, self.mz, self.rt, self.intensity, self.has_msms,
+                   self.dataset_id, self.feature_id]
+        columns.extend(values for values in self.labels.values() if values.dtype != object)
+        return sum(column.nbytes for column in columns)
+
+    def dataset_size(self, dataset_id: int) -> int:
+        """Number of features in one dataset."""
+        return int(self.dataset_offsets[dataset_id + 1] - self.dataset_offsets[dataset_id])
+
+    def dataset_slice(self, dataset_id: int) -> slice:
+        """Row range of one dataset."""
+        return slice(int(self.dataset_offsets[dataset_id]), int(self.dataset_offsets[dataset_id + 1]))
+
+    def dataset(self, dataset_id: int) -> 'FeatureTable':
+        """Single-dataset table viewing the rows of one dataset."""
+        rows = self.dataset_slice(dataset_id)
+        return FeatureTable([self.filenames[dataset_id]], [0, rows.stop - rows.start],
+                            self.mz[rows], self.rt[rows], self.intensity[rows],
+                            [self.spectra[dataset_id]],
+                            {name: values[rows] for name, values in self.labels.items()})
+
+    def basename(self, dataset_id: int) -> str:
+        """File name (without directory) of one dataset."""
+        return os.path.basename(self.filenames[dataset_id])
+
+    def row(self, dataset_id: int, feature_id: int) -> int:
+        """Global row of a (dataset_id, feature_id) feature."""
+        return int(self.dataset_offsets[dataset_id]) + int(feature_id)
+
+    def rows(self, dataset_ids, feature_ids) -> np.ndarray:
+        """Vectorized row(): global rows of many (dataset_id, feature_id) pairs."""
+        return self.dataset_offsets[np.asarray(dataset_ids, dtype=np.int64)] + \
+            np.asarray(feature_ids, dtype=np.int64)
+
+    def record(self, row: int) -> Dict[str, Any]:
+        """
+        Return one feature as a dictionary of Python values.
+
+        Parameters:
+        -----------
+        row : int
+            Global row
+
+        Returns:
+        --------
+        feature : dict
+            dataset_id, feature_id, mz, rt, intensity, has_msms, filename and label fields
+        """
+        dataset_id = int(self.dataset_id[row])
+        feature = {
+            'dataset_id': dataset_id,
+            'feature_id': int(self.feature_id[row]),
+            'mz': float(self.mz[row]),
+            'rt': float(self.rt[row]),
+            'intensity': self.intensity[row].item(),
+            'has_msms': bool(self.has_msms[row]),
+            'filename': self.basename(dataset_id),
+        }
+        for name, values in self.labels.items():
+            value = values[row]
+            feature[name] = value.item() if isinstance(value, np.generic) else value
+        return feature
+
+    def records(self, dataset_id: int = 0) -> List[Dict[str, Any]]:
+        """
+        Expand one dataset into the feature dictionaries returned by the list readers.
+
+        Parameters:
+        -----------
+        dataset_id : int
+            Dataset to expand (default: 0)
+
+        Returns:
+        --------
+        features : list
+            One dictionary per feature with label fields, mz, rt, intensity and
+            'msms_store'/'msms_index'/'has_msms' referencing the dataset's spectra
+        """
+        rows = self.dataset_slice(dataset_id)
+        store = self.spectra[dataset_id]
+        labels = {name: values[rows].tolist() for name, values in self.labels.items()}
+        columns = {'mz': self.mz[rows].tolist(), 'rt': self.rt[rows].tolist(),
+                   'intensity': self.intensity[rows].tolist()}
+
+        features = []
+        for index, flag in enumerate(self.has_msms[rows].tolist()):
+            feature = {name: values[index] for name, values in labels.items()
+                       if values[index] is not None}
+            for name, values in columns.items():
+                feature[name] = values[index]
+            feature['msms_store'] = store
+            feature['msms_index'] = index
+            feature['has_msms'] = flag
+            features.append(feature)
+        return features
+
+
+def node_feature(G, node) -> Dict[str, Any]:
+    """
+    Return the feature fields of a graph node.
+
+    Graphs built by GraphBuilder keep only dataset_id/feature_id on the nodes
+    and the FeatureTable in ``G.graph['features']``; older graphs (e.g. loaded
+    from a pickle) still carry the fields as node attributes.
+
+    Parameters:
+    -----------
+    G : networkx.Graph
+        Feature graph
+    node : str
+        Node ID
+
+    Returns:
+    --------
+    feature : dict
+        dataset_id, feature_id, mz, rt, intensity, has_msms, filename, ...
+    """
+    attributes = G.nodes[node]
+    table = G.graph.get('features')
+    if table is None or 'dataset_id' not in attributes:
+        return attributes
+    return table.record(table.row(attributes['dataset_id'], attributes['feature_id']))
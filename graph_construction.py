@@ -3,43 +3,434 @@ Module for constructing similarity graphs from mass spectrometry features.
 
 This module builds a graph where nodes represent mass features and edges
 represent similarity relationships between features from different datasets.
-It uses KD-trees for efficient similarity searching based on m/z and retention
-time tolerances.
+Candidate pairs are generated with a sorted m/z sweep, so only features inside
+the m/z and retention time tolerance windows are ever compared.
 
 Main functions/classes:
+    - find_candidate_pairs: Returns index pairs within m/z and RT tolerance
+    - dataset_columns: Extracts the m/z, RT, MS/MS flag and spectrum columns of a dataset
+    - candidate_pairs: Candidate pairs of one dataset pair with their differences and cosine scores
+    - select_pair_edges: Accepted edges of a dataset pair from its candidate pairs
+    - compare_dataset_pair: Computes the edges of one dataset pair as compact arrays
+    - best_connection_mask: Keep-mask with the best edge per (node, neighbor dataset)
     - GraphBuilder: Main class for constructing feature similarity graphs
     - build_graph: Creates graph with nodes and edges based on feature similarity
     - clean_multiple_connections: Resolves ambiguous connections between datasets
 
 Inputs:
-    - List of features from multiple datasets (with mz, rt, intensity values)
+    - FeatureTable with the features of all datasets (mz, rt, intensity columns)
     - mz_tolerance: Tolerance for m/z matching in Daltons
     - rt_tolerance: Tolerance for retention time matching in minutes
 
 Outputs:
-    - NetworkX graph with features as nodes and similarities as weighted edges
+    - EdgeGraph (edge arrays, see edge_graph) with features as nodes and similarities as weighted edges
     - Edge weights based on combined m/z and RT similarity scores
 
 Important arguments:
-    - features: List of feature dictionaries from read_files module
+    - features: FeatureTable from the read_files module
     - mz_tolerance: Maximum allowed m/z difference (default: 0.01 Da)
     - rt_tolerance: Maximum allowed RT difference (default: 0.5 min)
+    - workers: Number of processes used for dataset-pair comparisons (default: 1)
+    - cosine_cache_size: Spectrum pairs kept in the per-process cosine cache (default: COSINE_CACHE_SIZE)
 """
 from typing import List, Dict
-import networkx as nx
 import numpy as np
-from scipy.spatial import KDTree
-import pandas as pd
-from tqdm import tqdm
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 import random
-import os
 import logging
-from spectral_similarity import calculate_spectral_similarity, has_msms_data
+from spectral_similarity import batch_cosine_similarity, CosineCache, COSINE_CACHE_SIZE
+from feature_table import node_feature
+from edge_graph import EdgeGraph
 
 # Configure logger for this module
 logger = logging.getLogger(__name__)
 
+# Upper bound on the number of m/z-window candidates expanded at once
+CANDIDATE_BLOCK_SIZE = 2_000_000
+
+
+def dataset_columns(table):
+    """
+    Extract the columns used for edge creation from a dataset's feature table.
+    
+    Parameters:
+    -----------
+    table : FeatureTable
+        Single-dataset feature table (e.g. from read_feature_table)
+        
+    Returns:
+    --------
+    columns : dict
+        'mz' and 'rt' float64 arrays, the 'mz_order' sort index used by the
+        candidate search, 'has_msms' boolean array and the dataset's
+        'spectra' SpectrumStore (row k = feature k)
+    """
+    return {
+        'mz': table.mz,
+        'mz_order': np.argsort(table.mz, kind='stable'),
+        'rt': table.rt,
+        'has_msms': table.has_msms,
+        'spectra': table.spectra[0],
+    }
+
+
+def find_candidate_pairs(mz_a, rt_a, mz_b, rt_b, mz_tolerance, rt_tolerance, order_b=None):
+    """
+    Find all feature pairs between two datasets within m/z and RT tolerance.
+    
+    Dataset B is sorted by m/z once and every feature of dataset A looks up its
+    m/z window with a binary search, so the cost is O((N + M) log M + K) for K
+    candidates instead of O(N * M). The window is padded slightly and then
+    re-checked with the exact ``abs(diff) <= tolerance`` test used before, so the
+    returned pairs are identical to a brute-force comparison.
+    
+    Parameters:
+    -----------
+    mz_a, rt_a : array-like
+        m/z and RT values of dataset A
+    mz_b, rt_b : array-like
+        m/z and RT values of dataset B
+    mz_tolerance : float
+        Maximum allowed m/z difference (in Da)
+    rt_tolerance : float
+        Maximum allowed RT difference (in minutes)
+    order_b : numpy.ndarray, optional
+        Precomputed ``argsort`` of mz_b (see dataset_columns)
+        
+    Returns:
+    --------
+    idx_a, idx_b : numpy.ndarray
+        Feature indices of the matching pairs, sorted by (idx_a, idx_b)
+    """
+    mz_a = np.asarray(mz_a, dtype=np.float64)
+    rt_a = np.asarray(rt_a, dtype=np.float64)
+    mz_b = np.asarray(mz_b, dtype=np.float64)
+    rt_b = np.asarray(rt_b, dtype=np.float64)
+    
+    empty = np.empty(0, dtype=np.int64)
+    if len(mz_a) == 0 or len(mz_b) == 0:
+        return empty, empty
+    
+    if order_b is None:
+        order_b = np.argsort(mz_b, kind='stable')
+    sorted_mz_b = mz_b[order_b]
+    
+    # Pad the search window so rounding in mz +/- tol never drops a pair
+    pad = mz_tolerance + 1e-9 * max(1.0, mz_tolerance)
+    lo = np.searchsorted(sorted_mz_b, mz_a - pad, side='left')
+    hi = np.searchsorted(sorted_mz_b, mz_a + pad, side='right')
+    counts = np.maximum(hi - lo, 0)
+    
+    blocks_a, blocks_b = [], []
+    start = 0
+    cumulative = np.cumsum(counts)
+    while start < len(mz_a):
+        # Expand at most CANDIDATE_BLOCK_SIZE window entries at a time
+        base = cumulative[start - 1] if start > 0 else 0
+        stop = int(np.searchsorted(cumulative, base + CANDIDATE_BLOCK_SIZE, side='right'))
+        stop = max(stop, start + 1)
+        
+        block_counts = counts[start:stop]
+        total = int(block_counts.sum())
+        if total > 0:
+            idx_a = np.repeat(np.arange(start, stop), block_counts)
+            offsets = np.repeat(np.cumsum(block_counts) - block_counts, block_counts)
+            positions = np.repeat(lo[start:stop], block_counts) + (np.arange(total) - offsets)
+            idx_b = order_b[positions]
+            
+            # Exact tolerance gate (same test as the pairwise comparison)
+            keep = ((np.abs(mz_a[idx_a] - mz_b[idx_b]) <= mz_tolerance) &
+                    (np.abs(rt_a[idx_a] - rt_b[idx_b]) <= rt_tolerance))
+            blocks_a.append(idx_a[keep])
+            blocks_b.append(idx_b[keep])
+        start = stop
+    
+    if not blocks_a:
+        return empty, empty
+    
+    idx_a = np.concatenate(blocks_a).astype(np.int64, copy=False)
+    idx_b = np.concatenate(blocks_b).astype(np.int64, copy=False)
+    
+    # Restore the (feature_i, feature_j) order of the nested-loop comparison
+    order = np.lexsort((idx_b, idx_a))
+    return idx_a[order], idx_b[order]
+
+def candidate_pairs(columns_i, columns_j, settings):
+    """
+    Find the candidate pairs of two datasets and score the MS/MS ones.
+    
+    First half of compare_dataset_pair: every pair inside the m/z and RT
+    windows is returned, with its m/z and RT differences and, for pairs where
+    both features have MS/MS, the cosine score and shared peak count.
+    Rejected MS/MS pairs are kept, so select_pair_edges can derive the edges
+    of any tighter setting without repeating the search (see parameter_sweep).
+    
+    Parameters:
+    -----------
+    columns_i, columns_j : dict
+        Dataset columns from dataset_columns. An optional 'spectrum_rows' array
+        maps features to rows of 'spectra' when they differ (see reference_alignment)
+    settings : dict
+        mz_tolerance, rt_tolerance and min_shared_peaks; an optional
+        cosine_cache_size > 0 scores MS/MS pairs through the cache of this
+        process (see cosine_cache)
+        
+    Returns:
+    --------
+    candidates : dict
+        'idx_i', 'idx_j' (feature indices), 'mz_diff', 'rt_diff', 'is_msms',
+        'cosine' and 'shared_peaks' arrays (one entry per candidate pair) and
+        the 'cosine_cache_hits' and 'cosine_cache_misses' counts
+    """
+    mz_tolerance = settings['mz_tolerance']
+    rt_tolerance = settings['rt_tolerance']
+    
+    # Step 1: Apply m/z and RT gate (same for both cases)
+    mz_i, rt_i = columns_i['mz'], columns_i['rt']
+    mz_j, rt_j = columns_j['mz'], columns_j['rt']
+    cand_i, cand_j = find_candidate_pairs(mz_i, rt_i, mz_j, rt_j, mz_tolerance, rt_tolerance,
+                                          order_b=columns_j['mz_order'])
+    
+    # Step 2: Determine which case applies
+    is_msms = columns_i['has_msms'][cand_i] & columns_j['has_msms'][cand_j]
+    
+    # Case 2: MS/MS available - score every pair where both features have spectra
+    cosines = np.zeros(len(cand_i), dtype=np.float64)
+    shared = np.zeros(len(cand_i), dtype=np.int32)
+    msms_pairs = np.flatnonzero(is_msms)
+    spectra_i, spectra_j = cand_i[msms_pairs], cand_j[msms_pairs]
+    if 'spectrum_rows' in columns_i:
+        spectra_i = columns_i['spectrum_rows'][spectra_i]
+    if 'spectrum_rows' in columns_j:
+        spectra_j = columns_j['spectrum_rows'][spectra_j]
+    # A lazily decoded MS/MS string may hold no valid peak; such features
+    # have no MS/MS after all and keep the m/z/RT weight (case 1)
+    decoded = (columns_i['spectra'].peak_counts(spectra_i) > 0) & \
+        (columns_j['spectra'].peak_counts(spectra_j) > 0)
+    if not decoded.all():
+        is_msms[msms_pairs[~decoded]] = False
+        msms_pairs, spectra_i, spectra_j = msms_pairs[decoded], spectra_i[decoded], spectra_j[decoded]
+    cache = cosine_cache(settings.get('cosine_cache_size', 0))
+    hits, misses = (cache.hits, cache.misses) if cache is not None else (0, 0)
+    scores, shared_counts = batch_cosine_similarity(
+        columns_i['spectra'], spectra_i,
+        columns_j['spectra'], spectra_j,
+        settings['min_shared_peaks'], cache
+    )
+    cosines[msms_pairs] = scores
+    shared[msms_pairs] = shared_counts
+    
+    return {
+        'idx_i': cand_i,
+        'idx_j': cand_j,
+        'mz_diff': np.abs(mz_i[cand_i] - mz_j[cand_j]),
+        'rt_diff': np.abs(rt_i[cand_i] - rt_j[cand_j]),
+        'is_msms': is_msms,
+        'cosine': cosines,
+        'shared_peaks': shared,
+        'cosine_cache_hits': cache.hits - hits if cache is not None else 0,
+        'cosine_cache_misses': cache.misses - misses if cache is not None else 0,
+    }
+
+
+def select_pair_edges(candidates, settings):
+    """
+    Select the accepted edges of a dataset pair from its candidate pairs.
+    
+    Second half of compare_dataset_pair. The settings may be tighter than the
+    ones the candidates were computed with: pairs outside the m/z or RT
+    tolerance are dropped, and MS/MS pairs with fewer than min_shared_peaks
+    shared peaks score 0.0, exactly as if they had been scored with it.
+    
+    Parameters:
+    -----------
+    candidates : dict
+        Candidate pairs from candidate_pairs
+    settings : dict
+        mz_tolerance, rt_tolerance, cosine_threshold and min_shared_peaks
+        
+    Returns:
+    --------
+    edges : dict
+        'idx_i', 'idx_j' (feature indices), 'weight', 'is_msms', 'cosine',
+        'shared_peaks' arrays (one entry per edge) and the 'msms_rejected',
+        'candidate_pairs', 'msms_candidates' and 'cosine_evaluations' counts
+    """
+    mz_tolerance = settings['mz_tolerance']
+    rt_tolerance = settings['rt_tolerance']
+    min_shared_peaks = settings['min_shared_peaks']
+    
+    # Tighter windows: the same exact tolerance test as find_candidate_pairs
+    window = np.flatnonzero((candidates['mz_diff'] <= mz_tolerance) &
+                            (candidates['rt_diff'] <= rt_tolerance))
+    cand_i, cand_j = candidates['idx_i'][window], candidates['idx_j'][window]
+    mz_diff, rt_diff = candidates['mz_diff'][window], candidates['rt_diff'][window]
+    is_msms = candidates['is_msms'][window]
+    shared = candidates['shared_peaks'][window]
+    
+    # Case 1: No MS/MS - use m/z/RT weight (current behavior)
+    weights = 1.0 - (mz_diff / mz_tolerance + rt_diff / rt_tolerance) / 2.0
+    
+    # Case 2: MS/MS available - use cosine similarity as weight
+    cosines = np.where(shared >= min_shared_peaks, candidates['cosine'][window], 0.0)
+    msms_pairs = np.flatnonzero(is_msms)
+    scores = cosines[msms_pairs]
+    weights[msms_pairs] = scores
+    
+    # Only keep MS/MS edges with a positive score above the threshold
+    accepted = (scores > 0) & (scores >= settings['cosine_threshold'])
+    keep = ~is_msms
+    keep[msms_pairs[accepted]] = True
+    
+    return {
+        'idx_i': cand_i[keep].astype(np.int32),
+        'idx_j': cand_j[keep].astype(np.int32),
+        'weight': weights[keep],
+        'is_msms': is_msms[keep],
+        'cosine': cosines[keep],
+        'shared_peaks': shared[keep],
+        'msms_rejected': int(len(scores) - accepted.sum()),
+        'candidate_pairs': len(cand_i),
+        'msms_candidates': len(msms_pairs),
+        # Pairs that passed the shared-peak prefilter of batch_cosine_similarity
+        'cosine_evaluations': int(np.count_nonzero(shared[msms_pairs] >= max(min_shared_peaks, 1))),
+    }
+
+
+def compare_dataset_pair(columns_i, columns_j, settings):
+    """
+    Compare two datasets and return the accepted edges as compact arrays.
+    
+    This is the unit of work handed to the process pool: it only needs the
+    columns of the two datasets involved and returns plain NumPy arrays, so
+    results are cheap to send back to the parent and can be merged in a fixed
+    order. All MS/MS candidate pairs are scored with one
+    batch_cosine_similarity call (see candidate_pairs and select_pair_edges).
+    
+    Parameters:
+    -----------
+    columns_i, columns_j : dict
+        Dataset columns from dataset_columns. An optional 'spectrum_rows' array
+        maps features to rows of 'spectra' when they differ (see reference_alignment)
+    settings : dict
+        mz_tolerance, rt_tolerance, cosine_threshold and min_shared_peaks; an
+        optional cosine_cache_size > 0 scores MS/MS pairs through the cache of
+        this process (see cosine_cache)
+        
+    Returns:
+    --------
+    edges : dict
+        'idx_i', 'idx_j' (feature indices), 'weight', 'is_msms', 'cosine',
+        'shared_peaks' arrays (one entry per edge) and the 'msms_rejected',
+        'candidate_pairs', 'msms_candidates', 'cosine_evaluations',
+        'cosine_cache_hits' and 'cosine_cache_misses' counts
+    """
+    candidates = candidate_pairs(columns_i, columns_j, settings)
+    edges = select_pair_edges(candidates, settings)
+    edges.update(cosine_cache_hits=candidates['cosine_cache_hits'],
+                 cosine_cache_misses=candidates['cosine_cache_misses'])
+    return edges
+
+
+# Per-process state for the dataset-pair worker pool
+_pair_context = {}
+
+
+def cosine_cache(max_entries):
+    """
+    Return the cosine cache of this process, or None if caching is disabled.
+    
+    Every worker process keeps its own cache across the dataset pairs it
+    compares; it is replaced when a different size is requested.
+    
+    Parameters:
+    -----------
+    max_entries : int
+        Maximum number of spectrum pairs kept (0 disables the cache)
+        
+    Returns:
+    --------
+    cache : CosineCache or None
+    """
+    if max_entries <= 0:
+        return None
+    cache = _pair_context.get('cosine_cache')
+    if cache is None or cache.max_entries != max_entries:
+        cache = _pair_context['cosine_cache'] = CosineCache(max_entries)
+    return cache
+
+
+def best_connection_mask(u, v, weight, is_msms, dataset_id):
+    """
+    Select the best edge of every (node, neighbor dataset) group in one pass.
+    
+    Every edge belongs to two groups, (u, dataset of v) and (v, dataset of u).
+    Within a group MS/MS edges rank before m/z/RT edges, then by weight, and the
+    lower edge id wins ties. An edge is kept only if it is the best edge of both
+    of its groups, so the result does not depend on the order nodes are visited
+    and every node keeps at most one edge to each other dataset.
+    
+    Parameters:
+    -----------
+    u, v : numpy.ndarray
+        Endpoints of every edge (node ids)
+    weight : numpy.ndarray
+        Edge weights
+    is_msms : numpy.ndarray
+        True for MS/MS edges
+    dataset_id : numpy.ndarray
+        Dataset of every node id
+        
+    Returns:
+    --------
+    keep : numpy.ndarray
+        Boolean mask, True for the edges to keep
+    stats : dict
+        'multiple_connections' (groups with more than one edge), 'msms_preferred'
+        and 'mz_rt_kept' (how those groups were resolved), 'edges_removed'
+    """
+    n_edges = len(u)
+    edge = np.concatenate((np.arange(n_edges), np.arange(n_edges)))
+    node = np.concatenate((u, v)).astype(np.int64)
+    neighbor_dataset = np.asarray(dataset_id)[np.concatenate((v, u))].astype(np.int64)
+    
+    # Sort by group, then best edge first: MS/MS, highest weight, lowest edge id
+    order = np.lexsort((edge, -weight[edge], ~is_msms[edge], neighbor_dataset, node))
+    node, neighbor_dataset = node[order], neighbor_dataset[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = (node[1:] != node[:-1]) | (neighbor_dataset[1:] != neighbor_dataset[:-1])
+    
+    is_best = np.zeros(2 * n_edges, dtype=bool)
+    is_best[order[first]] = True
+    keep = is_best[:n_edges] & is_best[n_edges:]
+    
+    starts = np.flatnonzero(first)
+    multiple = np.diff(np.append(starts, len(order))) > 1
+    # The first edge of a group is an MS/MS edge whenever the group has one
+    msms_first = is_msms[edge[order[starts]]] & multiple
+    stats = {
+        'multiple_connections': int(np.count_nonzero(multiple)),
+        'msms_preferred': int(np.count_nonzero(msms_first)),
+        'mz_rt_kept': int(np.count_nonzero(multiple & ~msms_first)),
+        'edges_removed': int(n_edges - np.count_nonzero(keep)),
+    }
+    return keep, stats
+
+def _init_pair_worker(datasets, settings, compare=compare_dataset_pair):
+    """Store the datasets, settings and pair function once per worker process."""
+    _pair_context['datasets'] = datasets
+    _pair_context['settings'] = settings
+    _pair_context['compare'] = compare
+
+
+def _compare_pair_task(pair):
+    """Worker entry point: compare one (i, j) dataset pair from the shared context."""
+    i, j = pair
+    datasets = _pair_context['datasets']
+    return _pair_context['compare'](datasets[i], datasets[j], _pair_context['settings'])
+
+
 class GraphBuilder:
     """
     Class for building a graph from mass spectrometry features.
@@ -47,7 +438,8 @@ class GraphBuilder:
     Nodes represent features, and edges represent similarity between features.
     """
     
-    def __init__(self, mz_tolerance=0.01, rt_tolerance=0.5, cosine_threshold=0.5, min_shared_peaks=3):
+    def __init__(self, mz_tolerance=0.01, rt_tolerance=0.5, cosine_threshold=0.5, min_shared_peaks=3,
+                 workers=1, cosine_cache_size=COSINE_CACHE_SIZE):
         """
         Initialize the GraphBuilder with tolerance parameters and MS/MS similarity settings.
         
@@ -61,17 +453,46 @@ class GraphBuilder:
             Minimum cosine similarity for MS/MS-based edges (default: 0.5)
         min_shared_peaks : int
             Minimum number of shared peaks required for MS/MS similarity (default: 3)
+        workers : int
+            Number of worker processes for dataset-pair comparisons (default: 1)
+        cosine_cache_size : int
+            Spectrum pairs kept in each process's cosine cache, 0 to disable
+            (default: COSINE_CACHE_SIZE)
         """
         self.mz_tolerance = mz_tolerance
         self.rt_tolerance = rt_tolerance
         self.cosine_threshold = cosine_threshold
         self.min_shared_peaks = min_shared_peaks
-        self.G = nx.Graph()
+        self.workers = max(1, int(workers))
+        self.cosine_cache_size = max(0, int(cosine_cache_size))
+        self.G = None
+        # Counters of the last build_graph / clean_multiple_connections call
+        self.stats = {}
         
         logger.info(f"GraphBuilder initialized - mz_tol: {mz_tolerance}, rt_tol: {rt_tolerance}, "
-                   f"cosine_threshold: {cosine_threshold}, min_shared_peaks: {min_shared_peaks}")
+                   f"cosine_threshold: {cosine_threshold}, min_shared_peaks: {min_shared_peaks}, "
+                   f"workers: {self.workers}")
     
-    def build_graph(self, all_list_features):
+    def index_dataset(self, table):
+        """
+        Precompute the per-dataset columns used by build_graph.
+        
+        Called as soon as a dataset has been read so that indexing overlaps with
+        the ingest of the remaining files.
+        
+        Parameters:
+        -----------
+        table : FeatureTable
+            Single-dataset feature table
+            
+        Returns:
+        --------
+        columns : dict
+            Dataset columns (see dataset_columns)
+        """
+        return dataset_columns(table)
+    
+    def build_graph(self, features, dataset_index=None, previous_graph=None):
         """
         Build a graph from a list of features using two-case matching logic.
         
@@ -80,131 +501,139 @@ class GraphBuilder:
         
         Parameters:
         -----------
-        all_list_features : list
-            List of tuples (filename, features) where features is a list of dictionaries
+        features : FeatureTable
+            Features of all datasets (see FeatureTable.concat)
+        dataset_index : list, optional
+            Precomputed index_dataset() columns, one per dataset; computed here if omitted
+        previous_graph : EdgeGraph, optional
+            Uncleaned graph of a previous run over the first datasets of
+            ``features``; its edges are kept and only pairs involving the
+            datasets added since are compared (see alignment_state)
             
         Returns:
         --------
-        G : networkx.Graph
-            Graph with nodes representing features and edges representing similarity
+        G : EdgeGraph
+            Graph with nodes representing features and edges representing similarity.
+            Node ids are FeatureTable rows; the feature table is kept in
+            G.graph['features'] (see feature_table.node_feature)
         """
         logger.info("Building graph with two-case matching logic...")
-        self.G = nx.Graph()
-        
-        # Statistics tracking
-        mz_rt_edges = 0
-        msms_edges = 0
-        msms_rejected = 0
-        total_features = 0
-        features_with_msms = 0
-        
-        # Add nodes
-        node_id = 0
-        for dataset_id, (filename, features) in enumerate(all_list_features):
-            logger.info(f"Adding nodes for dataset {dataset_id}: {os.path.basename(filename)}")
-            
-            for feature_id, feature in enumerate(features):
-                # Create a unique ID for the node
-                node_id_str = f"{dataset_id}_{feature_id}"
-                
-                # Add node with attributes
-                self.G.add_node(node_id_str, 
-                               dataset_id=dataset_id,
-                               feature_id=feature_id,
-                               mz=feature.get('mz', 0),
-                               rt=feature.get('rt', 0),
-                               intensity=feature.get('intensity', 0),
-                               has_msms=feature.get('has_msms', False),
-                               filename=os.path.basename(filename))
-                
-                total_features += 1
-                if feature.get('has_msms', False):
-                    features_with_msms += 1
-                node_id += 1
-        
-        logger.info(f"Added {self.G.number_of_nodes()} nodes to the graph")
+        
+        total_features = len(features)
+        features_with_msms = int(features.has_msms.sum())
+        logger.info(f"Graph nodes are the {total_features} features of {features.n_datasets} datasets")
         logger.info(f"Features with MS/MS data: {features_with_msms}/{total_features} ({100*features_with_msms/total_features:.1f}%)")
         
         # Add edges using two-case logic
         logger.info("Adding edges with two-case matching logic...")
-        edge_count = 0
-        
-        # Compare features across different datasets
-        for i, (filename_i, features_i) in enumerate(all_list_features):
-            for j, (filename_j, features_j) in enumerate(all_list_features):
-                if i >= j:  # Skip same dataset and avoid duplicate comparisons
-                    continue
-                
-                logger.info(f"Comparing dataset {i} and {j}...")
-                
-                # Compare features between datasets
-                for feature_id_i, feature_i in enumerate(features_i):
-                    for feature_id_j, feature_j in enumerate(features_j):
-                        # Step 1: Apply m/z and RT gate (same for both cases)
-                        mz_diff = abs(feature_i.get('mz', 0) - feature_j.get('mz', 0))
-                        rt_diff = abs(feature_i.get('rt', 0) - feature_j.get('rt', 0))
-                        
-                        # Only proceed if within tolerance
-                        if mz_diff <= self.mz_tolerance and rt_diff <= self.rt_tolerance:
-                            
-                            # Step 2: Determine which case applies
-                            both_have_msms = (has_msms_data(feature_i) and has_msms_data(feature_j))
-                            
-                            if both_have_msms:
-                                # Case 2: MS/MS available - use cosine similarity as weight
-                                weight = calculate_spectral_similarity(
-                                    feature_i, feature_j, 
-                                    min_shared_peaks=self.min_shared_peaks,
-                                    cosine_threshold=self.cosine_threshold
-                                )
-                                
-                                if weight > 0:  # Only add edge if above threshold
-                                    # Calculate detailed spectral information for storage
-                                    from spectral_similarity import fast_cosine_similarity
-                                    peaks1 = feature_i['msms_peaks']
-                                    intensities1 = feature_i['msms_intensities']
-                                    peaks2 = feature_j['msms_peaks']
-                                    intensities2 = feature_j['msms_intensities']
-                                    cosine_score, shared_peaks_count = fast_cosine_similarity(
-                                        peaks1, intensities1, peaks2, intensities2, self.min_shared_peaks
-                                    )
-                                    
-                                    node_i = f"{i}_{feature_id_i}"
-                                    node_j = f"{j}_{feature_id_j}"
-                                    self.G.add_edge(node_i, node_j, 
-                                                  weight=weight, 
-                                                  edge_type='msms',
-                                                  cosine_similarity=cosine_score,
-                                                  shared_peaks=shared_peaks_count)
-                                    edge_count += 1
-                                    msms_edges += 1
-                                else:
-                                    msms_rejected += 1
-                                    
-                            else:
-                                # Case 1: No MS/MS - use m/z/RT weight (current behavior)
-                                weight = 1.0 - (mz_diff / self.mz_tolerance + rt_diff / self.rt_tolerance) / 2.0
-                                node_i = f"{i}_{feature_id_i}"
-                                node_j = f"{j}_{feature_id_j}"
-                                self.G.add_edge(node_i, node_j, weight=weight, edge_type='mz_rt')
-                                edge_count += 1
-                                mz_rt_edges += 1
+        
+        # Extract m/z, RT, MS/MS flag and spectrum columns once per dataset
+        if dataset_index is None:
+            dataset_index = [self.index_dataset(features.dataset(dataset_id))
+                             for dataset_id in range(features.n_datasets)]
+        datasets = dataset_index
+        settings = self._pair_settings()
+        
+        # Compare features across different datasets (i < j avoids duplicates)
+        first_new = 0 if previous_graph is None else previous_graph.features.n_datasets
+        pairs = [(i, j) for i in range(len(datasets)) for j in range(max(i + 1, first_new), len(datasets))]
+        if previous_graph is not None:
+            logger.info(f"Keeping {previous_graph.number_of_edges()} edges of {first_new} previous datasets; "
+                        f"comparing {len(pairs)} new dataset pairs")
+        
+        # Merge the workers' edge arrays in pair order so the graph is deterministic
+        counts = {'candidate_pairs': 0, 'msms_candidates': 0, 'cosine_evaluations': 0, 'msms_rejected': 0,
+                  'cosine_cache_hits': 0, 'cosine_cache_misses': 0}
+        pair_edges = []
+        for (i, j), edges in zip(pairs, self._compare_pairs(datasets, settings, pairs)):
+            logger.info(f"Comparing dataset {i} and {j}...")
+            pair_edges.append(((i, j), edges))
+            for name in counts:
+                counts[name] += edges[name]
+        msms_rejected = counts['msms_rejected']
+        self.G = EdgeGraph.from_pair_edges(features, pair_edges, base=previous_graph)
+        self.stats = dict(counts, dataset_pairs=len(pairs), edges=self.G.number_of_edges(),
+                          msms_edges=int(self.G.is_msms.sum()), nodes=self.G.number_of_nodes())
         
         # Log comprehensive statistics
+        edge_count = self.G.number_of_edges()
+        msms_edges = int(self.G.is_msms.sum())
+        mz_rt_edges = edge_count - msms_edges
         logger.info(f"Edge creation completed:")
         logger.info(f"  Total edges added: {edge_count}")
         logger.info(f"  Case 1 (m/z/RT) edges: {mz_rt_edges} ({100*mz_rt_edges/edge_count:.1f}%)")
         logger.info(f"  Case 2 (MS/MS) edges: {msms_edges} ({100*msms_edges/edge_count:.1f}%)")
         logger.info(f"  MS/MS edges rejected (cosine < {self.cosine_threshold}): {msms_rejected}")
+        if self.cosine_cache_size > 0:
+            lookups = counts['cosine_cache_hits'] + counts['cosine_cache_misses']
+            logger.info(f"  MS/MS cosine cache: {counts['cosine_cache_hits']} hits, "
+                        f"{counts['cosine_cache_misses']} misses "
+                        f"({100*counts['cosine_cache_hits']/max(lookups, 1):.1f}% hit rate)")
         
-        # Remove isolated nodes
-        isolated_nodes = list(nx.isolates(self.G))
-        self.G.remove_nodes_from(isolated_nodes)
-        logger.info(f"Removed {len(isolated_nodes)} isolated nodes")
+        # Features without any edge are not part of the graph
+        logger.info(f"Removed {total_features - self.G.number_of_nodes()} isolated nodes")
         logger.info(f"Final graph has {self.G.number_of_nodes()} nodes and {self.G.number_of_edges()} edges")
         
         return self.G
 
+    def candidate_pairs(self, features, dataset_index=None):
+        """
+        Compute the candidate pairs of every dataset pair without selecting edges.
+        
+        The result holds all pairs within this builder's tolerances together
+        with their cosine scores, so edges for any tighter settings can be
+        derived with select_pair_edges (see parameter_sweep).
+        
+        Parameters:
+        -----------
+        features : FeatureTable
+            Features of all datasets
+        dataset_index : list, optional
+            Precomputed index_dataset() columns, one per dataset; computed here if omitted
+            
+        Returns:
+        --------
+        pair_candidates : list
+            ((i, j), candidates) for every dataset pair i < j, in pair order
+        """
+        if dataset_index is None:
+            dataset_index = [self.index_dataset(features.dataset(dataset_id))
+                             for dataset_id in range(features.n_datasets)]
+        pairs = [(i, j) for i in range(len(dataset_index)) for j in range(i + 1, len(dataset_index))]
+        results = self._compare_pairs(dataset_index, self._pair_settings(), pairs, compare=candidate_pairs)
+        return list(zip(pairs, results))
+    
+    def _pair_settings(self):
+        """Settings handed to compare_dataset_pair for every dataset pair."""
+        return {
+            'mz_tolerance': self.mz_tolerance,
+            'rt_tolerance': self.rt_tolerance,
+            'cosine_threshold': self.cosine_threshold,
+            'min_shared_peaks': self.min_shared_peaks,
+            'cosine_cache_size': self.cosine_cache_size,
+        }
+    
+    def _compare_pairs(self, datasets, settings, pairs, compare=compare_dataset_pair):
+        """
+        Yield ``compare`` results (edge arrays) for each dataset pair, in the order of ``pairs``.
+        
+        With more than one worker the pairs are sent to a process pool; results
+        are still consumed in submission order, so the merged graph does not
+        depend on the worker count.
+        """
+        if self.workers <= 1 or len(pairs) <= 1:
+            for i, j in pairs:
+                yield compare(datasets[i], datasets[j], settings)
+            return
+        
+        n_workers = min(self.workers, len(pairs))
+        logger.info(f"Comparing {len(pairs)} dataset pairs with {n_workers} worker processes")
+        chunksize = max(1, len(pairs) // (n_workers * 4))
+        with ProcessPoolExecutor(max_workers=n_workers,
+                                 initializer=_init_pair_worker,
+                                 initargs=(datasets, settings, compare)) as executor:
+            yield from executor.map(_compare_pair_task, pairs, chunksize=chunksize)
+
     def get_feature_data(self, node_id):
         """
         Get feature data for a node.
@@ -219,10 +648,10 @@ class GraphBuilder:
         feature_data : dict
             Dictionary with feature data
         """
-        if node_id not in self.G:
+        if node_id not in self.G.nodes:
             return None
         
-        return self.G.nodes[node_id]
+        return node_feature(self.G, node_id)
 
     def calculate_similarity_score(self, feature1: Dict, feature2: Dict) -> float:
         """
@@ -239,77 +668,32 @@ class GraphBuilder:
         # Weight m/z more heavily than RT (0.7 vs 0.3)
         return 0.7 * mz_score + 0.3 * rt_score if mz_score > 0 and rt_score > 0 else 0
 
-    def clean_multiple_connections(self) -> nx.Graph:
+    def clean_multiple_connections(self) -> EdgeGraph:
         """
         Pre-process graph to resolve multiple connections with edge type priority.
         
         MS/MS edges are prioritized over m/z/RT edges, then by weight within each type.
         This ensures structurally similar features (MS/MS) are preferred over 
-        proximity-based matches (m/z/RT).
+        proximity-based matches (m/z/RT). An edge survives only if it is the best
+        connection of both of its features (see best_connection_mask).
         
         Returns:
         --------
-        nx.Graph: Cleaned graph with resolved multiple connections
+        EdgeGraph: Cleaned graph with resolved multiple connections
         """
         logger.info("Cleaning multiple connections with edge type prioritization...")
         
-        # Statistics tracking
-        total_multiple_connections = 0
-        msms_preferred = 0
-        mz_rt_kept = 0
-        edges_removed = 0
-        
-        for node in list(self.G.nodes()):
-            neighbors = list(self.G.neighbors(node))
-            by_dataset = {}
-            
-            # Group neighbors by dataset
-            for neighbor in neighbors:
-                dataset_id = neighbor.split('_')[0]  # Assuming ID format: "dataset_featurenum"
-                by_dataset.setdefault(dataset_id, []).append(neighbor)
-            
-            # Resolve multiple connections within each dataset
-            for dataset, features in by_dataset.items():
-                if len(features) > 1:
-                    total_multiple_connections += 1
-                    
-                    # Get edge information: (feature, weight, edge_type)
-                    edges_info = []
-                    for feature in features:
-                        edge_data = self.G[node][feature]
-                        weight = edge_data.get('weight', 0.0)
-                        edge_type = edge_data.get('edge_type', 'mz_rt')
-                        edges_info.append((feature, weight, edge_type))
-                    
-                    # Prioritize by edge type, then by weight
-                    msms_edges = [(f, w) for f, w, t in edges_info if t == 'msms']
-                    mz_rt_edges = [(f, w) for f, w, t in edges_info if t == 'mz_rt']
-                    
-                    # Select best connection
-                    if msms_edges:
-                        # Prefer MS/MS edges - select highest weight MS/MS edge
-                        best_feature = max(msms_edges, key=lambda x: x[1])[0]
-                        msms_preferred += 1
-                        logger.debug(f"Node {node}: MS/MS edge preferred to {best_feature} "
-                                   f"over {len(features)-1} alternatives")
-                    else:
-                        # No MS/MS edges available - select highest weight m/z/RT edge
-                        best_feature = max(mz_rt_edges, key=lambda x: x[1])[0]
-                        mz_rt_kept += 1
-                        logger.debug(f"Node {node}: Best m/z/RT edge kept to {best_feature}")
-                    
-                    # Remove other edges
-                    for feature in features:
-                        if feature != best_feature:
-                            self.G.remove_edge(node, feature)
-                            edges_removed += 1
+        keep, stats = best_connection_mask(self.G.u, self.G.v, self.G.weight, self.G.is_msms,
+                                           self.G.features.dataset_id)
+        self.G = self.G.edge_subgraph(keep)
+        self.stats = dict(stats, edges_kept=self.G.number_of_edges())
         
         # Log statistics
         logger.info(f"Multiple connection resolution completed:")
-        logger.info(f"  Cases with multiple connections: {total_multiple_connections}")
-        logger.info(f"  MS/MS edges preferred: {msms_preferred}")
-        logger.info(f"  m/z/RT edges kept: {mz_rt_kept}")
-        logger.info(f"  Total edges removed: {edges_removed}")
+        logger.info(f"  Cases with multiple connections: {stats['multiple_connections']}")
+        logger.info(f"  MS/MS edges preferred: {stats['msms_preferred']}")
+        logger.info(f"  m/z/RT edges kept: {stats['mz_rt_kept']}")
+        logger.info(f"  Total edges removed: {stats['edges_removed']}")
         
         return self.G
 
@@ -320,6 +704,6 @@ class GraphBuilder:
         return {
             'num_nodes': self.G.number_of_nodes(),
             'num_edges': self.G.number_of_edges(),
-            'avg_degree': sum(dict(self.G.degree()).values()) / self.G.number_of_nodes(),
-            'connected_components': nx.number_connected_components(self.G)
+            'avg_degree': 2 * self.G.number_of_edges() / self.G.number_of_nodes(),
+            'connected_components': len(self.G.connected_components())
         }
@@ -8,6 +8,7 @@ and m/z variations.
 Main functions/classes:
     - CommunityDetector: Detects communities using Louvain algorithm for soft grouping
     - CliqueDetector: Finds maximal cliques for strict feature grouping
+    - run_reference_alignment: Aligns against a growing consensus instead of building the graph
     - parse_arguments: Handles command-line arguments
     - main: Orchestrates the entire alignment pipeline
 
@@ -17,6 +18,7 @@ Inputs:
 
 Outputs:
     - TSV files with aligned features (community and clique methods)
+    - Result bundle (results/) with the feature graph and partition as memory-mappable columns
     - PNG visualizations (graphs and heatmaps) if --visualize is specified
     - Summary statistics
 
@@ -25,25 +27,35 @@ Important arguments:
     --mz-tolerance: m/z tolerance in Da (default: 0.01)
     --rt-tolerance: RT tolerance in minutes (default: 0.5)
     --min-datasets: Minimum datasets for valid group (default: 2)
+    --workers: Worker processes for file ingest, pair comparisons, Louvain and cliques (default: 1)
+    --alignment-mode: 'graph' (all dataset pairs) or 'reference' (consensus, linear in datasets)
+    --append: Add new input files to the previous run in --output-dir (graph mode)
+    --clique-time-budget: Seconds after which the clique search stops (default: no limit)
+    --output-format: Format of the aligned features files (tsv, tsv.gz or parquet)
+    --profile / --profile-stage: Per-stage time, memory and counters in profile.json, cProfile of one stage
+    --no-cache: Always re-parse inputs instead of using the parsed-input cache
+    --cosine-cache-size: Spectrum pairs kept in the MS/MS cosine cache of each process (default: 0, off)
     --visualize: Generate visualization plots
 """
 import os
 import argparse
-import csv
-import pandas as pd
-import networkx as nx
-import matplotlib.pyplot as plt
 from collections import defaultdict
 import time
 import numpy as np
 import logging
 from pathlib import Path
-from read_files import read_features, read_excel, collect_files
+from read_files import read_features, read_excel, collect_files, iter_read_features
+from feature_table import FeatureTable
 from graph_construction import GraphBuilder
-from community_detection import detect_communities, group_features_by_community, detect_cliques, group_features_by_clique
-from clique_detection import find_cliques, generate_clique_tables
+from spectral_similarity import COSINE_CACHE_SIZE
+from reference_alignment import ReferenceAligner
+from alignment_state import STATE_FILE_NAME, save_alignment_state, load_alignment_state
+from result_bundle import BUNDLE_DIR_NAME, save_result_bundle
+from profiling import STAGES, StageProfiler
+from community_detection import detect_communities, group_features_by_community, detect_cliques, group_features_by_clique, changed_components
+from clique_detection import find_cliques, generate_clique_tables, find_kpartite_cliques
 from mass_feature_aligner import write_aligned_features_tsv, filter_aligned_features, calculate_average_mz, merge_similar_groups
-from visualize_graph import plot_initial_graph, plot_community_graph, plot_clique_graph, visualize_subgraph, create_intensity_heatmap
+# visualize_graph (matplotlib, seaborn, networkx) is imported by the visualization stage only
 
 class CommunityDetector:
     """
@@ -52,21 +64,30 @@ class CommunityDetector:
     def __init__(self):
         self.G = None
         
-    def detect_communities(self, G, hard_separation=False):
+    def detect_communities(self, G, hard_separation=False, previous_partition=None, changed_nodes=None,
+                           workers=1):
         """
         Detect communities in the graph using the Louvain method.
         
         Parameters:
         -----------
-        G : networkx.Graph
+        G : EdgeGraph
             Graph to detect communities in
         hard_separation : bool
             If True, use a higher resolution and post-process communities to ensure hard separation
+        previous_partition : dict, optional
+            Partition of the previous run (--append); only changed components are re-detected
+        changed_nodes : array-like, optional
+            Node ids of the datasets added since the previous run
+        workers : int
+            Number of processes running Louvain on separate connected components
         """
         from community_detection import detect_communities
         self.G = G  # Store the graph
         print("Detecting communities...")
-        partition = detect_communities(G, hard_separation=hard_separation)
+        partition = detect_communities(G, hard_separation=hard_separation,
+                                       previous_partition=previous_partition, changed_nodes=changed_nodes,
+                                       workers=workers)
         
         # Count communities
         communities = {}
@@ -113,57 +134,31 @@ class CliqueDetector:
     def __init__(self):
         self.G = None
         
-    def find_cliques(self, G):
+    def find_cliques(self, G, previous_cliques=None, changed_nodes=None, workers=1, time_budget=None):
         """
-        Find cliques in the graph with optimizations to prevent excessive computation.
+        Find all maximal cliques with at least 3 nodes (see clique_detection.find_kpartite_cliques).
+        
+        With previous_cliques and changed_nodes (--append), cliques of unchanged
+        connected components are kept and only the changed components are searched.
         """
         self.G = G  # Store the graph
-        print("Finding cliques with optimizations...")
-        
-        # Set a maximum size for cliques to prevent excessive computation
-        max_clique_size = 10
+        print("Finding cliques...")
         
-        # Use a more efficient approach for finding cliques
         cliques = []
         
-        # First, find connected components to process them separately
-        components = list(nx.connected_components(G))
+        # Connected components are searched separately
+        components = G.connected_components()
         print(f"Graph has {len(components)} connected components")
         
-        # Process each component
-        for i, component in enumerate(components):
-            if i < 5:  # Only print details for the first 5 components
-                print(f"Processing component {i} with {len(component)} nodes")
-            
-            # Skip very large components
-            if len(component) > 100:
-                print(f"Skipping component {i} with {len(component)} nodes (too large)")
-                continue
-                
-            # Extract the subgraph for this component
-            subgraph = G.subgraph(component)
-            
-            try:
-                # Find cliques in this component with a size limit
-                component_cliques = []
-                for clique in nx.find_cliques(subgraph):
-                    if len(clique) >= 3 and len(clique) <= max_clique_size:
-                        component_cliques.append(clique)
-                    
-                    # Limit the number of cliques per component
-                    if len(component_cliques) >= 1000:
-                        print(f"Reached limit of 1000 cliques for component {i}")
-                        break
-                
-                cliques.extend(component_cliques)
-                
-                # Limit the total number of cliques
-                if len(cliques) >= 5000:
-                    print("Reached limit of 5000 total cliques")
-                    break
-                    
-            except Exception as e:
-                print(f"Error finding cliques in component {i}: {e}")
+        if previous_cliques is not None:
+            components, unchanged = changed_components(G, changed_nodes)
+            unchanged_keys = {key for component in unchanged for key in G.node_keys(component)}
+            cliques = [clique for clique in previous_cliques if clique[0] in unchanged_keys]
+            print(f"Keeping {len(cliques)} cliques of {len(unchanged)} unchanged components, "
+                  f"searching {len(components)} changed components")
+        
+        cliques.extend(find_kpartite_cliques(G, components, min_size=3, workers=workers,
+                                             time_budget=time_budget))
         
         print(f"Found {len(cliques)} cliques with at least 3 nodes")
         
@@ -226,14 +221,14 @@ def test_read_excel(directory):
     
     print("\n" + "="*50 + "\n")
 
-def write_summary(all_list_features, summary_file):
+def write_summary(features, summary_file):
     """
     Write summary statistics for processed files to a markdown file.
     
     Parameters:
     -----------
-    all_list_features : list
-        List of tuples (filename, features) where features is a list of dictionaries
+    features : FeatureTable
+        Features of all processed files
     summary_file : str or Path
         Path to the markdown file to write
     """
@@ -242,25 +237,20 @@ def write_summary(all_list_features, summary_file):
     
     # Calculate summary statistics
     summary_data = []
-    total_features = 0
+    total_features = len(features)
     
-    for filename, features in all_list_features:
-        # Calculate statistics
-        num_features = len(features)
-        total_features += num_features
+    for dataset_id in range(features.n_datasets):
+        rows = features.dataset_slice(dataset_id)
+        num_features = features.dataset_size(dataset_id)
         
         # Calculate average m/z, RT, and intensity
-        mz_values = [feature.get('mz', 0) for feature in features if 'mz' in feature]
-        rt_values = [feature.get('rt', 0) for feature in features if 'rt' in feature]
-        intensity_values = [feature.get('intensity', 0) for feature in features if 'intensity' in feature]
-        
-        avg_mz = sum(mz_values) / len(mz_values) if mz_values else 0
-        avg_rt = sum(rt_values) / len(rt_values) if rt_values else 0
-        avg_intensity = sum(intensity_values) / len(intensity_values) if intensity_values else 0
+        avg_mz = float(features.mz[rows].mean()) if num_features else 0
+        avg_rt = float(features.rt[rows].mean()) if num_features else 0
+        avg_intensity = float(features.intensity[rows].mean()) if num_features else 0
         
         # Add to summary data
         summary_data.append({
-            'filename': Path(filename).name,
+            'filename': features.basename(dataset_id),
             'num_features': num_features,
             'avg_mz': avg_mz,
             'avg_rt': avg_rt,
@@ -270,7 +260,7 @@ def write_summary(all_list_features, summary_file):
     # Write summary to markdown file
     with open(summary_file, 'w') as f:
         f.write("# Mass Feature Alignment Summary\n\n")
-        f.write(f"Processed {len(all_list_features)} files with a total of {total_features} features.\n\n")
+        f.write(f"Processed {features.n_datasets} files with a total of {total_features} features.\n\n")
         
         # Write table header
         f.write("| Filename | Features | Avg m/z | Avg RT (min) | Avg Intensity |\n")
@@ -281,7 +271,54 @@ def write_summary(all_list_features, summary_file):
             f.write(f"| {data['filename']} | {data['num_features']} | {data['avg_mz']:.4f} | {data['avg_rt']:.2f} | {data['avg_intensity']:.2e} |\n")
     
     logger.info(f"Summary written to {summary_file}")
-    logger.info(f"Processed {len(all_list_features)} files with a total of {total_features} features")
+    logger.info(f"Processed {features.n_datasets} files with a total of {total_features} features")
+
+def run_reference_alignment(args, features, dataset_index, output_dir, profiler=None):
+    """
+    Align features against a growing consensus feature table (--alignment-mode reference).
+    
+    Parameters:
+    -----------
+    args : argparse.Namespace
+        Parsed command line arguments
+    features : FeatureTable
+        Features of all processed files
+    dataset_index : list
+        Dataset columns from GraphBuilder.index_dataset, one per dataset
+    output_dir : Path
+        Directory for output files
+    profiler : StageProfiler, optional
+        Records the stages of the run (--profile)
+    """
+    logger = logging.getLogger(__name__)
+    profiler = profiler or StageProfiler()
+    aligner = ReferenceAligner(
+        mz_tolerance=args.mz_tolerance,
+        rt_tolerance=args.rt_tolerance,
+        cosine_threshold=0.5,
+        min_shared_peaks=3,
+        cosine_cache_size=args.cosine_cache_size
+    )
+    with profiler.stage('reference_alignment') as counters:
+        aligned_features, G = aligner.align(features, dataset_index=dataset_index)
+        counters.update(aligner.stats, consensus_features=len(aligned_features), edges=G.number_of_edges())
+    
+    with profiler.stage('write_output') as counters:
+        # Save the match graph for later use
+        save_result_bundle(output_dir / BUNDLE_DIR_NAME, G)
+        
+        aligned_features = filter_aligned_features(aligned_features, min_datasets=args.min_datasets)
+        feature_mzs = calculate_average_mz(aligned_features, {})
+        output_file = output_dir / f"aligned_features_reference.{args.output_format}"
+        write_aligned_features_tsv(aligned_features, feature_mzs, features, output_file, G)
+        counters.update(groups_written=len(aligned_features))
+    
+    if args.visualize:
+        with profiler.stage('visualization'):
+            logger.info("Generating visualizations...")
+            from visualize_graph import plot_initial_graph, create_intensity_heatmap
+            plot_initial_graph(G.to_networkx(), args.output_dir)
+            create_intensity_heatmap(output_file, args.output_dir, max_groups=50)
 
 def main():
     """
@@ -309,6 +346,19 @@ def main():
     parser.add_argument('--hard-separation', action='store_true', help='Enable hard separation of communities for better visualization')
     parser.add_argument('--max-vis-nodes', type=int, default=1000, help='Maximum number of nodes to display in visualizations')
     parser.add_argument('--max-vis-edges', type=int, default=5000, help='Maximum number of edges to display in visualizations')
+    parser.add_argument('--workers', type=int, default=1, help='Number of worker processes for file ingest, dataset-pair comparisons, community and clique detection')
+    parser.add_argument('--no-cache', action='store_true', help='Do not read or write the parsed-input cache next to the input files')
+    parser.add_argument('--alignment-mode', choices=['graph', 'reference'], default='graph',
+                        help="'graph' compares all dataset pairs; 'reference' aligns each dataset against a growing consensus (linear in the number of datasets)")
+    parser.add_argument('--clique-time-budget', type=float, default=None, help='Stop the clique search after this many seconds (default: no limit)')
+    parser.add_argument('--append', action='store_true', help='Add input files that are new since the previous run in --output-dir, reusing its alignment state')
+    parser.add_argument('--output-format', choices=['tsv', 'tsv.gz', 'parquet'], default='tsv',
+                        help="Format of the aligned features files ('parquet' requires pyarrow)")
+    parser.add_argument('--cosine-cache-size', type=int, default=COSINE_CACHE_SIZE,
+                        help='Spectrum pairs kept in the MS/MS cosine cache of each process (default: 0, off; helps when many spectra are identical, e.g. replicate injections)')
+    parser.add_argument('--profile', action='store_true', help='Record time, memory and counters of every stage in output_dir/profile.json (tracemalloc makes profiled runs slower)')
+    parser.add_argument('--profile-stage', choices=STAGES, default=None,
+                        help='With --profile, also run this stage under cProfile (output_dir/profile_<stage>.prof)')
     args = parser.parse_args()
     
     # Create output directory if it doesn't exist
@@ -317,6 +367,7 @@ def main():
     
     # Start timing
     start_time = time.time()
+    profiler = StageProfiler(enabled=args.profile, output_dir=output_dir, cprofile_stage=args.profile_stage)
     
     # Step 1: Read Excel files and extract features
     logger.info(f"Reading Excel files from {args.input_dir}...")
@@ -328,88 +379,171 @@ def main():
     
     logger.info(f"Found {len(excel_files)} Excel files")
     
-    # Read features from each file
-    all_list_features = []
-    for excel_file in excel_files:
-        try:
-            list_features = read_excel(excel_file)
-            all_list_features.append((excel_file, list_features))
-            logger.info(f"Read {len(list_features)} features from {Path(excel_file).name}")
-        except Exception as e:
-            logger.error(f"Error reading {excel_file}: {e}")
-    
-    # Write summary
-    summary_file = output_dir / "summary.md"
-    write_summary(all_list_features, summary_file)
-    
-    # Step 2: Build graph from features
     graph_builder = GraphBuilder(
         mz_tolerance=args.mz_tolerance, 
         rt_tolerance=args.rt_tolerance,
         cosine_threshold=0.5,
-        min_shared_peaks=3
+        min_shared_peaks=3,
+        workers=args.workers,
+        cosine_cache_size=args.cosine_cache_size
     )
-    G = graph_builder.build_graph(all_list_features)
+    settings = {
+        'mz_tolerance': graph_builder.mz_tolerance,
+        'rt_tolerance': graph_builder.rt_tolerance,
+        'cosine_threshold': graph_builder.cosine_threshold,
+        'min_shared_peaks': graph_builder.min_shared_peaks,
+    }
+    
+    # Incremental run: only the files missing from the previous state are read and compared
+    state_file = output_dir / STATE_FILE_NAME
+    previous = None
+    if args.append:
+        if args.alignment_mode != 'graph':
+            logger.error("--append is only supported with --alignment-mode graph")
+            return
+        previous = load_alignment_state(state_file)
+        if previous is None:
+            logger.warning(f"No alignment state found in {args.output_dir}; aligning all files")
+        elif previous['settings'] != settings:
+            logger.error(f"--append requires the settings of the previous run: {previous['settings']}")
+            return
+        else:
+            known_files = set(previous['features'].filenames)
+            excel_files = [excel_file for excel_file in excel_files
+                           if os.path.abspath(excel_file) not in known_files]
+            if not excel_files:
+                logger.info("No new input files since the previous run")
+                return
+            logger.info(f"Appending {len(excel_files)} new files to "
+                        f"{previous['features'].n_datasets} previously aligned datasets")
+    
+    # Read features from each file in a process pool; each dataset is indexed
+    # for graph construction as soon as it arrives, while other files are still parsed
+    with profiler.stage('ingest') as counters:
+        tables = [None] * len(excel_files)
+        dataset_index = [None] * len(excel_files)
+        for position, excel_file, table, error in iter_read_features(
+                excel_files, workers=args.workers, use_cache=not args.no_cache):
+            if error is not None:
+                logger.error(f"Error reading {excel_file}: {error}")
+                continue
+            tables[position] = table
+            dataset_index[position] = graph_builder.index_dataset(table)
+            logger.info(f"Read {len(table)} features from {Path(excel_file).name}")
+        
+        # Keep the collect_files order regardless of completion order
+        dataset_index = [index for index in dataset_index if index is not None]
+        tables = [table for table in tables if table is not None]
+        counters.update(files=len(tables), features=sum(len(table) for table in tables))
+        changed_nodes = None
+        if previous is not None:
+            # Previous datasets keep their ids (and node ids); new datasets follow them
+            previous_features = previous['features']
+            dataset_index = [graph_builder.index_dataset(previous_features.dataset(dataset_id))
+                             for dataset_id in range(previous_features.n_datasets)] + dataset_index
+            tables = [previous_features] + tables
+            changed_nodes = np.arange(len(previous_features), sum(len(table) for table in tables))
+        features = FeatureTable.concat(tables)
+        counters.update(features_with_msms=int(features.has_msms.sum()))
+    
+    # Write summary
+    summary_file = output_dir / "summary.md"
+    write_summary(features, summary_file)
+    
+    if args.alignment_mode == 'reference':
+        run_reference_alignment(args, features, dataset_index, output_dir, profiler)
+        profiler.write(dict(settings, alignment_mode=args.alignment_mode, workers=args.workers))
+        elapsed_time = time.time() - start_time
+        logger.info(f"Mass feature alignment completed in {elapsed_time:.2f} seconds")
+        return
+    
+    # Step 2: Build graph from features
+    with profiler.stage('build_graph') as counters:
+        G = graph_builder.build_graph(features, dataset_index=dataset_index,
+                                      previous_graph=previous['graph'] if previous else None)
+        counters.update(graph_builder.stats)
+    uncleaned_G = G
     
     # Clean multiple connections to keep only the most likely edge between datasets
     logger.info("Cleaning multiple connections...")
-    G = graph_builder.clean_multiple_connections()
+    with profiler.stage('clean_multiple_connections') as counters:
+        G = graph_builder.clean_multiple_connections()
+        counters.update(graph_builder.stats)
     logger.info(f"Graph after cleaning: {G.number_of_nodes()} nodes, {G.number_of_edges()} edges")
     
     # Step 3: Detect communities
     community_detector = CommunityDetector()
-    partition = community_detector.detect_communities(G, hard_separation=args.hard_separation)
-    
-    # Save graph and partition for later use
-    import pickle
-    with open(output_dir / "graph.pkl", 'wb') as f:
-        pickle.dump(G, f)
-    with open(output_dir / "partition.pkl", 'wb') as f:
-        pickle.dump(partition, f)
-    logger.info(f"Saved graph and partition to {args.output_dir}")
-    
-    # Step 4: Group features by community
-    aligned_features_community = community_detector.group_features_by_community(partition)
-    
-    # Filter aligned features
-    aligned_features_community = filter_aligned_features(aligned_features_community, min_datasets=args.min_datasets)
+    with profiler.stage('communities') as counters:
+        partition = community_detector.detect_communities(
+            G, hard_separation=args.hard_separation,
+            previous_partition=previous['partition'] if previous else None, changed_nodes=changed_nodes,
+            workers=args.workers)
+        counters.update(communities=len(set(partition.values())))
+        
+        # Step 4: Group features by community
+        aligned_features_community = community_detector.group_features_by_community(partition)
+        
+        # Filter aligned features
+        aligned_features_community = filter_aligned_features(aligned_features_community, min_datasets=args.min_datasets)
+        counters.update(groups_kept=len(aligned_features_community))
     
     # Step 5: Detect cliques
     clique_detector = CliqueDetector()
-    cliques, G_cliques = clique_detector.find_cliques(G)
-    
-    # Step 6: Group features by clique
-    aligned_features_clique = clique_detector.group_features_by_clique(cliques)
-    
-    # Filter aligned features
-    aligned_features_clique = filter_aligned_features(aligned_features_clique, min_datasets=args.min_datasets)
+    with profiler.stage('cliques') as counters:
+        cliques, G_cliques = clique_detector.find_cliques(
+            G, previous_cliques=previous['cliques'] if previous else None, changed_nodes=changed_nodes,
+            workers=args.workers, time_budget=args.clique_time_budget)
+        counters.update(cliques=len(cliques))
+        
+        # Step 6: Group features by clique
+        aligned_features_clique = clique_detector.group_features_by_clique(cliques)
+        
+        # Filter aligned features
+        aligned_features_clique = filter_aligned_features(aligned_features_clique, min_datasets=args.min_datasets)
+        counters.update(groups_kept=len(aligned_features_clique))
     
     # Step 7: Write aligned features to TSV files
-    # Calculate average m/z values for each group
-    feature_mzs_community = calculate_average_mz(aligned_features_community, {})
-    output_file_community = output_dir / "aligned_features_community.tsv"
-    write_aligned_features_tsv(aligned_features_community, feature_mzs_community, all_list_features, output_file_community, G)
-    
-    feature_mzs_clique = calculate_average_mz(aligned_features_clique, {})
-    output_file_clique = output_dir / "aligned_features_clique.tsv"
-    write_aligned_features_tsv(aligned_features_clique, feature_mzs_clique, all_list_features, output_file_clique, G)
-    
-    # Step 8: Visualize results
-    if args.visualize:
-        logger.info("Generating visualizations...")
-        
-        # Plot initial graph
-        pos = plot_initial_graph(G, args.output_dir)
+    with profiler.stage('write_output') as counters:
+        # Save graph and partition for later use
+        save_result_bundle(output_dir / BUNDLE_DIR_NAME, G, partition)
         
-        # Plot community graph
-        plot_community_graph(G, partition, args.output_dir, pos, args.max_vis_nodes, args.max_vis_edges, hard_separation=args.hard_separation)
+        # Calculate average m/z values for each group
+        feature_mzs_community = calculate_average_mz(aligned_features_community, {})
+        output_file_community = output_dir / f"aligned_features_community.{args.output_format}"
+        write_aligned_features_tsv(aligned_features_community, feature_mzs_community, features, output_file_community, G)
         
-        # Plot clique graph
-        plot_clique_graph(G, cliques, args.output_dir, pos, args.max_vis_nodes, args.max_vis_edges, hard_separation=args.hard_separation)
+        feature_mzs_clique = calculate_average_mz(aligned_features_clique, {})
+        output_file_clique = output_dir / f"aligned_features_clique.{args.output_format}"
+        write_aligned_features_tsv(aligned_features_clique, feature_mzs_clique, features, output_file_clique, G)
         
-        # Create intensity heatmaps
-        create_intensity_heatmap(output_file_community, args.output_dir, max_groups=50)
-        create_intensity_heatmap(output_file_clique, args.output_dir, max_groups=50)
+        # Keep the state for later --append runs
+        save_alignment_state(state_file, features, uncleaned_G, partition, cliques, settings)
+        counters.update(community_groups=len(aligned_features_community),
+                        clique_groups=len(aligned_features_clique))
+    
+    # Step 8: Visualize results
+    if args.visualize:
+        with profiler.stage('visualization'):
+            logger.info("Generating visualizations...")
+            from visualize_graph import plot_initial_graph, plot_community_graph, plot_clique_graph, create_intensity_heatmap
+            
+            # The plotting functions work on networkx graphs
+            G_vis = G.to_networkx()
+            
+            # Plot initial graph
+            pos = plot_initial_graph(G_vis, args.output_dir)
+            
+            # Plot community graph
+            plot_community_graph(G_vis, partition, args.output_dir, pos, args.max_vis_nodes, args.max_vis_edges, hard_separation=args.hard_separation)
+            
+            # Plot clique graph
+            plot_clique_graph(G_vis, cliques, args.output_dir, pos, args.max_vis_nodes, args.max_vis_edges, hard_separation=args.hard_separation)
+            
+            # Create intensity heatmaps
+            create_intensity_heatmap(output_file_community, args.output_dir, max_groups=50)
+            create_intensity_heatmap(output_file_clique, args.output_dir, max_groups=50)
+    
+    profiler.write(dict(settings, alignment_mode=args.alignment_mode, workers=args.workers))
     
     # Print timing information
     elapsed_time = time.time() - start_time
@@ -2,36 +2,42 @@
 Module for generating aligned feature output files.
 
 This module takes the grouped features from community or clique detection
-and creates structured TSV output files. It handles feature merging,
-average m/z calculation, and formatting of the final alignment results.
+and creates structured TSV (optionally gzip-compressed) or Parquet output
+files. It handles feature merging, average m/z calculation, and formatting of
+the final alignment results.
 
 Main functions/classes:
-    - write_aligned_features_tsv: Writes aligned features to TSV format
+    - write_aligned_features_tsv: Writes aligned features to TSV, gzip-TSV or Parquet in chunks
+    - msms_match_table: MS/MS edges inside every aligned group, in one pass over the edges
+    - read_aligned_features: Reads an aligned features file of any output format
     - filter_aligned_features: Filters features based on dataset requirements
     - calculate_average_mz: Computes representative m/z for feature groups
     - merge_similar_groups: Combines groups with overlapping features
 
 Inputs:
     - Aligned feature dictionaries from community/clique detection
-    - Original feature data with intensities and metadata
+    - FeatureTable with the original m/z, intensities and file names
     - Output file paths and filtering parameters
 
 Outputs:
-    - TSV files with aligned features across datasets
+    - TSV, gzip-TSV or Parquet files with aligned features across datasets
     - Average m/z values, intensities per dataset, and feature IDs
     - Summary statistics for alignment quality
 
 Important arguments:
     - aligned_features: Dictionary of grouped features
     - min_datasets: Minimum datasets required for valid alignment
-    - output_file: Path to output TSV file
+    - output_file: Path to output file; its suffix selects the format (.tsv, .gz, .parquet)
 """
-import os
+import gzip
+import heapq
 import pandas as pd
 import numpy as np
-from collections import defaultdict
 from typing import Dict, List, Tuple, Any
 
+# Number of groups written per chunk by write_aligned_features_tsv
+ROWS_PER_CHUNK = 50000
+
 def get_msms_matching_info(features_in_group, graph):
     """
     Extract MS/MS matching information for features in a group.
@@ -40,7 +46,7 @@ def get_msms_matching_info(features_in_group, graph):
     -----------
     features_in_group : list or dict
         Features in the current group
-    graph : networkx.Graph
+    graph : EdgeGraph or networkx.Graph
         Graph containing edge information
         
     Returns:
@@ -64,19 +70,167 @@ def get_msms_matching_info(features_in_group, graph):
     # Check all pairs of features in the group for MS/MS edges
     for i, node1 in enumerate(node_ids):
         for j, node2 in enumerate(node_ids):
-            if i < j and graph.has_edge(node1, node2):
-                edge_data = graph[node1][node2]
-                if edge_data.get('edge_type') == 'msms':
+            if i < j:
+                edge_data = graph.get_edge_data(node1, node2)
+                if edge_data is not None and edge_data.get('edge_type') == 'msms':
                     cosine_sim = edge_data.get('cosine_similarity', edge_data.get('weight', 0))
                     shared_peaks = edge_data.get('shared_peaks', 0)
                     msms_matches.append((node1, node2, cosine_sim, shared_peaks))
     
     return msms_matches
 
-def write_aligned_features_tsv(aligned_features, feature_mzs, all_list_features, output_file, graph=None):
+def output_format_for(output_file):
+    """
+    Return the output format implied by a file name.
+
+    Parameters:
+    -----------
+    output_file : str
+        Path of an aligned features file
+
+    Returns:
+    --------
+    output_format : str
+        'parquet' for *.parquet, 'tsv.gz' for *.gz and 'tsv' otherwise
+    """
+    name = str(output_file).lower()
+    if name.endswith('.parquet'):
+        return 'parquet'
+    if name.endswith('.gz'):
+        return 'tsv.gz'
+    return 'tsv'
+
+def read_aligned_features(aligned_file):
+    """
+    Read an aligned features file written by write_aligned_features_tsv.
+
+    Parameters:
+    -----------
+    aligned_file : str
+        Path to a TSV, gzip-compressed TSV or Parquet file
+
+    Returns:
+    --------
+    df : pandas.DataFrame
+        One row per aligned group
+    """
+    if output_format_for(aligned_file) != 'parquet':
+        return pd.read_csv(aligned_file, sep='\t')
+
+    # Nullable columns come back as pandas extension types; use the NumPy types read_csv gives
+    df = pd.read_parquet(aligned_file)
+    dtypes = {}
+    for name, dtype in df.dtypes.items():
+        if isinstance(dtype, pd.Int64Dtype):
+            dtypes[name] = np.float64 if df[name].isna().any() else np.int64
+        elif isinstance(dtype, pd.Float64Dtype):
+            dtypes[name] = np.float64
+    return df.astype(dtypes)
+
+def _group_rows(aligned_features, features_table):
+    """
+    Flatten aligned groups into member columns.
+
+    Returns:
+    --------
+    group_index, dataset_ids, feature_ids : numpy.ndarray
+        One entry per member, in group order; group_index is the position of
+        its group in aligned_features
+    """
+    group_index, dataset_ids, feature_ids = [], [], []
+    for index, features in enumerate(aligned_features.values()):
+        if isinstance(features, list):
+            # Community detection format: list of dictionaries
+            for feature in features:
+                group_index.append(index)
+                dataset_ids.append(feature['dataset_id'])
+                feature_ids.append(feature['feature_id'])
+        else:
+            # Clique detection format: dictionary mapping dataset_id to feature_id
+            for dataset_id, feature_id in features.items():
+                group_index.append(index)
+                dataset_ids.append(dataset_id)
+                feature_ids.append(feature_id)
+    return (np.array(group_index, dtype=np.int64), np.array(dataset_ids, dtype=np.int64),
+            np.array(feature_ids, dtype=np.int64))
+
+def msms_match_table(aligned_features, features_table, graph):
+    """
+    Collect the MS/MS edges inside every aligned group in one pass.
+
+    For an EdgeGraph the MS/MS edges are joined with the group members as
+    arrays; other graphs fall back to get_msms_matching_info per group.
+    Matches are ordered like get_msms_matching_info: by group, then by the
+    positions of the two features within the group.
+
+    Parameters:
+    -----------
+    aligned_features : dict
+        Aligned groups in community or clique format
+    features_table : FeatureTable
+        Features of all datasets
+    graph : EdgeGraph or networkx.Graph, optional
+        Graph containing edge information
+
+    Returns:
+    --------
+    matches : pandas.DataFrame
+        Columns group (position in aligned_features), dataset1, feature1,
+        dataset2, feature2, cosine and shared_peaks
+    """
+    columns = ['group', 'dataset1', 'feature1', 'dataset2', 'feature2', 'cosine', 'shared_peaks']
+    if graph is None:
+        return pd.DataFrame({name: np.empty(0, dtype=np.int64) for name in columns})
+
+    if not hasattr(graph, 'edge_type'):
+        records = []
+        for index, features in enumerate(aligned_features.values()):
+            for node1, node2, cosine_sim, shared_peaks in get_msms_matching_info(features, graph):
+                dataset1, feature1 = node1.split('_', 1)
+                dataset2, feature2 = node2.split('_', 1)
+                records.append((index, int(dataset1), int(feature1), int(dataset2), int(feature2),
+                                cosine_sim, shared_peaks))
+        return pd.DataFrame.from_records(records, columns=columns)
+
+    group_index, dataset_ids, feature_ids = _group_rows(aligned_features, features_table)
+    starts = np.searchsorted(group_index, group_index)
+    members = pd.DataFrame({
+        'row': features_table.rows(dataset_ids, feature_ids),
+        'group': group_index,
+        'position': np.arange(len(group_index)) - starts,
+    })
+    msms = np.flatnonzero(graph.is_msms)
+    edges = pd.DataFrame({'a': graph.u[msms].astype(np.int64), 'b': graph.v[msms].astype(np.int64),
+                          'cosine': graph.cosine[msms], 'shared_peaks': graph.shared_peaks[msms]})
+    edges = edges.merge(members.rename(columns={'row': 'a', 'position': 'position_a'}), on='a')
+    edges = edges.merge(members.rename(columns={'row': 'b', 'position': 'position_b'}), on=['b', 'group'])
+
+    # node1 is the member that comes first in its group
+    position_a, position_b = edges['position_a'].to_numpy(), edges['position_b'].to_numpy()
+    swap = position_a > position_b
+    first = np.where(swap, edges['b'], edges['a'])
+    second = np.where(swap, edges['a'], edges['b'])
+    order = np.lexsort((np.maximum(position_a, position_b), np.minimum(position_a, position_b),
+                        edges['group'].to_numpy()))
+    return pd.DataFrame({
+        'group': edges['group'].to_numpy()[order],
+        'dataset1': features_table.dataset_id[first[order]].astype(np.int64),
+        'feature1': features_table.feature_id[first[order]].astype(np.int64),
+        'dataset2': features_table.dataset_id[second[order]].astype(np.int64),
+        'feature2': features_table.feature_id[second[order]].astype(np.int64),
+        'cosine': edges['cosine'].to_numpy()[order],
+        'shared_peaks': edges['shared_peaks'].to_numpy()[order],
+    })
+
+def write_aligned_features_tsv(aligned_features, feature_mzs, features_table, output_file, graph=None,
+                               output_format=None, chunk_size=ROWS_PER_CHUNK):
     """
     Write aligned features to a TSV file with MS/MS matching information.
-    
+
+    Rows are written in chunks of chunk_size groups. The feature index, m/z
+    and intensity columns of a chunk are gathered from the FeatureTable with
+    array indexing, and the MS/MS columns come from msms_match_table.
+
     Parameters:
     -----------
     aligned_features : dict
@@ -85,120 +239,101 @@ def write_aligned_features_tsv(aligned_features, feature_mzs, all_list_features,
         - dictionaries mapping dataset_id to feature_id (from clique detection)
     feature_mzs : dict
         Dictionary mapping (group_id, dataset_id, feature_id) to m/z values
-    all_list_features : list
-        List of tuples (filename, features) where features is a list of dictionaries
+    features_table : FeatureTable
+        Features of all datasets (m/z, intensity and file names)
     output_file : str
-        Path to the output TSV file
-    graph : networkx.Graph, optional
+        Path to the output file
+    graph : EdgeGraph or networkx.Graph, optional
         Graph containing edge information for MS/MS similarity data
+    output_format : str, optional
+        'tsv', 'tsv.gz' or 'parquet' (default: from the file name, see output_format_for)
+    chunk_size : int
+        Number of groups per written chunk
     """
     print(f"Writing aligned features to {output_file}...")
-    
-    # Create a list to store rows for the TSV file
-    rows = []
-    
+    output_format = output_format or output_format_for(output_file)
+    if output_format not in ('tsv', 'tsv.gz', 'parquet'):
+        raise ValueError(f"Unknown output format: {output_format}")
+
     # Get filenames for header
-    filenames = [os.path.basename(filename) for filename, _ in all_list_features]
-    
-    # Create header row
-    header = ["Group ID"]
-    
-    # Add columns for each file (feature index, m/z, intensity)
-    for filename in filenames:
-        header.extend([
-            f"{filename}_feature_index",
-            f"{filename}_mz",
-            f"{filename}_intensity"
-        ])
-    
-    # Add MS/MS matching information columns
-    header.extend(["MSMS_Matches", "MSMS_Details"])
-    
-    # Add rows for each aligned group
-    for group_id, features in aligned_features.items():
-        row = [f"Group_{group_id}"]
-        
-        # Check if features is a list (community detection) or a dictionary (clique detection)
-        if isinstance(features, list):
-            # Community detection format: list of dictionaries
-            # Group features by dataset
-            features_by_dataset = defaultdict(list)
-            for feature in features:
-                features_by_dataset[feature['dataset_id']].append(feature)
-            
-            # Add data for each file
-            for dataset_id, (filename, _) in enumerate(all_list_features):
-                if dataset_id in features_by_dataset:
-                    # Use the first feature for this dataset (could be multiple if they're in the same community/clique)
-                    feature = features_by_dataset[dataset_id][0]
-                    feature_id = feature['feature_id']
-                    
-                    # Get original feature data
-                    _, dataset_features = all_list_features[dataset_id]
-                    original_feature = dataset_features[feature_id]
-                    
-                    # Add feature index, m/z, and intensity
-                    row.extend([
-                        feature_id,
-                        original_feature.get('mz', ''),
-                        original_feature.get('intensity', '')
-                    ])
-                else:
-                    # No feature for this dataset in this group
-                    row.extend(['', '', ''])
-        else:
-            # Clique detection format: dictionary mapping dataset_id to feature_id
-            # Add data for each file
-            for dataset_id, (filename, _) in enumerate(all_list_features):
-                if dataset_id in features:
-                    feature_id = features[dataset_id]
-                    
-                    # Get original feature data
-                    _, dataset_features = all_list_features[dataset_id]
-                    original_feature = dataset_features[feature_id]
-                    
-                    # Add feature index, m/z, and intensity
-                    row.extend([
-                        feature_id,
-                        original_feature.get('mz', ''),
-                        original_feature.get('intensity', '')
-                    ])
-                else:
-                    # No feature for this dataset in this group
-                    row.extend(['', '', ''])
-        
+    n_datasets = features_table.n_datasets
+    filenames = [features_table.basename(dataset_id) for dataset_id in range(n_datasets)]
+
+    # Feature id of every (group, dataset); the first member wins if a dataset
+    # occurs more than once in a community
+    group_ids = list(aligned_features)
+    group_index, dataset_ids, feature_ids = _group_rows(aligned_features, features_table)
+    cells, first = np.unique(group_index * n_datasets + dataset_ids, return_index=True)
+    feature_matrix = np.full((len(group_ids), n_datasets), -1, dtype=np.int64)
+    feature_matrix.flat[cells] = feature_ids[first]
+
+    matches = msms_match_table(aligned_features, features_table, graph)
+    match_groups = matches['group'].to_numpy(dtype=np.int64)
+    match_text = [f"{filenames[dataset1]}({feature1})-{filenames[dataset2]}({feature2}):"
+                  f"cos={cosine_sim:.3f},peaks={shared_peaks}"
+                  for dataset1, feature1, dataset2, feature2, cosine_sim, shared_peaks in zip(
+                      matches['dataset1'].tolist(), matches['feature1'].tolist(),
+                      matches['dataset2'].tolist(), matches['feature2'].tolist(),
+                      matches['cosine'].tolist(), matches['shared_peaks'].tolist())]
+    intensity_dtype = 'Int64' if features_table.intensity.dtype.kind in 'iu' else 'Float64'
+
+    def chunk_frame(start, stop):
+        block = feature_matrix[start:stop]
+        missing = block < 0
+        # Missing cells point at the first row of their dataset and are masked below
+        rows = np.minimum(features_table.dataset_offsets[:-1] + np.where(missing, 0, block),
+                          max(len(features_table) - 1, 0))
+
+        data = {"Group ID": [f"Group_{group_id}" for group_id in group_ids[start:stop]]}
+        for dataset_id, filename in enumerate(filenames):
+            mask = missing[:, dataset_id]
+            feature_index = pd.array(np.where(mask, 0, block[:, dataset_id]), dtype='Int64')
+            intensity = pd.array(features_table.intensity[rows[:, dataset_id]], dtype=intensity_dtype)
+            feature_index[mask] = pd.NA
+            intensity[mask] = pd.NA
+            data[f"{filename}_feature_index"] = feature_index
+            data[f"{filename}_mz"] = np.where(mask, np.nan, features_table.mz[rows[:, dataset_id]])
+            data[f"{filename}_intensity"] = intensity
+
         # Add MS/MS matching information
-        msms_matches = get_msms_matching_info(features, graph)
-        
-        if msms_matches:
-            # Format MS/MS matches summary
-            msms_count = len(msms_matches)
-            
-            # Create detailed match information
-            match_details = []
-            for node1, node2, cosine_sim, shared_peaks in msms_matches:
-                # Extract dataset and feature info from node IDs
-                dataset1, feature1 = node1.split('_', 1)
-                dataset2, feature2 = node2.split('_', 1)
-                
-                # Get dataset names
-                dataset1_name = os.path.basename(all_list_features[int(dataset1)][0])
-                dataset2_name = os.path.basename(all_list_features[int(dataset2)][0])
-                
-                match_detail = f"{dataset1_name}({feature1})-{dataset2_name}({feature2}):cos={cosine_sim:.3f},peaks={shared_peaks}"
-                match_details.append(match_detail)
-            
-            row.extend([msms_count, "; ".join(match_details)])
-        else:
-            row.extend([0, "No MS/MS matches"])
-        
-        rows.append(row)
-    
-    # Create DataFrame and write to TSV
-    df = pd.DataFrame(rows, columns=header)
-    df.to_csv(output_file, sep='\t', index=False)
-    
-    print(f"Wrote {len(rows)} aligned feature groups to {output_file}")
+        lo, hi = np.searchsorted(match_groups, [start, stop])
+        counts = np.bincount(match_groups[lo:hi] - start, minlength=stop - start)
+        details = ["No MS/MS matches"] * (stop - start)
+        position = lo
+        for offset in np.flatnonzero(counts).tolist():
+            details[offset] = "; ".join(match_text[position:position + counts[offset]])
+            position += counts[offset]
+        data["MSMS_Matches"] = counts.astype(np.int64)
+        data["MSMS_Details"] = details
+        return pd.DataFrame(data)
+
+    # Stream the chunks to disk; an empty alignment still gets a header
+    bounds = list(range(0, len(group_ids), chunk_size)) or [0]
+    if output_format == 'parquet':
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError("Parquet output requires pyarrow (pip install pyarrow)") from e
+        writer = None
+        try:
+            for start in bounds:
+                table = pa.Table.from_pandas(chunk_frame(start, min(start + chunk_size, len(group_ids))),
+                                             preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(str(output_file), table.schema)
+                writer.write_table(table)
+        finally:
+            if writer is not None:
+                writer.close()
+    else:
+        opener = gzip.open if output_format == 'tsv.gz' else open
+        with opener(output_file, 'wt', newline='') as handle:
+            for start in bounds:
+                chunk_frame(start, min(start + chunk_size, len(group_ids))).to_csv(
+                    handle, sep='\t', index=False, header=start == 0)
+
+    print(f"Wrote {len(group_ids)} aligned feature groups to {output_file}")
 
 def calculate_average_mz(aligned_features, feature_mzs):
     """
@@ -294,72 +429,217 @@ def filter_aligned_features(aligned_features, min_datasets=2):
     
     return filtered_features
 
-def merge_similar_groups(aligned_features, feature_mzs, mz_tolerance=0.01):
+def _group_members(aligned_features, feature_mzs, features_table=None):
     """
-    Merge similar groups based on m/z similarity.
-    
+    Flatten aligned groups into member columns.
+
+    m/z values come from feature_mzs where present, otherwise from the
+    FeatureTable or the community feature dictionaries; RT values from the
+    FeatureTable or the feature dictionaries (NaN if unknown).
+
+    Returns:
+    --------
+    group_index, dataset_ids, mzs, rts : numpy.ndarray
+        One entry per member; group_index is the position of its group in aligned_features
+    """
+    group_index, dataset_ids, feature_ids, mzs, rts = [], [], [], [], []
+    for index, (group_id, features) in enumerate(aligned_features.items()):
+        if isinstance(features, list):
+            # Community detection format: list of dictionaries
+            members = [(feature['dataset_id'], feature['feature_id'],
+                        feature.get('mz', 0), feature.get('rt', np.nan)) for feature in features]
+        else:
+            # Clique detection format: dictionary mapping dataset_id to feature_id
+            members = [(dataset_id, feature_id, 0, np.nan) for dataset_id, feature_id in features.items()]
+        for dataset_id, feature_id, mz, rt in members:
+            group_index.append(index)
+            dataset_ids.append(dataset_id)
+            feature_ids.append(feature_id)
+            mzs.append(feature_mzs.get((group_id, dataset_id, feature_id), mz))
+            rts.append(rt)
+
+    group_index = np.array(group_index, dtype=np.int64)
+    dataset_ids = np.array(dataset_ids, dtype=np.int64)
+    mzs = np.array(mzs, dtype=np.float64)
+    rts = np.array(rts, dtype=np.float64)
+    if features_table is not None and len(group_index):
+        rows = features_table.rows(dataset_ids, feature_ids)
+        mzs = np.where(mzs > 0, mzs, features_table.mz[rows])
+        rts = features_table.rt[rows]
+    return group_index, dataset_ids, mzs, rts
+
+def merge_similar_groups(aligned_features, feature_mzs, mz_tolerance=0.01, rt_tolerance=None,
+                         features_table=None):
+    """
+    Merge similar groups based on m/z (and optionally RT) similarity.
+
+    Groups are swept in order of increasing average m/z. Each group that has
+    not been merged yet absorbs, in m/z order, the following groups whose
+    average m/z is within mz_tolerance of its own (and average RT within
+    rt_tolerance, if given) and which share no dataset with it. Dataset sets
+    are bitmasks, and unmerged groups are kept in one list per mask with
+    next-pointers past merged groups. A group only visits the lists of masks
+    disjoint from its own, so groups it could never absorb are not scanned;
+    the cost is O(G log G) plus, per group, the number of distinct dataset
+    masks in its window (at most 2**n_datasets). Groups rejected only by
+    rt_tolerance are still visited one by one.
+
+    Library function: main.py does not call it, so rt_tolerance has no
+    command-line option.
+
     Parameters:
     -----------
     aligned_features : dict
-        Dictionary mapping group IDs to lists of features
+        Dictionary mapping group IDs to either:
+        - lists of feature dictionaries (from community detection)
+        - dictionaries mapping dataset_id to feature_id (from clique detection)
     feature_mzs : dict
-        Dictionary mapping (group_id, dataset_id, feature_id) to m/z values
+        Dictionary mapping (group_id, dataset_id, feature_id) to m/z values;
+        missing entries fall back to features_table or the feature dictionaries
     mz_tolerance : float
         Tolerance for m/z values to consider groups similar
-        
+    rt_tolerance : float, optional
+        Tolerance for average RT values (default: m/z only)
+    features_table : FeatureTable, optional
+        Table providing m/z and RT for clique-format groups
+
     Returns:
     --------
     merged_features : dict
-        Dictionary with merged aligned features
+        Dictionary with merged aligned features, in the format of the input
     """
-    # Calculate average m/z for each group
-    avg_mzs = calculate_average_mz(aligned_features, feature_mzs)
-    
-    # Sort groups by average m/z
-    sorted_groups = sorted(avg_mzs.items(), key=lambda x: x[1])
-    
-    # Initialize merged groups
-    merged_features = {}
-    merged_group_id = 0
-    
-    # Process groups in order of increasing m/z
-    i = 0
-    while i < len(sorted_groups):
-        group_id, avg_mz = sorted_groups[i]
-        
-        # Start a new merged group
-        current_group = aligned_features[group_id]
-        current_datasets = set(feature['dataset_id'] for feature in current_group)
-        
-        # Look ahead for similar groups
-        j = i + 1
-        while j < len(sorted_groups):
-            next_group_id, next_avg_mz = sorted_groups[j]
-            
-            # Check if m/z difference is within tolerance
-            if next_avg_mz - avg_mz > mz_tolerance:
+    group_ids = list(aligned_features)
+    n_groups = len(group_ids)
+    group_index, dataset_ids, mzs, rts = _group_members(aligned_features, feature_mzs, features_table)
+
+    # Average m/z over members with a known m/z, as calculate_average_mz
+    valid = mzs > 0
+    mz_sums = np.bincount(group_index[valid], weights=mzs[valid], minlength=n_groups)
+    mz_counts = np.bincount(group_index[valid], minlength=n_groups)
+    avg_mzs = np.divide(mz_sums, mz_counts, out=np.zeros(n_groups), where=mz_counts > 0)
+
+    use_rt = rt_tolerance is not None
+    if use_rt:
+        known = ~np.isnan(rts)
+        rt_sums = np.bincount(group_index[known], weights=rts[known], minlength=n_groups)
+        rt_counts = np.bincount(group_index[known], minlength=n_groups)
+        avg_rts = np.divide(rt_sums, rt_counts, out=np.full(n_groups, np.nan), where=rt_counts > 0)
+
+    # Dataset set of every group as an integer bitmask
+    masks = [0] * n_groups
+    for index, dataset_id in zip(group_index.tolist(), dataset_ids.tolist()):
+        masks[index] |= 1 << dataset_id
+    all_datasets = 0
+    for mask in masks:
+        all_datasets |= mask
+
+    order = np.argsort(avg_mzs, kind='stable')
+    sorted_mzs = avg_mzs[order].tolist()
+    sorted_rts = avg_rts[order].tolist() if use_rt else None
+    sorted_masks = [masks[index] for index in order.tolist()]
+    merged = [False] * n_groups
+
+    # Unmerged groups are kept in one bucket per dataset mask (positions in m/z
+    # order), each with its own path-compressed next pointers past merged
+    # groups and past groups already swept as anchors
+    buckets = {}
+    for position, mask in enumerate(sorted_masks):
+        buckets.setdefault(mask, []).append(position)
+    next_alive = {mask: list(range(len(positions) + 1)) for mask, positions in buckets.items()}
+    local_index = [0] * n_groups
+    for positions in buckets.values():
+        for k, position in enumerate(positions):
+            local_index[position] = k
+
+    def find(mask, k):
+        pointers = next_alive[mask]
+        root = k
+        while pointers[root] != root:
+            root = pointers[root]
+        while pointers[k] != root:
+            pointers[k], k = root, pointers[k]
+        return root
+
+    # Unmerged groups per mask inside the current window (anchor, window_end]
+    window_counts = {}
+    window_end = -1
+
+    def enter(mask):
+        window_counts[mask] = window_counts.get(mask, 0) + 1
+
+    def leave(mask):
+        if window_counts[mask] == 1:
+            del window_counts[mask]
+        else:
+            window_counts[mask] -= 1
+
+    merged_positions = []
+    for i in range(n_groups):
+        avg_mz = sorted_mzs[i]
+        while window_end + 1 < n_groups and (window_end < i or sorted_mzs[window_end + 1] - avg_mz <= mz_tolerance):
+            window_end += 1
+            enter(sorted_masks[window_end])
+        if merged[i]:
+            continue
+        current_mask = sorted_masks[i]
+        next_alive[current_mask][local_index[i]] = local_index[i] + 1
+        leave(current_mask)
+        members = [i]
+
+        # Only buckets sharing no dataset with the anchor are visited: the
+        # masks in the window, or the submasks of the free datasets if fewer
+        free = all_datasets & ~current_mask
+        if len(window_counts) <= 1 << bin(free).count('1'):
+            eligible = [mask for mask in window_counts if not mask & current_mask]
+        else:
+            eligible, submask = [], free
+            while True:
+                if submask in window_counts:
+                    eligible.append(submask)
+                if submask == 0:
+                    break
+                submask = (submask - 1) & free
+
+        # First unmerged group of every eligible bucket (all earlier groups are
+        # anchors or merged), in m/z order
+        heap = []
+        for mask in eligible:
+            k = find(mask, 0)
+            heap.append((buckets[mask][k], mask, k))
+        heapq.heapify(heap)
+
+        while heap:
+            j, mask, k = heapq.heappop(heap)
+            if j > window_end:
                 break
-            
-            # Check if groups have overlapping datasets
-            next_group = aligned_features[next_group_id]
-            next_datasets = set(feature['dataset_id'] for feature in next_group)
-            
-            if not current_datasets.intersection(next_datasets):
-                # No overlap, can merge
-                current_group.extend(next_group)
-                current_datasets.update(next_datasets)
-                
-                # Remove this group from consideration
-                sorted_groups.pop(j)
-            else:
-                j += 1
-        
-        # Add merged group
-        merged_features[merged_group_id] = current_group
-        merged_group_id += 1
-        
-        i += 1
-    
+            if mask & current_mask:
+                continue  # overlaps a group merged meanwhile
+            if not use_rt or abs(sorted_rts[j] - sorted_rts[i]) <= rt_tolerance:
+                # No overlap, can merge; skip this group from now on
+                current_mask |= mask
+                members.append(j)
+                merged[j] = True
+                next_alive[mask][k] = k + 1
+                leave(mask)
+                if mask:
+                    continue
+            # Next unmerged group of the same bucket (RT mismatch or empty mask)
+            k = find(mask, k + 1)
+            if k < len(buckets[mask]):
+                heapq.heappush(heap, (buckets[mask][k], mask, k))
+        merged_positions.append(members)
+
+    # Build merged groups without modifying the input
+    sorted_ids = [group_ids[index] for index in order.tolist()]
+    merged_features = {}
+    for merged_group_id, members in enumerate(merged_positions):
+        groups = [aligned_features[sorted_ids[position]] for position in members]
+        if isinstance(groups[0], list):
+            merged_features[merged_group_id] = [feature for group in groups for feature in group]
+        else:
+            merged_features[merged_group_id] = {dataset_id: feature_id for group in groups
+                                                for dataset_id, feature_id in group.items()}
+
     print(f"Merged {len(aligned_features)} groups into {len(merged_features)} groups")
-    
-    return merged_features 
\ No newline at end of file
+
+    return merged_features
@@ -0,0 +1,246 @@
+"""
+Module for sweeping the matching parameters of the graph alignment.
+
+Tuning the m/z and RT tolerances, the cosine threshold and the minimum number
+of shared peaks used to mean one full main.py run per combination. The sweep
+reads the inputs once and computes the candidate pairs and MS/MS cosine scores
+of every dataset pair once, at the loosest settings of the grid. The edges of
+each combination are then selected from those arrays (select_pair_edges),
+followed by clean_multiple_connections, community detection and a summary of
+the resulting groups, so a grid costs one candidate search plus one community
+detection per combination.
+
+Main functions/classes:
+    - ParameterSweep: Runs a parameter grid over one feature table
+    - main: Command-line entry point (python parameter_sweep.py)
+
+Inputs:
+    - Excel files with mass features (as for main.py)
+    - Lists of m/z tolerances, RT tolerances, cosine thresholds and minimum shared peaks
+
+Outputs:
+    - <output_dir>/sweep_summary.tsv: One row per combination with edge, community
+      and group counts
+
+Important arguments:
+    --input-dir: Directory containing Excel files with mass features
+    --mz-tolerances / --rt-tolerances: Tolerances to try (Da / minutes)
+    --cosine-thresholds / --min-shared-peaks: MS/MS settings to try
+    --min-datasets: Minimum datasets for a group to be counted (default: 2)
+    --workers: Worker processes for file ingest, pair comparisons and Louvain (default: 1)
+"""
+import argparse
+import itertools
+import logging
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+import numpy as np
+import pandas as pd
+from read_files import collect_files, iter_read_features
+from feature_table import FeatureTable
+from graph_construction import GraphBuilder, select_pair_edges
+from spectral_similarity import COSINE_CACHE_SIZE
+from edge_graph import EdgeGraph
+from community_detection import detect_communities, group_features_by_community
+from mass_feature_aligner import filter_aligned_features
+
+# Configure logger for this module
+logger = logging.getLogger(__name__)
+
+SUMMARY_FILE_NAME = "sweep_summary.tsv"
+
+
+class ParameterSweep:
+    """
+    Class for evaluating a grid of matching parameters on one feature table.
+
+    Candidate pairs are computed once with the largest tolerances and the
+    smallest min_shared_peaks of the grid. Tighter settings only drop pairs or
+    zero out scores, so the edges of every combination are identical to those
+    of a GraphBuilder run with that combination.
+    """
+
+    def __init__(self, mz_tolerances, rt_tolerances, cosine_thresholds=(0.5,), min_shared_peaks=(3,),
+                 min_datasets=2, workers=1, cosine_cache_size=COSINE_CACHE_SIZE):
+        """
+        Initialize the sweep with the parameter values to combine.
+
+        Parameters:
+        -----------
+        mz_tolerances : list
+            m/z tolerances to try (in Da)
+        rt_tolerances : list
+            RT tolerances to try (in minutes)
+        cosine_thresholds : list
+            Minimum cosine similarities for MS/MS edges to try (default: 0.5)
+        min_shared_peaks : list
+            Minimum numbers of shared peaks to try (default: 3)
+        min_datasets : int
+            Minimum number of datasets for a group to be counted (default: 2)
+        workers : int
+            Number of processes for dataset-pair comparisons and Louvain (default: 1)
+        cosine_cache_size : int
+            Spectrum pairs kept in the cosine cache, 0 to disable (default: COSINE_CACHE_SIZE)
+        """
+        self.mz_tolerances = sorted(set(mz_tolerances))
+        self.rt_tolerances = sorted(set(rt_tolerances))
+        self.cosine_thresholds = sorted(set(cosine_thresholds))
+        self.min_shared_peaks = sorted(set(min_shared_peaks))
+        self.min_datasets = min_datasets
+        self.workers = workers
+        # Loosest settings of the grid; every combination is derived from them
+        self.builder = GraphBuilder(mz_tolerance=self.mz_tolerances[-1], rt_tolerance=self.rt_tolerances[-1],
+                                    cosine_threshold=self.cosine_thresholds[0],
+                                    min_shared_peaks=self.min_shared_peaks[0], workers=workers,
+                                    cosine_cache_size=cosine_cache_size)
+
+    def combinations(self) -> List[Dict[str, Any]]:
+        """
+        Return the settings of every combination in the grid.
+
+        Returns:
+        --------
+        settings : list
+            One dict with mz_tolerance, rt_tolerance, cosine_threshold and
+            min_shared_peaks per combination
+        """
+        return [{'mz_tolerance': mz_tolerance, 'rt_tolerance': rt_tolerance,
+                 'cosine_threshold': cosine_threshold, 'min_shared_peaks': min_shared_peaks}
+                for mz_tolerance, rt_tolerance, cosine_threshold, min_shared_peaks in itertools.product(
+                    self.mz_tolerances, self.rt_tolerances, self.cosine_thresholds, self.min_shared_peaks)]
+
+    def run(self, features: FeatureTable, dataset_index: Optional[list] = None) -> pd.DataFrame:
+        """
+        Evaluate every combination of the grid.
+
+        Parameters:
+        -----------
+        features : FeatureTable
+            Features of all datasets
+        dataset_index : list, optional
+            Precomputed GraphBuilder.index_dataset() columns, one per dataset
+
+        Returns:
+        --------
+        summary : pandas.DataFrame
+            One row per combination: the settings, edge counts before and after
+            cleaning, communities, groups kept, groups covering every dataset,
+            mean group size and the seconds spent on the combination
+        """
+        start = time.time()
+        pair_candidates = self.builder.candidate_pairs(features, dataset_index=dataset_index)
+        n_candidates = sum(len(candidates['idx_i']) for _, candidates in pair_candidates)
+        hits = sum(candidates['cosine_cache_hits'] for _, candidates in pair_candidates)
+        misses = sum(candidates['cosine_cache_misses'] for _, candidates in pair_candidates)
+        logger.info(f"Computed {n_candidates} candidate pairs of {len(pair_candidates)} dataset pairs "
+                    f"in {time.time() - start:.2f} seconds (cosine cache: {hits} hits, {misses} misses)")
+
+        combinations = self.combinations()
+        rows = []
+        for number, settings in enumerate(combinations, 1):
+            logger.info(f"Sweep setting {number}/{len(combinations)}: {settings}")
+            rows.append(self.evaluate(features, pair_candidates, settings))
+        return pd.DataFrame(rows)
+
+    def evaluate(self, features: FeatureTable, pair_candidates: list, settings: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Align the features with one combination of settings and summarize the groups.
+
+        Parameters:
+        -----------
+        features : FeatureTable
+            Features of all datasets
+        pair_candidates : list
+            ((i, j), candidates) from GraphBuilder.candidate_pairs at looser settings
+        settings : dict
+            mz_tolerance, rt_tolerance, cosine_threshold and min_shared_peaks
+
+        Returns:
+        --------
+        row : dict
+            Settings and counts of the combination
+        """
+        start = time.time()
+        builder = GraphBuilder(workers=self.workers, cosine_cache_size=0, **settings)
+        pair_edges = [(pair, select_pair_edges(candidates, settings)) for pair, candidates in pair_candidates]
+        builder.G = EdgeGraph.from_pair_edges(features, pair_edges)
+        edges = builder.G.number_of_edges()
+        msms_edges = int(builder.G.is_msms.sum())
+        G = builder.clean_multiple_connections()
+
+        partition = detect_communities(G, workers=self.workers)
+        groups = filter_aligned_features(group_features_by_community(G, partition),
+                                         min_datasets=self.min_datasets)
+        group_sizes = np.array([len({feature['dataset_id'] for feature in members})
+                                for members in groups.values()], dtype=np.int64)
+
+        return dict(settings,
+                    edges=edges,
+                    msms_edges=msms_edges,
+                    edges_kept=G.number_of_edges(),
+                    communities=len(set(partition.values())),
+                    groups=len(groups),
+                    groups_all_datasets=int(np.count_nonzero(group_sizes == features.n_datasets)),
+                    mean_group_size=float(group_sizes.mean()) if len(group_sizes) else 0.0,
+                    seconds=time.time() - start)
+
+
+def main():
+    """
+    Run a parameter sweep from the command line.
+    """
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    parser = argparse.ArgumentParser(description='Mass Feature Alignment parameter sweep')
+    parser.add_argument('--input-dir', type=str, required=True, help='Directory containing Excel files with mass features')
+    parser.add_argument('--output-dir', type=str, default='output', help='Directory to save the sweep summary')
+    parser.add_argument('--mz-tolerances', type=float, nargs='+', default=[0.01], help='m/z tolerances to try (in Da)')
+    parser.add_argument('--rt-tolerances', type=float, nargs='+', default=[0.5], help='RT tolerances to try (in minutes)')
+    parser.add_argument('--cosine-thresholds', type=float, nargs='+', default=[0.5], help='Minimum cosine similarities for MS/MS edges to try')
+    parser.add_argument('--min-shared-peaks', type=int, nargs='+', default=[3], help='Minimum numbers of shared MS/MS peaks to try')
+    parser.add_argument('--min-datasets', type=int, default=2, help='Minimum number of datasets for a group to be counted')
+    parser.add_argument('--workers', type=int, default=1, help='Number of worker processes for file ingest, dataset-pair comparisons and community detection')
+    parser.add_argument('--no-cache', action='store_true', help='Do not read or write the parsed-input cache next to the input files')
+    parser.add_argument('--cosine-cache-size', type=int, default=COSINE_CACHE_SIZE,
+                        help='Spectrum pairs kept in the MS/MS cosine cache of each process (default: 0, off; helps when many spectra are identical, e.g. replicate injections)')
+    args = parser.parse_args()
+
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(exist_ok=True)
+    start_time = time.time()
+
+    excel_files = collect_files(args.input_dir, file_extension=".xlsx")
+    if not excel_files:
+        logger.error(f"No Excel files found in {args.input_dir}")
+        return
+
+    sweep = ParameterSweep(args.mz_tolerances, args.rt_tolerances, args.cosine_thresholds, args.min_shared_peaks,
+                           min_datasets=args.min_datasets, workers=args.workers,
+                           cosine_cache_size=args.cosine_cache_size)
+
+    # Keep the collect_files order regardless of completion order
+    tables = [None] * len(excel_files)
+    for position, excel_file, table, error in iter_read_features(
+            excel_files, workers=args.workers, use_cache=not args.no_cache):
+        if error is not None:
+            logger.error(f"Error reading {excel_file}: {error}")
+            continue
+        tables[position] = table
+    tables = [table for table in tables if table is not None]
+    features = FeatureTable.concat(tables)
+    dataset_index = [sweep.builder.index_dataset(table) for table in tables]
+
+    summary = sweep.run(features, dataset_index=dataset_index)
+    summary_file = output_dir / SUMMARY_FILE_NAME
+    summary.to_csv(summary_file, sep='\t', index=False)
+    logger.info(f"Sweep summary:\n{summary.to_string(index=False)}")
+    logger.info(f"Wrote {len(summary)} settings to {summary_file}")
+    logger.info(f"Parameter sweep completed in {time.time() - start_time:.2f} seconds")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""
+Module for per-stage profiling of an alignment run.
+
+With main.py --profile every pipeline stage (ingest, graph construction,
+cleaning, community detection, cliques, output writing, visualization) is
+wrapped in StageProfiler.stage(), which records wall and CPU time, the peak
+RSS of the process, the peak of traced Python allocations and the allocation
+sites that grew most during the stage. Stages also report counters such as
+candidate pairs, cosine evaluations and edges kept or dropped. Optionally one
+stage is run under cProfile.
+
+Main functions/classes:
+    - StageProfiler: Records stage measurements and writes them as JSON
+
+Inputs:
+    - Stage names and counters from main.py
+
+Outputs:
+    - <output_dir>/profile.json: One entry per stage plus totals
+    - <output_dir>/profile_<stage>.prof: cProfile data of one stage (pstats format)
+
+Important arguments:
+    - enabled: Without it stages only collect counters and nothing is measured
+    - cprofile_stage: Name of the stage to run under cProfile (default: none)
+    - top_allocations: Number of allocation sites reported per stage (default: 10)
+    - trace_memory: Trace Python allocations with tracemalloc (default: True)
+"""
+import os
+import sys
+import json
+import time
+import logging
+import cProfile
+import tracemalloc
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Configure logger for this module
+logger = logging.getLogger(__name__)
+
+PROFILE_FILE_NAME = "profile.json"
+
+# Stage names used by main.py, in pipeline order
+STAGES = ('ingest', 'build_graph', 'clean_multiple_connections', 'communities', 'cliques',
+          'reference_alignment', 'write_output', 'visualization')
+
+
+def _peak_rss_mb() -> Dict[str, Optional[float]]:
+    """Peak resident set size of this process and of its finished child processes."""
+    if resource is None:
+        return {'peak_rss_mb': None, 'children_peak_rss_mb': None}
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    scale = 1024 ** 2 if sys.platform == 'darwin' else 1024
+    return {
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale,
+        'children_peak_rss_mb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale,
+    }
+
+
+def _children_cpu_seconds() -> float:
+    """CPU time of finished child processes (worker pools)."""
+    times = os.times()
+    return times.children_user + times.children_system
+
+
+class StageProfiler:
+    """
+    Collects wall time, CPU time, memory and counters per pipeline stage.
+
+    ``with profiler.stage(name) as counters:`` measures the block and yields a
+    dictionary the block fills with its counters. A disabled profiler yields a
+    dictionary as well, so call sites do not need to check ``enabled``.
+    tracemalloc is started when the profiler is enabled; it slows allocation-
+    heavy stages down, so profiled timings are somewhat higher than normal ones.
+    Timing-only users (see benchmark) pass trace_memory=False.
+    """
+
+    def __init__(self, enabled: bool = False, output_dir: str = '.',
+                 cprofile_stage: Optional[str] = None, top_allocations: int = 10,
+                 trace_memory: bool = True):
+        self.enabled = enabled
+        self.output_dir = str(output_dir)
+        self.cprofile_stage = cprofile_stage
+        self.top_allocations = top_allocations
+        self.trace_memory = trace_memory
+        self.stages: List[Dict[str, Any]] = []
+        self._start_wall = time.perf_counter()
+        self._start_cpu = time.process_time()
+        self._start_children_cpu = _children_cpu_seconds()
+        if self.enabled and self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[Dict[str, Any]]:
+        """
+        Measure one pipeline stage.
+
+        Inputs:
+            name (str): Stage name (see STAGES)
+
+        Outputs:
+            Dict[str, Any]: Counters of the stage, filled in by the caller
+        """
+        counters: Dict[str, Any] = {}
+        if not self.enabled:
+            yield counters
+            return
+
+        before = None
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            before = tracemalloc.take_snapshot()
+        profile = cProfile.Profile() if name == self.cprofile_stage else None
+        wall, cpu, children_cpu = time.perf_counter(), time.process_time(), _children_cpu_seconds()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield counters
+        finally:
+            if profile is not None:
+                profile.disable()
+            record = {
+                'stage': name,
+                'wall_seconds': time.perf_counter() - wall,
+                'cpu_seconds': time.process_time() - cpu,
+                'children_cpu_seconds': _children_cpu_seconds() - children_cpu,
+            }
+            record.update(_peak_rss_mb())
+            if before is not None:
+                record['traced_peak_mb'] = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+                record['top_allocations'] = self._top_allocations(before)
+            record['counters'] = counters
+            if profile is not None:
+                profile_path = os.path.join(self.output_dir, f"profile_{name}.prof")
+                profile.dump_stats(profile_path)
+                record['cprofile'] = profile_path
+            self.stages.append(record)
+            traced = f", {record['traced_peak_mb']:.1f} MB traced peak" if before is not None else ""
+            logger.info(f"Stage {name}: {record['wall_seconds']:.2f} s wall, "
+                        f"{record['cpu_seconds']:.2f} s CPU{traced}")
+
+    def _top_allocations(self, before) -> List[Dict[str, Any]]:
+        """Allocation sites whose traced memory grew most since ``before``."""
+        after = tracemalloc.take_snapshot()
+        differences = sorted(after.compare_to(before, 'lineno'), key=lambda stat: stat.size_diff, reverse=True)
+        return [{'location': f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                 'size_diff_kb': stat.size_diff / 1024,
+                 'count_diff': stat.count_diff}
+                for stat in differences[:self.top_allocations] if stat.size_diff > 0]
+
+    def write(self, settings: Optional[Dict[str, Any]] = None) -> Optional[str]:
+        """
+        Write the recorded stages to <output_dir>/profile.json.
+
+        Inputs:
+            settings (Optional[Dict[str, Any]]): Run settings stored alongside the stages
+
+        Outputs:
+            Optional[str]: Path of the written file, None if profiling is disabled
+        """
+        if not self.enabled:
+            return None
+        profile_path = os.path.join(self.output_dir, PROFILE_FILE_NAME)
+        total = {
+            'wall_seconds': time.perf_counter() - self._start_wall,
+            'cpu_seconds': time.process_time() - self._start_cpu,
+            'children_cpu_seconds': _children_cpu_seconds() - self._start_children_cpu,
+        }
+        total.update(_peak_rss_mb())
+        with open(profile_path, 'w') as f:
+            json.dump({'settings': settings or {}, 'total': total, 'stages': self.stages}, f, indent=2)
+        logger.info(f"Wrote profile of {len(self.stages)} stages to {profile_path}")
+        return profile_path
@@ -6,10 +6,15 @@ including Excel, TSV, MSP, and MGF files. It handles the extraction of key
 information such as m/z values, retention times, and peak intensities.
 
 Main functions/classes:
+    - parse_msms_column: Parses a whole column of MS/MS strings into flat peak arrays
+    - msms_column_to_store: Builds a dataset-level sparse SpectrumStore from MS/MS strings
     - read_mgf: Reads features from MGF format files
     - read_msp: Reads features from MSP format files  
+    - iter_mgf_spectra / iter_msp_spectra: Stream spectra of memory-mapped MGF/MSP files
     - read_excel: Reads features from Excel files with specific column mapping
-    - read_features: Main function that auto-detects format and reads features
+    - read_feature_table: Auto-detects the format and reads a file into a FeatureTable
+    - read_features: Same as read_feature_table, returned as a list of feature dictionaries
+    - iter_read_features: Reads many files in a process pool, yielding each as it completes
     - collect_files: Collects all compatible files from a directory
 
 Inputs:
@@ -18,25 +23,41 @@ Inputs:
     - TSV files with tab-separated values
 
 Outputs:
-    - List of dictionaries containing feature information (peak_id, mz, rt, intensity, etc.)
+    - One FeatureTable per file (mz, rt, intensity columns, labels such as peak_id/scan/title)
+    - One sparse SpectrumStore per file, held by the table (for Excel files a
+      LazySpectrumStore that decodes MS/MS strings when they are first compared)
+    - List of dictionaries containing feature information for the list readers
     - File metadata and dataset identification
 
 Important arguments:
     - file_path: Path to the input file
     - input_dir: Directory containing multiple input files
+    - use_cache: Reuse parsed results from the on-disk feature cache (see feature_cache)
 """
 import os
+import mmap
 import pandas as pd
 import re
 import warnings
-from typing import List, Dict, Tuple, Any, Optional
+from typing import List, Dict, Tuple, Any, Optional, Iterable, Iterator
 import glob
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from io import StringIO
 import numpy as np
+from spectral_similarity import SpectrumStore, LazySpectrumStore
+from feature_table import FeatureTable
+import feature_cache
 
 # Configuration for MS/MS array processing
 MAX_MZ = 2000  # Maximum m/z value for array size
 MIN_INTENSITY = 0.0  # Minimum intensity threshold
 
+# Bump whenever parsing output changes so cached inputs are re-parsed
+PARSER_VERSION = 4
+
+# Start of the first line after a run of fragment peak lines
+_NON_PEAK_LINE = re.compile(rb'^[^0-9]', re.MULTILINE)
+
 
 def parse_msms_string_to_arrays(msms_string: str, 
                                max_mz: int = MAX_MZ,
@@ -94,40 +115,153 @@ def parse_msms_string_to_arrays(msms_string: str,
     return peak_present, intensities
 
 
+def parse_msms_column(msms_strings,
+                      max_mz: int = MAX_MZ,
+                      min_intensity: float = MIN_INTENSITY) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Parse a whole column of MS/MS spectrum strings into flat peak arrays in one pass.
+    
+    Every spectrum is rewritten as "row m/z intensity" lines and handed to the
+    pandas C parser, so the per-peak work happens outside the Python interpreter.
+    Nominal m/z conversion, bounds and intensity threshold are the same as in
+    parse_msms_string_to_arrays. Missing values (NaN/None) mean "no MS/MS".
+    
+    Inputs:
+        msms_strings (sequence): MS/MS strings, one per feature
+        max_mz (int): Maximum m/z value for array size
+        min_intensity (float): Minimum intensity threshold
+        
+    Outputs:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]:
+            - Row (feature) index of each peak
+            - Nominal m/z of each peak
+            - Intensity of each peak (float32)
+    """
+    lines = []
+    for row, msms_string in enumerate(msms_strings):
+        if isinstance(msms_string, str) and msms_string.strip():
+            lines.append(f"{row} " + msms_string.strip().replace(';', f"\n{row} "))
+    
+    if not lines:
+        return (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64),
+                np.empty(0, dtype=np.float32))
+    
+    peaks = pd.read_csv(StringIO("\n".join(lines)), sep=r'\s+', header=None,
+                        names=['row', 'mz', 'intensity'], usecols=[0, 1, 2],
+                        on_bad_lines='skip', engine='c')
+    rows = peaks['row'].to_numpy(dtype=np.int64)
+    mz = pd.to_numeric(peaks['mz'], errors='coerce').to_numpy(dtype=np.float64)
+    intensity = pd.to_numeric(peaks['intensity'], errors='coerce').to_numpy(dtype=np.float64)
+    
+    parsed = ~(np.isnan(mz) | np.isnan(intensity))
+    malformed = peaks['mz'].notna().to_numpy() & ~parsed  # blank segments are not errors
+    if malformed.any():
+        warnings.warn(f"Skipped {int(malformed.sum())} malformed MS/MS peaks")
+    
+    # Convert to nominal m/z using rounding (np.rint rounds half to even like round())
+    nominal_mz = np.rint(np.where(parsed, mz, -1)).astype(np.int64)
+    keep = parsed & (nominal_mz >= 0) & (nominal_mz < max_mz) & (intensity >= min_intensity)
+    
+    return rows[keep], nominal_mz[keep], intensity[keep].astype(np.float32)
+
+
+def msms_column_to_store(msms_strings,
+                         max_mz: int = MAX_MZ,
+                         min_intensity: float = MIN_INTENSITY) -> SpectrumStore:
+    """
+    Convert a column of MS/MS strings to a sparse dataset-level spectrum store.
+    
+    Inputs:
+        msms_strings (sequence): MS/MS strings, one per feature
+        max_mz (int): Maximum m/z value (peaks at or above it are dropped)
+        min_intensity (float): Minimum intensity threshold
+        
+    Outputs:
+        SpectrumStore: One row per feature, empty for features without MS/MS
+    """
+    rows, nominal_mz, intensities = parse_msms_column(msms_strings, max_mz, min_intensity)
+    return SpectrumStore.from_peaks(rows, nominal_mz, intensities, len(msms_strings))
+
+
+def attach_spectrum_store(features: List[Dict[str, Any]],
+                          store: SpectrumStore) -> List[Dict[str, Any]]:
+    """
+    Point every feature at its row of a shared spectrum store.
+    
+    Inputs:
+        features (List[Dict[str, Any]]): Feature dictionaries, in store row order
+        store (SpectrumStore): Store holding one spectrum per feature
+        
+    Outputs:
+        List[Dict[str, Any]]: The same features with 'msms_store', 'msms_index' and 'has_msms'
+    """
+    for index, (feature, flag) in enumerate(zip(features, store.has_msms.tolist())):
+        feature['msms_store'] = store
+        feature['msms_index'] = index
+        feature['has_msms'] = flag  # Quick check for MS/MS availability
+    return features
+
+
 def add_msms_arrays_to_feature(feature: Dict[str, Any], 
                               max_mz: int = MAX_MZ,
                               min_intensity: float = MIN_INTENSITY) -> Dict[str, Any]:
     """
-    Add MS/MS boolean and intensity arrays to a feature dictionary.
+    Add a single-spectrum MS/MS store to a feature dictionary.
+    
+    Readers keep one store per dataset in their FeatureTable; this helper
+    is kept for features created one at a time.
     
     Inputs:
         feature (Dict[str, Any]): Feature dictionary from file reading
-        max_mz (int): Maximum m/z value for array size
+        max_mz (int): Maximum m/z value (peaks at or above it are dropped)
         min_intensity (float): Minimum intensity threshold
         
     Outputs:
-        Dict[str, Any]: Feature dictionary with added 'msms_peaks' and 'msms_intensities'
+        Dict[str, Any]: Feature dictionary with added 'msms_store' and 'msms_index'
     """
     # Extract MS/MS string from feature
     msms_string = feature.get('ms2', '') or feature.get('msms', '') or feature.get('MSMS spectrum', '')
     
-    # Convert to arrays
-    peak_present, intensities = parse_msms_string_to_arrays(msms_string, max_mz, min_intensity)
-    
-    # Add arrays to feature
-    feature['msms_peaks'] = peak_present
-    feature['msms_intensities'] = intensities
-    feature['has_msms'] = np.any(peak_present)  # Quick check for MS/MS availability
+    store = msms_column_to_store([msms_string], max_mz, min_intensity)
+    attach_spectrum_store([feature], store)
     
     return feature
 
 
-def read_mgf(file_path: str) -> List[Dict[str, Any]]:
+def _read_with_cache(file_path: str, reader: str, parse, use_cache: bool) -> FeatureTable:
+    """
+    Return the parsed feature table from the on-disk cache, parsing and caching on a miss.
+    
+    Inputs:
+        file_path (str): Input file
+        reader (str): Reader name used in the cache key ('excel', 'mgf', 'msp')
+        parse (callable): Parser returning a FeatureTable for file_path
+        use_cache (bool): If False, always parse and never write the cache
+        
+    Outputs:
+        FeatureTable: Single-dataset table of the file
+    """
+    # Hash the file once for both the lookup and the write
+    cache_path = feature_cache.cache_entry_path(file_path, reader, PARSER_VERSION) if use_cache else None
+    if cache_path is not None:
+        table = feature_cache.load_cached_table(file_path, reader, PARSER_VERSION, cache_path=cache_path)
+        if table is not None:
+            return table
+    
+    table = parse(file_path)
+    
+    if cache_path is not None and len(table):
+        feature_cache.save_cached_table(file_path, reader, PARSER_VERSION, table, cache_path=cache_path)
+    return table
+
+
+def read_mgf(file_path: str, use_cache: bool = True) -> List[Dict[str, Any]]:
     """
     Read mass features from an MGF (Mascot Generic Format) file and preprocess MS/MS data into arrays.
     
     Inputs:
         file_path (str): Path to the MGF file to read
+        use_cache (bool): Load/store the parsed result in the on-disk feature cache
     
     Outputs:
         List[Dict[str, Any]]: List of feature dictionaries containing:
@@ -136,96 +270,230 @@ def read_mgf(file_path: str) -> List[Dict[str, Any]]:
             - precursor_mz: Precursor m/z value
             - charge: Ion charge state
             - signal_intensity: Peak intensity
-            - fragment_spectrum: List of (mz, intensity) tuples for MS/MS
-            - msms_peaks: Boolean array for fast similarity calculation
-            - msms_intensities: Intensity array for fast similarity calculation
-    """
-    list_features = []
-    with open(file_path, 'r') as file:
-        lines = file.readlines()
-        feature = {}
-        for line in lines:
-            if line.startswith("BEGIN IONS"):
-                feature = {}
-            elif line.startswith("TITLE"):
-                feature['title'] = line.split('=')[1].strip()
-            elif line.startswith("RTINSECONDS"):
-                feature['retention_time'] = float(line.split('=')[1].strip())
-                # Convert to minutes for consistency with other formats
-                feature['rt'] = feature['retention_time'] / 60.0
-            elif line.startswith("PEPMASS"):
-                feature['precursor_mz'] = float(line.split('=')[1].split()[0])
-                feature['mz'] = feature['precursor_mz']  # Standardize field name
-            elif line.startswith("CHARGE"):
-                feature['charge'] = int(line.split('=')[1].strip().replace('+', ''))
-            elif line.startswith("Signal_intensity"):
-                feature['signal_intensity'] = float(line.split('=')[1].strip())
-                feature['intensity'] = feature['signal_intensity']  # Standardize field name
-            elif line[0].isdigit():
-                if 'fragment_spectrum' not in feature:
-                    feature['fragment_spectrum'] = []
-                mz, intensity = map(float, line.split())
-                feature['fragment_spectrum'].append((mz, intensity))
-            elif line.startswith("END IONS"):
-                # Convert fragment spectrum to MS/MS string format for array processing
-                if 'fragment_spectrum' in feature and feature['fragment_spectrum']:
-                    msms_string = ';'.join([f"{mz} {intensity}" for mz, intensity in feature['fragment_spectrum']])
-                    feature['ms2'] = msms_string
-                else:
-                    feature['ms2'] = ''
-                
-                # Add MS/MS arrays to feature
-                feature = add_msms_arrays_to_feature(feature)
-                
-                list_features.append(feature)
-    return list_features
-
-def read_msp(file_path: str) -> List[Dict[str, Any]]:
+            - msms_store: Dataset-level sparse SpectrumStore shared by all features
+            - msms_index: Row of the feature's spectrum in msms_store
+    """
+    return _read_with_cache(file_path, 'mgf', _parse_mgf, use_cache).records()
+
+
+def _parse_mgf(file_path: str) -> FeatureTable:
+    """Parse an MGF file into a FeatureTable (see read_mgf)."""
+    return _collect_spectra(file_path, iter_mgf_spectra(file_path))
+
+
+def iter_mgf_spectra(file_path: str) -> Iterator[Tuple[Dict[str, Any], np.ndarray, np.ndarray]]:
+    """
+    Stream the spectra of an MGF file one at a time.
+    
+    The file is memory-mapped; header lines are decoded one by one while each
+    run of peak lines is parsed into arrays in one step, so no per-peak Python
+    objects are created.
+    
+    Inputs:
+        file_path (str): Path to the MGF file to read
+    
+    Outputs:
+        Iterator[Tuple[Dict[str, Any], np.ndarray, np.ndarray]]:
+            - Feature dictionary (title, rt, mz, charge, intensity, ...)
+            - Fragment m/z values (float64)
+            - Fragment intensities (float64)
+    """
+    feature = {}
+    peaks = []
+    for item in _iter_mapped_lines(file_path):
+        if isinstance(item, tuple):
+            peaks.append(item)
+            continue
+        line = item
+        if line.startswith("BEGIN IONS"):
+            feature = {}
+            peaks = []
+        elif line.startswith("TITLE"):
+            feature['title'] = line.split('=')[1].strip()
+        elif line.startswith("RTINSECONDS"):
+            feature['retention_time'] = float(line.split('=')[1].strip())
+            # Convert to minutes for consistency with other formats
+            feature['rt'] = feature['retention_time'] / 60.0
+        elif line.startswith("PEPMASS"):
+            feature['precursor_mz'] = float(line.split('=')[1].split()[0])
+            feature['mz'] = feature['precursor_mz']  # Standardize field name
+        elif line.startswith("CHARGE"):
+            feature['charge'] = int(line.split('=')[1].strip().replace('+', ''))
+        elif line.startswith("Signal_intensity"):
+            feature['signal_intensity'] = float(line.split('=')[1].strip())
+            feature['intensity'] = feature['signal_intensity']  # Standardize field name
+        elif line.startswith("END IONS"):
+            yield (feature,) + _join_peak_runs(peaks)
+
+
+def read_msp(file_path: str, use_cache: bool = True) -> List[Dict[str, Any]]:
     """
     Read mass features from an MSP format file and preprocess MS/MS data into arrays.
     
     Inputs:
         file_path (str): Path to the MSP file to read
+        use_cache (bool): Load/store the parsed result in the on-disk feature cache
     
     Outputs:
-        List[Dict[str, Any]]: List of feature dictionaries with MS/MS arrays
-    """
-    list_features = []
-    with open(file_path, 'r') as file:
-        lines = file.readlines()
-        feature = {}
-        for line in lines:
-            if line.startswith("Name:"):
-                feature = {'fragment_spectrum': []}
-            elif line.startswith("PrecursorMZ:"):
-                feature['precursor_mz'] = float(line.split(':')[1].strip())
-                feature['mz'] = feature['precursor_mz']  # Standardize field name
-            elif line.startswith("RetentionTime:"):
-                feature['retention_time'] = float(line.split(':')[1].strip())
-                feature['rt'] = feature['retention_time']  # Standardize field name
-            elif line.startswith("Signal_intensity"):
-                feature['signal_intensity'] = float(line.split(':')[1].strip())
-                feature['intensity'] = feature['signal_intensity']  # Standardize field name
-            elif line[0].isdigit():
-                mz, intensity = map(float, line.split())
-                feature['fragment_spectrum'].append((mz, intensity))
-            elif line.startswith("Num peaks:"):
-                pass
-            elif line == '\n':
-                # Convert fragment spectrum to MS/MS string format for array processing
-                if 'fragment_spectrum' in feature and feature['fragment_spectrum']:
-                    msms_string = ';'.join([f"{mz} {intensity}" for mz, intensity in feature['fragment_spectrum']])
-                    feature['ms2'] = msms_string
-                else:
-                    feature['ms2'] = ''
-                
-                # Add MS/MS arrays to feature
-                feature = add_msms_arrays_to_feature(feature)
-                
-                list_features.append(feature)
-    return list_features
-
-def read_excel(file_path: str) -> List[Dict[str, Any]]:
+        List[Dict[str, Any]]: List of feature dictionaries referencing a shared SpectrumStore
+    """
+    return _read_with_cache(file_path, 'msp', _parse_msp, use_cache).records()
+
+
+def _parse_msp(file_path: str) -> FeatureTable:
+    """Parse an MSP file into a FeatureTable (see read_msp)."""
+    return _collect_spectra(file_path, iter_msp_spectra(file_path))
+
+
+def iter_msp_spectra(file_path: str) -> Iterator[Tuple[Dict[str, Any], np.ndarray, np.ndarray]]:
+    """
+    Stream the spectra of an MSP file one at a time (see iter_mgf_spectra).
+    
+    Records start with a "Name:" line and end at a blank line or the end of the file.
+    
+    Inputs:
+        file_path (str): Path to the MSP file to read
+    
+    Outputs:
+        Iterator[Tuple[Dict[str, Any], np.ndarray, np.ndarray]]:
+            Feature dictionary, fragment m/z values and fragment intensities
+    """
+    feature = None
+    peaks = []
+    for item in _iter_mapped_lines(file_path):
+        if isinstance(item, tuple):
+            peaks.append(item)
+            continue
+        line = item
+        if line.startswith("Name:"):
+            feature = {}
+            peaks = []
+        elif feature is None:
+            continue
+        elif line.startswith("PrecursorMZ:"):
+            feature['precursor_mz'] = float(line.split(':')[1].strip())
+            feature['mz'] = feature['precursor_mz']  # Standardize field name
+        elif line.startswith("RetentionTime:"):
+            feature['retention_time'] = float(line.split(':')[1].strip())
+            feature['rt'] = feature['retention_time']  # Standardize field name
+        elif line.startswith("Signal_intensity"):
+            feature['signal_intensity'] = float(line.split(':')[1].strip())
+            feature['intensity'] = feature['signal_intensity']  # Standardize field name
+        elif not line.strip():
+            yield (feature,) + _join_peak_runs(peaks)
+            feature = None
+    
+    # Last record without a trailing blank line
+    if feature is not None:
+        yield (feature,) + _join_peak_runs(peaks)
+
+
+def _iter_mapped_lines(file_path: str) -> Iterator[Any]:
+    """
+    Memory-map a text spectrum file and yield its content in file order.
+    
+    Lines that do not start with a digit are yielded as str. Each run of
+    consecutive lines starting with a digit (fragment peaks) is yielded as one
+    (mz, intensity) tuple of float64 arrays.
+    """
+    if os.path.getsize(file_path) == 0:
+        return
+    with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        size = len(mm)
+        pos = 0
+        while pos < size:
+            if mm[pos:pos + 1].isdigit():
+                match = _NON_PEAK_LINE.search(mm, pos)
+                end = match.start() if match else size
+                yield _parse_peak_block(mm[pos:end])
+            else:
+                end = mm.find(b'\n', pos)
+                end = size if end < 0 else end + 1
+                yield mm[pos:end].decode('utf-8', errors='replace')
+            pos = end
+
+
+def _parse_peak_block(block: bytes) -> Tuple[np.ndarray, np.ndarray]:
+    """Parse consecutive "m/z intensity" lines into two float64 arrays."""
+    tokens = block.split()
+    n_lines = block.count(b'\n') + (not block.endswith(b'\n'))
+    if len(tokens) == 2 * n_lines:
+        try:
+            values = np.array(tokens, dtype=np.float64).reshape(-1, 2)
+            return values[:, 0], values[:, 1]
+        except ValueError:
+            pass
+    
+    # Slow path: extra columns (e.g. peak annotations) or malformed lines
+    mz, intensity = [], []
+    skipped = 0
+    for line in block.splitlines():
+        parts = line.split()
+        try:
+            mz_value, intensity_value = float(parts[0]), float(parts[1])
+        except (IndexError, ValueError):
+            skipped += 1
+            continue
+        mz.append(mz_value)
+        intensity.append(intensity_value)
+    if skipped:
+        warnings.warn(f"Skipped {skipped} malformed MS/MS peaks")
+    return np.array(mz, dtype=np.float64), np.array(intensity, dtype=np.float64)
+
+
+def _join_peak_runs(peaks: List[Tuple[np.ndarray, np.ndarray]]) -> Tuple[np.ndarray, np.ndarray]:
+    """Concatenate the peak runs of one spectrum."""
+    if not peaks:
+        return np.empty(0, dtype=np.float64), np.empty(0, dtype=np.float64)
+    if len(peaks) == 1:
+        return peaks[0]
+    return (np.concatenate([mz for mz, _ in peaks]),
+            np.concatenate([intensity for _, intensity in peaks]))
+
+
+def _collect_spectra(file_path: str,
+                     spectra: Iterable[Tuple[Dict[str, Any], np.ndarray, np.ndarray]],
+                     max_mz: int = MAX_MZ,
+                     min_intensity: float = MIN_INTENSITY) -> FeatureTable:
+    """
+    Gather streamed spectra into a FeatureTable with one shared SpectrumStore.
+    
+    Nominal m/z conversion, bounds and intensity threshold are the same as in
+    parse_msms_column.
+    
+    Inputs:
+        file_path (str): Source file of the spectra
+        spectra (Iterable): (feature, mz, intensity) tuples, e.g. from iter_mgf_spectra
+        max_mz (int): Maximum m/z value (peaks at or above it are dropped)
+        min_intensity (float): Minimum intensity threshold
+        
+    Outputs:
+        FeatureTable: Single-dataset table of the file
+    """
+    list_features, mz_runs, intensity_runs, lengths = [], [], [], []
+    for feature, mz, intensity in spectra:
+        list_features.append(feature)
+        mz_runs.append(mz)
+        intensity_runs.append(intensity)
+        lengths.append(len(mz))
+    
+    if not list_features:
+        return FeatureTable.from_columns(file_path, [], [], [])
+    
+    rows = np.repeat(np.arange(len(list_features), dtype=np.int64), lengths)
+    mz = np.concatenate(mz_runs)
+    intensity = np.concatenate(intensity_runs)
+    
+    # Convert to nominal m/z using rounding (np.rint rounds half to even like round())
+    nominal_mz = np.rint(mz).astype(np.int64)
+    keep = (nominal_mz >= 0) & (nominal_mz < max_mz) & (intensity >= min_intensity)
+    
+    store = SpectrumStore.from_peaks(rows[keep], nominal_mz[keep],
+                                     intensity[keep].astype(np.float32), len(list_features))
+    return FeatureTable.from_features(list_features, file_path, spectra=store)
+
+
+def read_excel(file_path: str, use_cache: bool = True) -> List[Dict[str, Any]]:
     """
     Read features from an Excel file and preprocess MS/MS data into arrays.
     
@@ -233,14 +501,20 @@ def read_excel(file_path: str) -> List[Dict[str, Any]]:
     -----------
     file_path : str
         Path to the Excel file
+    use_cache : bool
+        Load/store the parsed result in the on-disk feature cache (default: True)
         
     Returns:
     --------
     list
-        List of feature dictionaries with MS/MS arrays
+        List of feature dictionaries referencing a shared SpectrumStore
     """
     print(f"Reading features from {file_path}...")
-    
+    return _read_with_cache(file_path, 'excel', _parse_excel, use_cache).records()
+
+
+def _parse_excel(file_path: str) -> FeatureTable:
+    """Parse an Excel file into a FeatureTable (see read_excel)."""
     # Determine the engine based on file extension
     _, ext = os.path.splitext(file_path)
     if ext.lower() in ['.xlsx', '.xlsm']:
@@ -259,32 +533,36 @@ def read_excel(file_path: str) -> List[Dict[str, Any]]:
         if missing_columns:
             warnings.warn(f"Missing columns in {file_path}: {missing_columns}")
         
-        # Extract features
-        features = []
-        for _, row in df.iterrows():
-            try:
-                feature = {
-                    'peak_id': row.get('Peak ID', ''),
-                    'scan': row.get('Scan', 0),
-                    'rt': row.get('RT (min)', 0.0),
-                    'mz': row.get('Precursor m/z', 0.0),
-                    'intensity': row.get('Height', 0.0),
-                    'ms2': row.get('MSMS spectrum', '')
-                }
-                
-                # Add MS/MS arrays to feature
-                feature = add_msms_arrays_to_feature(feature)
-                
-                features.append(feature)
-            except Exception as e:
-                warnings.warn(f"Error processing row in {file_path}: {e}")
+        # Pull each field out as a whole column instead of iterating rows
+        n_rows = len(df)
         
-        print(f"Extracted {len(features)} features from {file_path}")
-        return features
+        def column(name, default):
+            if name in df.columns:
+                return df[name].to_numpy()
+            return np.full(n_rows, default, dtype=object)
+        
+        peak_ids = column('Peak ID', '')
+        scans = column('Scan', 0)
+        rts = column('RT (min)', 0.0)
+        mzs = column('Precursor m/z', 0.0)
+        heights = column('Height', 0.0)
+        msms_strings = column('MSMS spectrum', '')
+        # Empty cells come back as NaN; store them as empty strings
+        msms_strings = np.array([value if isinstance(value, str) else '' for value in msms_strings],
+                                dtype=object)
+        
+        # Keep the raw strings; spectra are decoded when they are first compared
+        store = LazySpectrumStore.from_strings(msms_strings, MAX_MZ, MIN_INTENSITY)
+        
+        table = FeatureTable.from_columns(file_path, mzs, rts, heights, store,
+                                          labels={'peak_id': peak_ids, 'scan': scans})
+        
+        print(f"Extracted {len(table)} features from {file_path}")
+        return table
     
     except Exception as e:
         print(f"Error reading {file_path}: {e}")
-        return []
+        return FeatureTable.from_columns(file_path, [], [], [])
 
 def collect_files(directory: str, file_extension: str = ".xlsx") -> List[str]:
     """
@@ -320,27 +598,115 @@ def collect_files(directory: str, file_extension: str = ".xlsx") -> List[str]:
     print(f"Found {len(files)} files")
     return files
 
-def read_features(file_path: str) -> List[Dict[str, Any]]:
+def read_feature_table(file_path: str, use_cache: bool = True) -> FeatureTable:
     """
-    Read features from a file based on its extension.
+    Read a file into a single-dataset FeatureTable based on its extension.
     
     Parameters:
     -----------
     file_path : str
-        Path to the file
+        Path to the file (.xlsx/.xls/.xlsm, .mgf or .msp)
+    use_cache : bool
+        Load/store the parsed result in the on-disk feature cache (default: True)
         
     Returns:
     --------
-    list
-        List of feature dictionaries
+    FeatureTable
+        Columnar features of the file with its SpectrumStore
     """
     _, ext = os.path.splitext(file_path)
     
     if ext.lower() in ['.xlsx', '.xls', '.xlsm']:
-        return read_excel(file_path)
+        print(f"Reading features from {file_path}...")
+        return _read_with_cache(file_path, 'excel', _parse_excel, use_cache)
+    elif ext.lower() == '.mgf':
+        return _read_with_cache(file_path, 'mgf', _parse_mgf, use_cache)
+    elif ext.lower() == '.msp':
+        return _read_with_cache(file_path, 'msp', _parse_msp, use_cache)
     else:
         raise ValueError(f"Unsupported file extension: {ext}")
 
+def read_features(file_path: str, use_cache: bool = True) -> List[Dict[str, Any]]:
+    """
+    Read features from a file based on its extension.
+    
+    Parameters:
+    -----------
+    file_path : str
+        Path to the file
+    use_cache : bool
+        Load/store the parsed result in the on-disk feature cache (default: True)
+        
+    Returns:
+    --------
+    list
+        List of feature dictionaries (see FeatureTable.records)
+    """
+    return read_feature_table(file_path, use_cache=use_cache).records()
+
+def _read_features_task(file_path: str, use_cache: bool) -> Tuple[Optional[FeatureTable], Optional[str]]:
+    """Pool entry point: read one file, returning (table, error message)."""
+    try:
+        return read_feature_table(file_path, use_cache=use_cache), None
+    except Exception as e:
+        return None, str(e)
+
+def iter_read_features(file_paths: List[str], workers: int = 1, use_cache: bool = True,
+                       max_pending: Optional[int] = None):
+    """
+    Read several files, yielding each dataset as soon as it has been parsed.
+    
+    With more than one worker the files are parsed in a process pool. At most
+    max_pending files are in flight at a time (a bounded queue), so parsed
+    datasets do not pile up in memory faster than the caller consumes them, and
+    the caller can index each dataset while the remaining files are still
+    being read.
+    
+    Parameters:
+    -----------
+    file_paths : list
+        Files to read (any extension supported by read_feature_table)
+    workers : int
+        Number of worker processes (default: 1, read in the calling process)
+    use_cache : bool
+        Load/store the parsed results in the on-disk feature cache
+    max_pending : int, optional
+        Maximum number of files queued or being parsed (default: 2 * workers)
+        
+    Yields:
+    -------
+    tuple
+        (position in file_paths, file_path, FeatureTable or None, error message or None),
+        in completion order
+    """
+    if workers <= 1 or len(file_paths) <= 1:
+        for position, file_path in enumerate(file_paths):
+            table, error = _read_features_task(file_path, use_cache)
+            yield position, file_path, table, error
+        return
+    
+    max_pending = max_pending or 2 * workers
+    with ProcessPoolExecutor(max_workers=min(workers, len(file_paths))) as executor:
+        queued = iter(enumerate(file_paths))
+        pending = {}
+        
+        def submit_next():
+            for position, file_path in queued:
+                future = executor.submit(_read_features_task, file_path, use_cache)
+                pending[future] = (position, file_path)
+                return
+        
+        for _ in range(max_pending):
+            submit_next()
+        
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                position, file_path = pending.pop(future)
+                submit_next()
+                table, error = future.result()
+                yield position, file_path, table, error
+
 def test_read_excel(directory: str) -> None:
     """
     Test reading Excel files from a directory.
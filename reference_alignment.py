@@ -0,0 +1,314 @@
+"""
+Module for reference-anchored alignment of mass features.
+
+Instead of comparing every dataset with every other dataset (D * (D - 1) / 2
+comparisons), each dataset is compared once with a consensus feature table
+built from the datasets aligned before it. Matched features join their
+consensus feature, whose m/z and RT are the running means of its members;
+unmatched features start new consensus features. The number of comparisons
+is therefore linear in the number of datasets.
+
+Main functions/classes:
+    - ConsensusTable: Growing table of consensus features (m/z, RT, spectrum, members)
+    - ReferenceAligner: Aligns datasets one by one against the consensus table
+
+Inputs:
+    - FeatureTable with the features of all datasets
+    - Dataset columns from graph_construction.dataset_columns (optional, precomputed)
+
+Outputs:
+    - Aligned groups in the clique format ({dataset_id: feature_id} per group),
+      written with mass_feature_aligner.write_aligned_features_tsv
+    - EdgeGraph of the accepted matches (feature -> representative feature of its
+      consensus), used for the MS/MS columns of the TSV output
+
+Important arguments:
+    - mz_tolerance: Maximum m/z difference to a consensus feature (default: 0.01 Da)
+    - rt_tolerance: Maximum RT difference to a consensus feature (default: 0.5 min)
+    - cosine_threshold / min_shared_peaks: MS/MS matching settings, as in GraphBuilder
+"""
+import logging
+import numpy as np
+from typing import Dict, List, Tuple
+from spectral_similarity import SpectrumStore, COSINE_CACHE_SIZE
+from graph_construction import dataset_columns, compare_dataset_pair, best_connection_mask
+from edge_graph import EdgeGraph, EDGE_MSMS, EDGE_MZ_RT, EDGE_COLUMNS
+
+# Configure logger for this module
+logger = logging.getLogger(__name__)
+
+
+class ConsensusTable:
+    """
+    Consensus features of the datasets aligned so far.
+
+    Every consensus feature keeps the sums of its members' m/z and RT, the
+    FeatureTable row of a representative member and, if any member has MS/MS,
+    a representative spectrum. Spectra live in an append-only SpectrumStore;
+    ``spectrum_rows`` maps consensus features to its rows (row 0 is empty).
+    Identical spectra (same content hash) share one row of the store.
+    """
+
+    def __init__(self):
+        self.mz_sum = np.empty(0, dtype=np.float64)
+        self.rt_sum = np.empty(0, dtype=np.float64)
+        self.count = np.empty(0, dtype=np.int64)
+        self.representative = np.empty(0, dtype=np.int64)
+        self.spectrum_rows = np.empty(0, dtype=np.int64)
+        self.spectra = SpectrumStore.empty(1)
+        # Row of every spectrum stored so far, by content hash
+        self.spectrum_index: Dict[int, int] = {}
+        # FeatureTable rows of the members and their consensus feature, per dataset
+        self.member_rows: List[np.ndarray] = []
+        self.member_consensus: List[np.ndarray] = []
+
+    def __len__(self) -> int:
+        return len(self.count)
+
+    def columns(self) -> Dict[str, np.ndarray]:
+        """
+        Return the consensus as dataset columns for compare_dataset_pair.
+
+        Returns:
+        --------
+        columns : dict
+            'mz', 'rt' (member means), 'mz_order', 'has_msms', 'spectra' and
+            'spectrum_rows'
+        """
+        mz = self.mz_sum / self.count
+        return {
+            'mz': mz,
+            'mz_order': np.argsort(mz, kind='stable'),
+            'rt': self.rt_sum / self.count,
+            'has_msms': self.spectrum_rows > 0,
+            'spectra': self.spectra,
+            'spectrum_rows': self.spectrum_rows,
+        }
+
+    @staticmethod
+    def _with_spectrum(columns: Dict[str, np.ndarray], feature_ids: np.ndarray) -> np.ndarray:
+        """Mask of the features whose MS/MS has at least one decoded peak."""
+        has_msms = columns['has_msms'][feature_ids].copy()
+        # has_msms of a lazy store only means a non-blank MS/MS string
+        has_msms[has_msms] = columns['spectra'].peak_counts(feature_ids[has_msms]) > 0
+        return has_msms
+
+    def _append_spectra(self, store: SpectrumStore, indices: np.ndarray) -> np.ndarray:
+        """Append rows of a dataset's store; returns their rows in the consensus store."""
+        spectra, spectrum_ids = store.take(indices).deduplicate()
+        hashes = spectra.content_hashes().tolist()
+        rows = np.array([self.spectrum_index.get(key, -1) for key in hashes], dtype=np.int64)
+        new = np.flatnonzero(rows < 0)
+        rows[new] = np.arange(len(self.spectra), len(self.spectra) + len(new))
+        self.spectrum_index.update((hashes[k], row) for k, row in zip(new.tolist(), rows[new].tolist()))
+        # Hash the stored rows once so concat keeps the hashes for the cosine cache
+        self.spectra.content_hashes()
+        self.spectra = SpectrumStore.concat([self.spectra, spectra.take(new)])
+        return rows[spectrum_ids]
+
+    def add_members(self, consensus_ids: np.ndarray, rows: np.ndarray,
+                    columns: Dict[str, np.ndarray], feature_ids: np.ndarray) -> None:
+        """
+        Add matched features of one dataset to existing consensus features.
+
+        Consensus features without a spectrum take the spectrum (and
+        representative) of a new member that has MS/MS.
+
+        Parameters:
+        -----------
+        consensus_ids : numpy.ndarray
+            Consensus feature of every matched feature (unique)
+        rows : numpy.ndarray
+            FeatureTable rows of the matched features
+        columns : dict
+            Dataset columns of their dataset
+        feature_ids : numpy.ndarray
+            Feature ids of the matched features within their dataset
+        """
+        self.mz_sum[consensus_ids] += columns['mz'][feature_ids]
+        self.rt_sum[consensus_ids] += columns['rt'][feature_ids]
+        self.count[consensus_ids] += 1
+
+        upgrade = (self.spectrum_rows[consensus_ids] == 0) & self._with_spectrum(columns, feature_ids)
+        if upgrade.any():
+            self.spectrum_rows[consensus_ids[upgrade]] = self._append_spectra(
+                columns['spectra'], feature_ids[upgrade])
+            self.representative[consensus_ids[upgrade]] = rows[upgrade]
+
+        self.member_rows.append(rows)
+        self.member_consensus.append(consensus_ids)
+
+    def add_features(self, rows: np.ndarray, columns: Dict[str, np.ndarray],
+                     feature_ids: np.ndarray) -> None:
+        """
+        Start one new consensus feature per unmatched feature of a dataset.
+
+        Parameters:
+        -----------
+        rows : numpy.ndarray
+            FeatureTable rows of the features
+        columns : dict
+            Dataset columns of their dataset
+        feature_ids : numpy.ndarray
+            Feature ids of the features within their dataset
+        """
+        first = len(self)
+        has_msms = self._with_spectrum(columns, feature_ids)
+        spectrum_rows = np.zeros(len(feature_ids), dtype=np.int64)
+        spectrum_rows[has_msms] = self._append_spectra(columns['spectra'], feature_ids[has_msms])
+
+        self.mz_sum = np.concatenate((self.mz_sum, columns['mz'][feature_ids]))
+        self.rt_sum = np.concatenate((self.rt_sum, columns['rt'][feature_ids]))
+        self.count = np.concatenate((self.count, np.ones(len(feature_ids), dtype=np.int64)))
+        self.representative = np.concatenate((self.representative, rows))
+        self.spectrum_rows = np.concatenate((self.spectrum_rows, spectrum_rows))
+
+        self.member_rows.append(rows)
+        self.member_consensus.append(np.arange(first, len(self), dtype=np.int64))
+
+
+class ReferenceAligner:
+    """
+    Class for aligning datasets against a growing consensus feature table.
+
+    Datasets are aligned in FeatureTable order; the first dataset seeds the
+    consensus. Each later dataset is compared with the consensus using the
+    same m/z/RT and MS/MS rules as GraphBuilder, and every feature is matched
+    to at most one consensus feature (see best_connection_mask).
+    """
+
+    def __init__(self, mz_tolerance=0.01, rt_tolerance=0.5, cosine_threshold=0.5, min_shared_peaks=3,
+                 cosine_cache_size=COSINE_CACHE_SIZE):
+        """
+        Initialize the ReferenceAligner with tolerance parameters and MS/MS similarity settings.
+
+        Parameters:
+        -----------
+        mz_tolerance : float
+            Tolerance for m/z values (in Da)
+        rt_tolerance : float
+            Tolerance for retention time values (in minutes)
+        cosine_threshold : float
+            Minimum cosine similarity for MS/MS-based matches (default: 0.5)
+        min_shared_peaks : int
+            Minimum number of shared peaks required for MS/MS similarity (default: 3)
+        cosine_cache_size : int
+            Spectrum pairs kept in the cosine cache, 0 to disable (default: COSINE_CACHE_SIZE)
+        """
+        self.settings = {
+            'mz_tolerance': mz_tolerance,
+            'rt_tolerance': rt_tolerance,
+            'cosine_threshold': cosine_threshold,
+            'min_shared_peaks': min_shared_peaks,
+            'cosine_cache_size': max(0, int(cosine_cache_size)),
+        }
+        self.consensus = None
+        self.G = None
+        # Counters of the last align call
+        self.stats = {}
+
+        logger.info(f"ReferenceAligner initialized - mz_tol: {mz_tolerance}, rt_tol: {rt_tolerance}, "
+                    f"cosine_threshold: {cosine_threshold}, min_shared_peaks: {min_shared_peaks}")
+
+    def align(self, features, dataset_index=None) -> Tuple[Dict[int, Dict[int, int]], EdgeGraph]:
+        """
+        Align all datasets of a feature table against the consensus.
+
+        Parameters:
+        -----------
+        features : FeatureTable
+            Features of all datasets
+        dataset_index : list, optional
+            Precomputed dataset_columns(), one per dataset; computed here if omitted
+
+        Returns:
+        --------
+        aligned_features : dict
+            Consensus feature id -> {dataset_id: feature_id}, for every consensus feature
+        G : EdgeGraph
+            Accepted matches between features and the representatives of their consensus
+        """
+        logger.info(f"Aligning {features.n_datasets} datasets against a consensus feature table...")
+        if dataset_index is None:
+            dataset_index = [dataset_columns(features.dataset(dataset_id))
+                             for dataset_id in range(features.n_datasets)]
+
+        self.consensus = ConsensusTable()
+        edges = {name: [] for name in EDGE_COLUMNS}
+        self.stats = {'cosine_cache_hits': 0, 'cosine_cache_misses': 0}
+
+        for dataset_id, columns in enumerate(dataset_index):
+            n_features = len(columns['mz'])
+            offset = int(features.dataset_offsets[dataset_id])
+            matched = np.zeros(n_features, dtype=bool)
+
+            if len(self.consensus) > 0 and n_features > 0:
+                pair = compare_dataset_pair(columns, self.consensus.columns(), self.settings)
+                for name in self.stats:
+                    self.stats[name] += pair[name]
+                feature_ids = pair['idx_i'].astype(np.int64)
+                consensus_ids = pair['idx_j'].astype(np.int64)
+
+                # One consensus feature per dataset feature and vice versa
+                sides = np.concatenate((np.zeros(n_features, dtype=np.int64),
+                                        np.ones(len(self.consensus), dtype=np.int64)))
+                keep, _ = best_connection_mask(feature_ids, consensus_ids + n_features,
+                                               pair['weight'], pair['is_msms'], sides)
+                feature_ids, consensus_ids = feature_ids[keep], consensus_ids[keep]
+                rows = offset + feature_ids
+
+                edges['u'].append(self.consensus.representative[consensus_ids])
+                edges['v'].append(rows)
+                edges['weight'].append(pair['weight'][keep])
+                edges['edge_type'].append(np.where(pair['is_msms'][keep], EDGE_MSMS, EDGE_MZ_RT))
+                edges['cosine'].append(pair['cosine'][keep])
+                edges['shared_peaks'].append(pair['shared_peaks'][keep])
+
+                self.consensus.add_members(consensus_ids, rows, columns, feature_ids)
+                matched[feature_ids] = True
+
+            new_ids = np.flatnonzero(~matched)
+            self.consensus.add_features(offset + new_ids, columns, new_ids)
+            logger.info(f"Aligned dataset {dataset_id}: {int(matched.sum())} features matched, "
+                        f"{len(new_ids)} new consensus features ({len(self.consensus)} total)")
+
+        arrays = {name: np.concatenate(parts) if parts else np.empty(0)
+                  for name, parts in edges.items()}
+        self.G = EdgeGraph(features, **arrays)
+        aligned_features = self.aligned_features(features)
+
+        logger.info(f"Reference alignment completed: {len(aligned_features)} consensus features, "
+                    f"{self.G.number_of_edges()} matches ({int(self.G.is_msms.sum())} MS/MS)")
+        if self.settings['cosine_cache_size'] > 0:
+            logger.info(f"MS/MS cosine cache: {self.stats['cosine_cache_hits']} hits, "
+                        f"{self.stats['cosine_cache_misses']} misses")
+        return aligned_features, self.G
+
+    def aligned_features(self, features) -> Dict[int, Dict[int, int]]:
+        """
+        Return the members of every consensus feature.
+
+        Parameters:
+        -----------
+        features : FeatureTable
+            Features of all datasets
+
+        Returns:
+        --------
+        aligned_features : dict
+            Consensus feature id -> {dataset_id: feature_id}, datasets in ascending order
+        """
+        if not self.consensus.member_rows:
+            return {}
+        rows = np.concatenate(self.consensus.member_rows)
+        consensus_ids = np.concatenate(self.consensus.member_consensus)
+        # Members were added dataset by dataset, so a stable sort keeps dataset order
+        order = np.argsort(consensus_ids, kind='stable')
+        consensus_ids = consensus_ids[order].tolist()
+        dataset_ids = features.dataset_id[rows[order]].tolist()
+        feature_ids = features.feature_id[rows[order]].tolist()
+
+        aligned_features = {}
+        for consensus_id, dataset_id, feature_id in zip(consensus_ids, dataset_ids, feature_ids):
+            aligned_features.setdefault(consensus_id, {})[dataset_id] = feature_id
+        return aligned_features
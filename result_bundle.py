@@ -0,0 +1,222 @@
+"""
+Module for writing and reading the columnar result bundle of an alignment run.
+
+The bundle replaces the pickled graph and partition (graph.pkl, partition.pkl).
+Every column of the node table, the edge table and the partition is a separate
+.npy file, and a small JSON manifest lists the columns, file names and label
+kinds. Report and analysis tools memory-map the bundle and load only the
+columns they use; no pickle is involved.
+
+Main functions/classes:
+    - save_result_bundle: Writes the feature graph and partition of a run
+    - ResultBundle: Memory-mapped access to the columns of a bundle
+    - load_result_bundle: Opens a bundle, or returns None if there is none
+
+Inputs:
+    - EdgeGraph (with its FeatureTable) and, in graph mode, the community partition
+
+Outputs:
+    - <output_dir>/results/manifest.json
+    - <output_dir>/results/nodes.<column>.npy: one entry per FeatureTable row
+      (mz, rt, intensity, has_msms, node_mask, community and label columns)
+    - <output_dir>/results/edges.<column>.npy: u, v, weight, edge_type, cosine, shared_peaks
+    - <output_dir>/results/datasets.offsets.npy: first row of every dataset
+
+Important arguments:
+    - community: -1 for rows that are not in the partition
+    - mmap_mode: How columns are opened (default: 'r', read-only memory map)
+"""
+import os
+import json
+import shutil
+import logging
+import numpy as np
+from typing import Any, Dict, List, Optional
+from spectral_similarity import SpectrumStore
+from feature_table import FeatureTable
+from feature_cache import encode_labels, decode_labels
+from edge_graph import EdgeGraph, EDGE_TYPE_NAMES, EDGE_COLUMNS
+
+# Configure logger for this module
+logger = logging.getLogger(__name__)
+
+BUNDLE_DIR_NAME = "results"
+MANIFEST_NAME = "manifest.json"
+
+# Bumped whenever the layout of the bundle changes
+BUNDLE_VERSION = 1
+
+
+def save_result_bundle(bundle_dir: str, graph: EdgeGraph, partition: Optional[Dict[str, int]] = None) -> None:
+    """
+    Write the feature graph and partition of a run as a result bundle.
+
+    The bundle is written next to bundle_dir and moved into place when
+    complete, so readers never see a partial bundle.
+
+    Inputs:
+        bundle_dir (str): Directory of the bundle (replaced if it exists)
+        graph (EdgeGraph): Feature graph with its FeatureTable
+        partition (Optional[Dict[str, int]]): Community of every node key
+    """
+    features = graph.features
+    community = np.full(len(features), -1, dtype=np.int64)
+    if partition:
+        community[[graph.node_index(key) for key in partition]] = list(partition.values())
+
+    columns = {
+        'datasets.offsets': features.dataset_offsets,
+        'nodes.mz': features.mz,
+        'nodes.rt': features.rt,
+        'nodes.intensity': features.intensity,
+        'nodes.has_msms': features.has_msms,
+        'nodes.node_mask': graph.node_mask,
+        'nodes.community': community,
+    }
+    for name in EDGE_COLUMNS:
+        columns[f"edges.{name}"] = getattr(graph, name)
+    labels = {}
+    kinds = encode_labels(features.labels, labels)
+    columns.update((f"nodes.{name}", values) for name, values in labels.items())
+
+    tmp_dir = str(bundle_dir) + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    for name, values in columns.items():
+        np.save(os.path.join(tmp_dir, f"{name}.npy"), np.ascontiguousarray(values), allow_pickle=False)
+    with open(os.path.join(tmp_dir, MANIFEST_NAME), 'w') as f:
+        json.dump({
+            'version': BUNDLE_VERSION,
+            'filenames': [os.path.basename(filename) for filename in features.filenames],
+            'n_rows': len(features),
+            'n_edges': graph.number_of_edges(),
+            'has_partition': bool(partition),
+            'edge_types': list(EDGE_TYPE_NAMES),
+            'labels': kinds,
+            'columns': {name: {'dtype': str(values.dtype), 'length': len(values)}
+                        for name, values in columns.items()},
+        }, f, indent=2)
+
+    shutil.rmtree(bundle_dir, ignore_errors=True)
+    os.replace(tmp_dir, bundle_dir)
+    logger.info(f"Saved result bundle with {len(features)} features and "
+                f"{graph.number_of_edges()} edges to {bundle_dir}")
+
+
+class _LabelColumns:
+    """Mapping view for decode_labels that loads "nodes.label__*" columns on access."""
+
+    def __init__(self, bundle: 'ResultBundle'):
+        self.bundle = bundle
+
+    def __getitem__(self, key: str) -> np.ndarray:
+        return self.bundle.column(f"nodes.{key}")
+
+
+class ResultBundle:
+    """
+    Read access to a result bundle.
+
+    Columns are opened with np.load(mmap_mode=...), so only the pages that are
+    used are read. features(), graph() and partition() rebuild the objects the
+    pipeline produced from the columns they need.
+    """
+
+    def __init__(self, bundle_dir: str, manifest: Dict[str, Any], mmap_mode: Optional[str] = 'r'):
+        self.bundle_dir = str(bundle_dir)
+        self.manifest = manifest
+        self.mmap_mode = mmap_mode
+
+    @property
+    def columns(self) -> List[str]:
+        """Names of the columns in the bundle."""
+        return list(self.manifest['columns'])
+
+    def column(self, name: str) -> np.ndarray:
+        """
+        Open one column.
+
+        Inputs:
+            name (str): Column name, e.g. 'nodes.mz' or 'edges.weight'
+
+        Outputs:
+            np.ndarray: The column, memory-mapped unless mmap_mode is None
+        """
+        if name not in self.manifest['columns']:
+            raise KeyError(f"No column {name} in result bundle {self.bundle_dir}")
+        return np.load(os.path.join(self.bundle_dir, f"{name}.npy"), mmap_mode=self.mmap_mode,
+                       allow_pickle=False)
+
+    def features(self) -> FeatureTable:
+        """
+        FeatureTable of the run (without spectra; has_msms is kept).
+
+        Outputs:
+            FeatureTable: Features of all aligned datasets
+        """
+        offsets = self.column('datasets.offsets')
+        stores = [SpectrumStore.empty(int(offsets[d + 1] - offsets[d])) for d in range(len(offsets) - 1)]
+        features = FeatureTable(self.manifest['filenames'], offsets, self.column('nodes.mz'),
+                                self.column('nodes.rt'), self.column('nodes.intensity'), stores,
+                                decode_labels(self.manifest['labels'], _LabelColumns(self)))
+        features.has_msms = self.column('nodes.has_msms')
+        return features
+
+    def graph(self, features: Optional[FeatureTable] = None, with_edges: bool = True) -> EdgeGraph:
+        """
+        Feature graph of the run.
+
+        Inputs:
+            features (Optional[FeatureTable]): Table from features(), loaded if omitted
+            with_edges (bool): Load the edge table; without it the graph only
+                has the nodes (enough for node lookups and node_feature)
+
+        Outputs:
+            EdgeGraph: Graph with the nodes and (optionally) edges of the run
+        """
+        if features is None:
+            features = self.features()
+        if with_edges:
+            edges = {name: self.column(f"edges.{name}") for name in EDGE_COLUMNS}
+        else:
+            edges = {name: np.empty(0) for name in EDGE_COLUMNS}
+        return EdgeGraph(features, node_mask=self.column('nodes.node_mask'), **edges)
+
+    def partition(self) -> Optional[Dict[str, int]]:
+        """
+        Community partition of the run.
+
+        Outputs:
+            Optional[Dict[str, int]]: Community of every node key, or None if
+            the run had no partition (reference mode)
+        """
+        if not self.manifest['has_partition']:
+            return None
+        community = self.column('nodes.community')
+        rows = np.flatnonzero(community >= 0)
+        offsets = self.column('datasets.offsets')
+        dataset_ids = np.searchsorted(offsets, rows, side='right') - 1
+        keys = [f"{d}_{f}" for d, f in zip(dataset_ids.tolist(), (rows - offsets[dataset_ids]).tolist())]
+        return dict(zip(keys, community[rows].tolist()))
+
+
+def load_result_bundle(bundle_dir: str, mmap_mode: Optional[str] = 'r') -> Optional[ResultBundle]:
+    """
+    Open the result bundle written by save_result_bundle.
+
+    Inputs:
+        bundle_dir (str): Directory of the bundle
+        mmap_mode (Optional[str]): np.load memory-map mode, None to read columns into memory
+
+    Outputs:
+        Optional[ResultBundle]: The bundle, or None if there is no usable bundle
+    """
+    manifest_path = os.path.join(str(bundle_dir), MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    if manifest.get('version') != BUNDLE_VERSION:
+        logger.warning(f"Ignoring result bundle {bundle_dir} with version {manifest.get('version')}")
+        return None
+    return ResultBundle(bundle_dir, manifest, mmap_mode)
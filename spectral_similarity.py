@@ -2,17 +2,23 @@
 Module for fast MS/MS spectral similarity calculations.
 
 This module provides ultra-fast cosine similarity calculations between MS/MS spectra
-using precomputed boolean and intensity arrays. It implements the matching logic
+stored in a sparse, dataset-level SpectrumStore. It implements the matching logic
 defined in the design document for features with MS/MS data.
 
 Main functions/classes:
-    - fast_cosine_similarity: Core cosine similarity using precomputed arrays
+    - SpectrumStore: CSR-style container (indptr/mz_bin/intensity) for a dataset's spectra
+    - LazySpectrumStore: Keeps raw MS/MS strings and decodes spectra on first use
+    - CosineCache: Bounded LRU cache of cosine scores keyed by spectrum content hashes
+    - fast_cosine_similarity: Core cosine similarity between two stored spectra
+    - batch_cosine_similarity: Vectorized cosine scores for many spectrum pairs at once
+    - shared_peak_counts: Shared peak counts of many pairs from bit-packed fingerprints
+    - spectrum_store_for: Returns one SpectrumStore covering a list of features
     - calculate_spectral_similarity: Main interface for feature-to-feature comparison
     - has_msms_data: Quick check for MS/MS availability
     - get_msms_stats: Get statistics about MS/MS data in a feature
 
 Inputs:
-    - Feature dictionaries with precomputed 'msms_peaks' and 'msms_intensities' arrays
+    - Feature dictionaries referencing a spectrum via 'msms_store' and 'msms_index'
     - Configuration parameters for minimum shared peaks and similarity thresholds
 
 Outputs:
@@ -35,6 +41,519 @@ logger = logging.getLogger(__name__)
 DEFAULT_MIN_SHARED_PEAKS = 3
 DEFAULT_COSINE_THRESHOLD = 0.0
 
+# Upper bound on the number of expanded peaks handled per batch_cosine_similarity block
+BATCH_PEAK_BLOCK_SIZE = 4_000_000
+
+# Number of pairs whose fingerprints are ANDed at once in shared_peak_counts
+FINGERPRINT_BLOCK_PAIRS = 65_536
+
+# Default --cosine-cache-size of the builders: off. Scoring a pair after the
+# fingerprint prefilter is about as cheap as a cache lookup, so the cache only
+# pays off on inputs with many identical spectra (replicate injections)
+COSINE_CACHE_SIZE = 0
+
+# Number of spectrum pairs kept by a CosineCache unless a size is given
+COSINE_CACHE_ENTRIES = 100_000
+
+# Set bits of every byte value (popcount fallback for NumPy < 2.0)
+_POPCOUNT_TABLE = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+
+
+class SpectrumStore:
+    """
+    Sparse CSR-style store for all MS/MS spectra of one dataset.
+    
+    Spectrum ``k`` consists of the peaks ``indptr[k]:indptr[k + 1]`` of the flat
+    ``mz_bin`` (nominal m/z, sorted and unique within a spectrum) and
+    ``intensity`` arrays. Features without MS/MS simply have an empty row, so
+    memory grows with the number of peaks rather than features x MAX_MZ.
+    The peak-presence bitsets used to prefilter pairs and the content hashes
+    used by CosineCache are built on first use (see fingerprints, content_hashes).
+    """
+    
+    def __init__(self, indptr: np.ndarray, mz_bin: np.ndarray, intensity: np.ndarray):
+        """
+        Wrap existing CSR arrays.
+        
+        Inputs:
+            indptr (np.ndarray): Row offsets, length n_spectra + 1
+            mz_bin (np.ndarray): Nominal m/z of every peak, sorted within each row
+            intensity (np.ndarray): Intensity of every peak
+        """
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.mz_bin = np.asarray(mz_bin, dtype=np.int32)
+        self.intensity = np.asarray(intensity, dtype=np.float32)
+        self._fingerprints = None
+        self._content_hashes = None
+    
+    def __getstate__(self):
+        # Fingerprints are a cache; rebuild them where they are needed
+        state = self.__dict__.copy()
+        state['_fingerprints'] = None
+        return state
+    
+    @classmethod
+    def from_peaks(cls, rows: np.ndarray, mz_bin: np.ndarray, intensity: np.ndarray,
+                   n_spectra: int) -> 'SpectrumStore':
+        """
+        Build a store from flat (row, nominal m/z, intensity) peak arrays.
+        
+        Peaks may come in any order; duplicates at the same nominal m/z of a
+        spectrum are merged by keeping the maximum intensity.
+        
+        Inputs:
+            rows (np.ndarray): Spectrum index of each peak
+            mz_bin (np.ndarray): Nominal m/z of each peak
+            intensity (np.ndarray): Intensity of each peak
+            n_spectra (int): Total number of spectra (rows) in the store
+            
+        Outputs:
+            SpectrumStore: Store with sorted, de-duplicated rows
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        mz_bin = np.asarray(mz_bin, dtype=np.int64)
+        intensity = np.asarray(intensity, dtype=np.float32)
+        
+        if len(rows) > 0:
+            order = np.lexsort((mz_bin, rows))
+            rows, mz_bin, intensity = rows[order], mz_bin[order], intensity[order]
+            
+            # If multiple peaks at same nominal m/z, take maximum intensity
+            first = np.ones(len(rows), dtype=bool)
+            first[1:] = (rows[1:] != rows[:-1]) | (mz_bin[1:] != mz_bin[:-1])
+            starts = np.flatnonzero(first)
+            intensity = np.maximum.reduceat(intensity, starts)
+            rows, mz_bin = rows[starts], mz_bin[starts]
+        
+        indptr = np.zeros(n_spectra + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=n_spectra), out=indptr[1:])
+        return cls(indptr, mz_bin, intensity)
+    
+    @classmethod
+    def empty(cls, n_spectra: int = 0) -> 'SpectrumStore':
+        """Create a store of ``n_spectra`` spectra without any peaks."""
+        return cls(np.zeros(n_spectra + 1, dtype=np.int64),
+                   np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32))
+    
+    @classmethod
+    def concat(cls, stores: list) -> 'SpectrumStore':
+        """
+        Stack stores row-wise (rows of the second store follow those of the first, ...).
+        
+        Content hashes are carried over when every store has them.
+        
+        Inputs:
+            stores (list): SpectrumStore objects
+            
+        Outputs:
+            SpectrumStore: Store with the rows of all stores
+        """
+        indptr = [np.zeros(1, dtype=np.int64)]
+        offset = 0
+        for store in stores:
+            indptr.append(store.indptr[1:] + offset)
+            offset += int(store.indptr[-1])
+        result = cls(np.concatenate(indptr),
+                     np.concatenate([store.mz_bin for store in stores] + [np.empty(0, dtype=np.int32)]),
+                     np.concatenate([store.intensity for store in stores] + [np.empty(0, dtype=np.float32)]))
+        if stores and all(store._content_hashes is not None for store in stores):
+            result._content_hashes = np.concatenate([store._content_hashes for store in stores])
+        return result
+    
+    def take(self, indices: np.ndarray) -> 'SpectrumStore':
+        """
+        Return a new store with the given rows, in the given order.
+        
+        Inputs:
+            indices (np.ndarray): Rows to copy
+            
+        Outputs:
+            SpectrumStore: Store whose row k is row ``indices[k]`` of this store
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        counts = self.num_peaks[indices]
+        positions = _gather_peak_positions(self.indptr, indices, counts)
+        indptr = np.zeros(len(indices) + 1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:])
+        result = SpectrumStore(indptr, self.mz_bin[positions], self.intensity[positions])
+        if self._content_hashes is not None:
+            result._content_hashes = self._content_hashes[indices]
+        return result
+    
+    def __len__(self) -> int:
+        return len(self.indptr) - 1
+    
+    @property
+    def num_peaks(self) -> np.ndarray:
+        """Number of peaks in every spectrum."""
+        return np.diff(self.indptr)
+    
+    @property
+    def has_msms(self) -> np.ndarray:
+        """Boolean array, True for spectra with at least one peak."""
+        return self.num_peaks > 0
+    
+    @property
+    def nbytes(self) -> int:
+        """Memory used by the CSR arrays in bytes."""
+        return self.indptr.nbytes + self.mz_bin.nbytes + self.intensity.nbytes
+    
+    def resolve(self, indices: np.ndarray) -> Tuple['SpectrumStore', np.ndarray]:
+        """
+        Return the store and rows that hold the given spectra.
+        
+        Similarity functions call this before reading peaks so that stores
+        which decode spectra on demand (LazySpectrumStore) only decode the rows
+        that are compared. A plain store holds every spectrum itself.
+        
+        Inputs:
+            indices (np.ndarray): Rows of this store
+            
+        Outputs:
+            Tuple[SpectrumStore, np.ndarray]: Store with decoded peaks and the rows of the spectra in it
+        """
+        return self, np.asarray(indices, dtype=np.int64)
+    
+    def fingerprints(self) -> np.ndarray:
+        """
+        Peak-presence bitsets of all spectra, packed into uint64 words.
+        
+        Bit ``b % 64`` of word ``b // 64`` of row k is set if spectrum k has a
+        peak at nominal m/z ``b``. Built once and cached on the store.
+        
+        Outputs:
+            np.ndarray: uint64 array of shape (n_spectra, n_words)
+        """
+        if self._fingerprints is None:
+            n_words = (int(self.mz_bin.max(initial=-1)) + 64) // 64
+            self._fingerprints = _build_fingerprints(self.indptr, self.mz_bin, n_words)
+        return self._fingerprints
+    
+    def content_hashes(self) -> np.ndarray:
+        """
+        64-bit content hash of every spectrum, built once and cached on the store.
+        
+        The hash covers the nominal m/z bins and intensities of a spectrum, so
+        spectra that are identical after parsing (e.g. replicate or QC-pool
+        injections) have the same hash in any store.
+        
+        Outputs:
+            np.ndarray: uint64 array, one hash per spectrum
+        """
+        if self._content_hashes is None:
+            # Mix every (m/z bin, intensity bits) peak to 64 bits, sum the peaks
+            # of each row (mod 2**64, via a running sum) and mix in the peak count
+            peaks = (self.mz_bin.astype(np.uint64) << np.uint64(32)) | \
+                self.intensity.view(np.uint32).astype(np.uint64)
+            running = np.zeros(len(peaks) + 1, dtype=np.uint64)
+            np.cumsum(_mix64(peaks), out=running[1:])
+            sums = running[self.indptr[1:]] - running[self.indptr[:-1]]
+            self._content_hashes = _mix64(sums ^ _mix64(self.num_peaks.astype(np.uint64)))
+        return self._content_hashes
+    
+    def deduplicate(self) -> Tuple['SpectrumStore', np.ndarray]:
+        """
+        Keep one copy of every distinct spectrum.
+        
+        Outputs:
+            Tuple[SpectrumStore, np.ndarray]: Store of the distinct spectra (in
+            order of first occurrence) and the row of every spectrum in it
+        """
+        _, first, rows = np.unique(self.content_hashes(), return_index=True, return_inverse=True)
+        # Renumber the distinct spectra in order of first occurrence
+        order = np.argsort(first, kind='stable')
+        rank = np.empty(len(order), dtype=np.int64)
+        rank[order] = np.arange(len(order))
+        return self.take(first[order]), rank[rows.ravel()]
+    
+    def peak_counts(self, indices: np.ndarray) -> np.ndarray:
+        """
+        Number of peaks of the given spectra.
+        
+        Unlike has_msms this looks at the parsed peaks, so on a
+        LazySpectrumStore it decodes the rows and is 0 for MS/MS strings
+        without any valid peak.
+        
+        Inputs:
+            indices (np.ndarray): Rows of this store
+            
+        Outputs:
+            np.ndarray: Peak count of every requested row
+        """
+        store, rows = self.resolve(indices)
+        return store.indptr[rows + 1] - store.indptr[rows]
+    
+    def peaks(self, index: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return the (mz_bin, intensity) views of one spectrum.
+        
+        Inputs:
+            index (int): Spectrum (row) index
+            
+        Outputs:
+            Tuple[np.ndarray, np.ndarray]: Nominal m/z and intensity of its peaks
+        """
+        start, end = self.indptr[index], self.indptr[index + 1]
+        return self.mz_bin[start:end], self.intensity[start:end]
+    
+    def to_dense(self, index: int, max_mz: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Expand one spectrum to the dense boolean/intensity array representation.
+        
+        Inputs:
+            index (int): Spectrum (row) index
+            max_mz (int): Length of the dense arrays
+            
+        Outputs:
+            Tuple[np.ndarray, np.ndarray]: Peak presence and intensity arrays
+        """
+        mz_bin, intensity = self.peaks(index)
+        peak_present = np.zeros(max_mz, dtype=bool)
+        intensities = np.zeros(max_mz, dtype=np.float32)
+        peak_present[mz_bin] = True
+        intensities[mz_bin] = intensity
+        return peak_present, intensities
+
+
+class LazySpectrumStore(SpectrumStore):
+    """
+    Spectrum store that keeps the raw MS/MS strings and decodes spectra on first use.
+    
+    The strings of all features are kept as one UTF-8 buffer with row offsets.
+    has_msms is derived from the strings at ingest (a non-blank string counts
+    as MS/MS; see peak_counts for rows that decode to no peaks), and resolve()
+    decodes only the requested rows. Decoded rows are appended to growable CSR
+    buffers together with their fingerprints (and, once a caller has asked for
+    them, their content hashes), so each spectrum is parsed, fingerprinted and
+    hashed at most once per process.
+    Accessing indptr/mz_bin/intensity directly decodes all rows.
+    """
+    
+    def __init__(self, buffer: np.ndarray, offsets: np.ndarray, has_msms: np.ndarray,
+                 max_mz: int, min_intensity: float):
+        """
+        Wrap raw MS/MS strings.
+        
+        Inputs:
+            buffer (np.ndarray): uint8 UTF-8 bytes of all MS/MS strings
+            offsets (np.ndarray): Row offsets into buffer, length n_spectra + 1
+            has_msms (np.ndarray): Boolean flag of every row
+            max_mz (int): Peaks at or above this nominal m/z are dropped when decoding
+            min_intensity (float): Peaks below this intensity are dropped when decoding
+        """
+        self.buffer = np.asarray(buffer, dtype=np.uint8)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self._has_msms = np.asarray(has_msms, dtype=bool)
+        self.max_mz = max_mz
+        self.min_intensity = min_intensity
+        # Decoded peaks are below max_mz, so fingerprints have a fixed width
+        self._n_words = (int(max_mz) + 63) // 64
+        self._row_map = np.full(len(self._has_msms), -1, dtype=np.int64)
+        self._full = None
+        self._fingerprints = None
+        self._content_hashes = None
+        self._reset_decoded()
+    
+    def __getstate__(self):
+        # The decoded view is rebuilt from the buffers after unpickling
+        state = self.__dict__.copy()
+        state['_decoded'] = None
+        return state
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._update_decoded()
+    
+    @classmethod
+    def from_strings(cls, msms_strings, max_mz: int, min_intensity: float) -> 'LazySpectrumStore':
+        """
+        Build a store from MS/MS strings without decoding them.
+        
+        Inputs:
+            msms_strings (sequence): MS/MS strings, one per feature ('' or None for no MS/MS)
+            max_mz (int): Maximum m/z value (peaks at or above it are dropped)
+            min_intensity (float): Minimum intensity threshold
+            
+        Outputs:
+            LazySpectrumStore: One row per feature
+        """
+        encoded = [value.encode('utf-8') if isinstance(value, str) else b'' for value in msms_strings]
+        lengths = np.array([len(value) for value in encoded], dtype=np.int64)
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        has_msms = np.array([bool(value.strip()) for value in encoded], dtype=bool)
+        buffer = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        return cls(buffer, offsets, has_msms, max_mz, min_intensity)
+    
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+    
+    @property
+    def has_msms(self) -> np.ndarray:
+        """Boolean array, True for rows with a non-blank MS/MS string."""
+        return self._has_msms
+    
+    @property
+    def nbytes(self) -> int:
+        """Memory used by the raw strings and the decoded spectra in bytes."""
+        if self._full is not None:
+            decoded = self._full.nbytes
+        else:
+            decoded = sum(array.nbytes for array in (self._indptr_buffer, self._mz_bin_buffer,
+                                                     self._intensity_buffer, self._fingerprint_buffer,
+                                                     self._hash_buffer))
+        return self.buffer.nbytes + self.offsets.nbytes + decoded
+    
+    @property
+    def n_decoded(self) -> int:
+        """Number of spectra decoded so far."""
+        return len(self) if self._full is not None else self._n_rows
+    
+    def strings(self, indices: np.ndarray) -> list:
+        """Raw MS/MS strings of the given rows."""
+        data = self.buffer.tobytes()
+        offsets = self.offsets.tolist()
+        return [data[offsets[k]:offsets[k + 1]].decode('utf-8') for k in np.asarray(indices).tolist()]
+    
+    def _decode(self, indices: np.ndarray) -> SpectrumStore:
+        """Parse the strings of the given rows into a store (row k = indices[k])."""
+        # read_files imports this module, so its parser is looked up on first use
+        from read_files import msms_column_to_store
+        return msms_column_to_store(self.strings(indices), self.max_mz, self.min_intensity)
+    
+    def resolve(self, indices: np.ndarray) -> Tuple[SpectrumStore, np.ndarray]:
+        """
+        Decode the given rows if needed and return where their spectra are.
+        
+        Inputs:
+            indices (np.ndarray): Rows of this store
+            
+        Outputs:
+            Tuple[SpectrumStore, np.ndarray]: Store of decoded spectra and the rows in it
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        if self._full is not None:
+            return self._full, indices
+        missing = np.unique(indices[self._row_map[indices] < 0])
+        if len(missing) > 0:
+            first = self._n_rows
+            self._append_decoded(self._decode(missing))
+            self._row_map[missing] = np.arange(first, first + len(missing))
+        return self._decoded, self._row_map[indices]
+    
+    def _reset_decoded(self) -> None:
+        """Drop all decoded rows."""
+        self._n_rows = 0
+        self._indptr_buffer = np.zeros(1, dtype=np.int64)
+        self._mz_bin_buffer = np.empty(0, dtype=np.int32)
+        self._intensity_buffer = np.empty(0, dtype=np.float32)
+        self._fingerprint_buffer = np.zeros((0, self._n_words), dtype=np.uint64)
+        self._hash_buffer = np.empty(0, dtype=np.uint64)
+        self._hashing = False
+        self._update_decoded()
+    
+    def _append_decoded(self, store: SpectrumStore) -> None:
+        """Append freshly decoded rows, with their fingerprints and hashes, to the buffers."""
+        n_rows, n_peaks = self._n_rows, int(self._indptr_buffer[self._n_rows])
+        end_row, end_peak = n_rows + len(store), n_peaks + int(store.indptr[-1])
+        if not self._hashing and self._decoded._content_hashes is not None:
+            # A caller (the cosine cache) hashed the decoded rows: keep those
+            # hashes and hash every later row as it is decoded
+            self._hash_buffer = self._decoded._content_hashes.copy()
+            self._hashing = True
+        self._indptr_buffer = _grow(self._indptr_buffer, end_row + 1)
+        self._mz_bin_buffer = _grow(self._mz_bin_buffer, end_peak)
+        self._intensity_buffer = _grow(self._intensity_buffer, end_peak)
+        self._fingerprint_buffer = _grow(self._fingerprint_buffer, end_row)
+        
+        self._indptr_buffer[n_rows + 1:end_row + 1] = store.indptr[1:] + n_peaks
+        self._mz_bin_buffer[n_peaks:end_peak] = store.mz_bin
+        self._intensity_buffer[n_peaks:end_peak] = store.intensity
+        self._fingerprint_buffer[n_rows:end_row] = _build_fingerprints(store.indptr, store.mz_bin, self._n_words)
+        if self._hashing:
+            self._hash_buffer = _grow(self._hash_buffer, end_row)
+            self._hash_buffer[n_rows:end_row] = store.content_hashes()
+        self._n_rows = end_row
+        self._update_decoded()
+    
+    def _update_decoded(self) -> None:
+        """Expose the filled part of the buffers as a SpectrumStore (views, no copies)."""
+        n_rows, n_peaks = self._n_rows, int(self._indptr_buffer[self._n_rows])
+        decoded = SpectrumStore(self._indptr_buffer[:n_rows + 1], self._mz_bin_buffer[:n_peaks],
+                                self._intensity_buffer[:n_peaks])
+        decoded._fingerprints = self._fingerprint_buffer[:n_rows]
+        if self._hashing:
+            decoded._content_hashes = self._hash_buffer[:n_rows]
+        self._decoded = decoded
+    
+    def materialize(self) -> SpectrumStore:
+        """Decode all rows (once) and return them as a plain SpectrumStore in row order."""
+        if self._full is None:
+            self._full = self._decode(np.arange(len(self)))
+            self._row_map[:] = -1
+            self._reset_decoded()
+        return self._full
+    
+    @property
+    def indptr(self) -> np.ndarray:
+        return self.materialize().indptr
+    
+    @property
+    def mz_bin(self) -> np.ndarray:
+        return self.materialize().mz_bin
+    
+    @property
+    def intensity(self) -> np.ndarray:
+        return self.materialize().intensity
+    
+    def fingerprints(self) -> np.ndarray:
+        return self.materialize().fingerprints()
+    
+    def content_hashes(self) -> np.ndarray:
+        return self.materialize().content_hashes()
+    
+    def take(self, indices: np.ndarray) -> SpectrumStore:
+        store, rows = self.resolve(indices)
+        return store.take(rows)
+    
+    def peaks(self, index: int) -> Tuple[np.ndarray, np.ndarray]:
+        store, rows = self.resolve([index])
+        return store.peaks(rows[0])
+
+
+def _mix64(values: np.ndarray) -> np.ndarray:
+    """splitmix64 finalizer: a well-mixed 64-bit hash of every uint64 value."""
+    values = values + np.uint64(0x9E3779B97F4A7C15)
+    values = (values ^ (values >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
+
+
+def _build_fingerprints(indptr: np.ndarray, mz_bin: np.ndarray, n_words: int) -> np.ndarray:
+    """Peak-presence bitsets of CSR spectra (see SpectrumStore.fingerprints)."""
+    n_spectra = len(indptr) - 1
+    fingerprints = np.zeros((n_spectra, n_words), dtype=np.uint64)
+    if len(mz_bin) > 0:
+        rows = np.repeat(np.arange(n_spectra, dtype=np.int64), np.diff(indptr))
+        mz_bin = mz_bin.astype(np.int64)
+        # Rows are sorted by m/z, so peaks of the same word are adjacent
+        word = rows * n_words + (mz_bin >> 6)
+        bits = np.left_shift(np.uint64(1), (mz_bin & 63).astype(np.uint64))
+        first = np.ones(len(word), dtype=bool)
+        first[1:] = word[1:] != word[:-1]
+        starts = np.flatnonzero(first)
+        fingerprints.ravel()[word[starts]] = np.bitwise_or.reduceat(bits, starts)
+    return fingerprints
+
+
+def _grow(array: np.ndarray, size: int) -> np.ndarray:
+    """Return array, or a copy with at least size rows (capacity doubles)."""
+    if len(array) >= size:
+        return array
+    grown = np.zeros((max(size, 2 * len(array)),) + array.shape[1:], dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
 
 def has_msms_data(feature: Dict[str, Any]) -> bool:
     """
@@ -49,39 +568,43 @@ def has_msms_data(feature: Dict[str, Any]) -> bool:
     return feature.get('has_msms', False)
 
 
-def fast_cosine_similarity(peaks1: np.ndarray, 
-                          intensities1: np.ndarray,
-                          peaks2: np.ndarray, 
-                          intensities2: np.ndarray,
+def fast_cosine_similarity(store1: SpectrumStore,
+                          index1: int,
+                          store2: SpectrumStore,
+                          index2: int,
                           min_shared_peaks: int = DEFAULT_MIN_SHARED_PEAKS) -> Tuple[float, int]:
     """
-    Calculate cosine similarity between two preprocessed spectra using vectorized operations.
+    Calculate cosine similarity between two stored spectra using sparse peak lists.
     
-    This is the core function that performs ultra-fast cosine similarity calculation
-    using boolean masks and numpy vectorization.
+    This is the core function that performs ultra-fast cosine similarity calculation.
+    Both spectra are sorted lists of nominal m/z bins, so the shared peaks are
+    found by a sorted intersection instead of masking MAX_MZ-sized arrays.
     
     Inputs:
-        peaks1 (np.ndarray): Boolean array for spectrum 1 (peak presence)
-        intensities1 (np.ndarray): Intensity array for spectrum 1
-        peaks2 (np.ndarray): Boolean array for spectrum 2 (peak presence)  
-        intensities2 (np.ndarray): Intensity array for spectrum 2
+        store1 (SpectrumStore): Store holding spectrum 1
+        index1 (int): Row of spectrum 1 in store1
+        store2 (SpectrumStore): Store holding spectrum 2
+        index2 (int): Row of spectrum 2 in store2
         min_shared_peaks (int): Minimum number of shared peaks required
         
     Outputs:
         Tuple[float, int]: (cosine_similarity_score, number_of_shared_peaks)
     """
-    # Find shared peaks using boolean AND operation (extremely fast)
-    shared_peaks_mask = peaks1 & peaks2
-    num_shared = np.sum(shared_peaks_mask)
+    mz_bin1, intensities1 = store1.peaks(index1)
+    mz_bin2, intensities2 = store2.peaks(index2)
+    
+    # Find shared peaks (both peak lists are sorted and unique)
+    _, shared1, shared2 = np.intersect1d(mz_bin1, mz_bin2, assume_unique=True,
+                                         return_indices=True)
+    num_shared = len(shared1)
     
     # Check minimum shared peaks requirement
     if num_shared < min_shared_peaks:
         return 0.0, num_shared
     
     # Extract intensity vectors only where both spectra have peaks
-    # This is much faster than iterating through all m/z values
-    vec1 = intensities1[shared_peaks_mask]
-    vec2 = intensities2[shared_peaks_mask]
+    vec1 = intensities1[shared1]
+    vec2 = intensities2[shared2]
     
     # Calculate cosine similarity using vectorized operations
     dot_product = np.dot(vec1, vec2)
@@ -100,10 +623,332 @@ def fast_cosine_similarity(peaks1: np.ndarray,
     return similarity, num_shared
 
 
+def _popcount_rows(words: np.ndarray) -> np.ndarray:
+    """Number of set bits in every row of a 2-D uint64 array."""
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words).sum(axis=1, dtype=np.int64)
+    return _POPCOUNT_TABLE[words.view(np.uint8)].sum(axis=1, dtype=np.int64)
+
+
+def shared_peak_counts(store_a: SpectrumStore,
+                       indices_a: np.ndarray,
+                       store_b: SpectrumStore,
+                       indices_b: np.ndarray) -> np.ndarray:
+    """
+    Count the shared nominal m/z peaks of many spectrum pairs.
+    
+    The peak-presence fingerprints of each pair are ANDed word by word and the
+    set bits counted, without touching peak lists or intensities.
+    
+    Inputs:
+        store_a (SpectrumStore): Store holding the first spectrum of each pair
+        indices_a (np.ndarray): Rows in store_a
+        store_b (SpectrumStore): Store holding the second spectrum of each pair
+        indices_b (np.ndarray): Rows in store_b
+        
+    Outputs:
+        np.ndarray: Number of shared peaks, one entry per pair
+    """
+    store_a, indices_a = store_a.resolve(indices_a)
+    store_b, indices_b = store_b.resolve(indices_b)
+    fingerprints_a = store_a.fingerprints()
+    fingerprints_b = store_b.fingerprints()
+    # Words beyond the narrower fingerprint cannot have shared bits
+    n_words = min(fingerprints_a.shape[1], fingerprints_b.shape[1])
+    fingerprints_a = fingerprints_a[:, :n_words]
+    fingerprints_b = fingerprints_b[:, :n_words]
+    
+    counts = np.zeros(len(indices_a), dtype=np.int64)
+    for start in range(0, len(indices_a), FINGERPRINT_BLOCK_PAIRS):
+        stop = start + FINGERPRINT_BLOCK_PAIRS
+        both = fingerprints_a[indices_a[start:stop]] & fingerprints_b[indices_b[start:stop]]
+        counts[start:stop] = _popcount_rows(both)
+    return counts
+
+
+def _gather_peak_positions(indptr: np.ndarray, indices: np.ndarray,
+                           counts: np.ndarray) -> np.ndarray:
+    """Flat positions of all peaks of the given store rows, row after row."""
+    total = int(counts.sum())
+    offsets = np.repeat(np.cumsum(counts) - counts, counts)
+    return np.repeat(indptr[indices], counts) + (np.arange(total) - offsets)
+
+
+def batch_cosine_similarity(store_a: SpectrumStore,
+                            indices_a: np.ndarray,
+                            store_b: SpectrumStore,
+                            indices_b: np.ndarray,
+                            min_shared_peaks: int = DEFAULT_MIN_SHARED_PEAKS,
+                            cache: Optional['CosineCache'] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Calculate cosine similarity for many spectrum pairs in one vectorized pass.
+    
+    The peaks of every pair are keyed as ``pair * stride + mz_bin`` so a single
+    sorted intersection finds all shared peaks of all pairs. Dot products and
+    the norms of the shared intensity vectors are then summed per pair with
+    ``np.bincount``. Scores follow fast_cosine_similarity: pairs with fewer
+    than ``min_shared_peaks`` shared peaks or a zero norm score 0.0.
+    
+    Shared peaks are first counted with shared_peak_counts, and only the pairs
+    that reach ``min_shared_peaks`` (usually a small fraction) have their peak
+    lists expanded and intersected. With a cache, pairs of spectra whose
+    scores are already known are not computed again (see CosineCache).
+    
+    Inputs:
+        store_a (SpectrumStore): Store holding the first spectrum of each pair
+        indices_a (np.ndarray): Rows in store_a
+        store_b (SpectrumStore): Store holding the second spectrum of each pair
+        indices_b (np.ndarray): Rows in store_b
+        min_shared_peaks (int): Minimum number of shared peaks required
+        cache (Optional[CosineCache]): Cache of scores by spectrum content
+        
+    Outputs:
+        Tuple[np.ndarray, np.ndarray]: (cosine scores, shared peak counts), one entry per pair
+    """
+    if len(indices_a) == 0:
+        return np.zeros(0, dtype=np.float64), np.zeros(0, dtype=np.int64)
+    
+    # Lazy stores decode only the spectra that are compared
+    store_a, indices_a = store_a.resolve(indices_a)
+    store_b, indices_b = store_b.resolve(indices_b)
+    if cache is not None:
+        return cache.scores(store_a, indices_a, store_b, indices_b, min_shared_peaks)
+    return _cosine_scores(store_a, indices_a, store_b, indices_b, min_shared_peaks)
+
+
+def _cosine_scores(store_a: SpectrumStore, indices_a: np.ndarray,
+                   store_b: SpectrumStore, indices_b: np.ndarray,
+                   min_shared_peaks: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Cosine scores and shared peak counts of pairs of decoded spectra (see batch_cosine_similarity)."""
+    n_pairs = len(indices_a)
+    scores = np.zeros(n_pairs, dtype=np.float64)
+    shared = np.zeros(n_pairs, dtype=np.int64)
+    
+    # Prefilter: only pairs with enough shared peaks need the intensity dot products
+    shared[:] = shared_peak_counts(store_a, indices_a, store_b, indices_b)
+    candidates = np.flatnonzero(shared >= max(min_shared_peaks, 1))
+    indices_a, indices_b = indices_a[candidates], indices_b[candidates]
+    n_candidates = len(candidates)
+    
+    counts_a = np.diff(store_a.indptr)[indices_a]
+    counts_b = np.diff(store_b.indptr)[indices_b]
+    stride = int(max(store_a.mz_bin.max(initial=0), store_b.mz_bin.max(initial=0))) + 1
+    
+    # Split the pairs into blocks that bound the number of expanded peaks
+    peak_totals = np.cumsum(counts_a + counts_b)
+    start = 0
+    while start < n_candidates:
+        base = peak_totals[start - 1] if start > 0 else 0
+        stop = int(np.searchsorted(peak_totals, base + BATCH_PEAK_BLOCK_SIZE, side='right'))
+        stop = max(stop, start + 1)
+        
+        block_a, block_b = counts_a[start:stop], counts_b[start:stop]
+        pos_a = _gather_peak_positions(store_a.indptr, indices_a[start:stop], block_a)
+        pos_b = _gather_peak_positions(store_b.indptr, indices_b[start:stop], block_b)
+        pair_ids = np.arange(stop - start, dtype=np.int64)
+        keys_a = np.repeat(pair_ids, block_a) * stride + store_a.mz_bin[pos_a]
+        keys_b = np.repeat(pair_ids, block_b) * stride + store_b.mz_bin[pos_b]
+        
+        # Shared peaks of all pairs at once (keys are unique within each side)
+        common, shared_a, shared_b = np.intersect1d(keys_a, keys_b, assume_unique=True,
+                                                    return_indices=True)
+        pair_of_peak = common // stride
+        vec_a = store_a.intensity[pos_a[shared_a]].astype(np.float64)
+        vec_b = store_b.intensity[pos_b[shared_b]].astype(np.float64)
+        
+        n_block = stop - start
+        block_shared = np.bincount(pair_of_peak, minlength=n_block)
+        dot_product = np.bincount(pair_of_peak, weights=vec_a * vec_b, minlength=n_block)
+        norm_a = np.sqrt(np.bincount(pair_of_peak, weights=vec_a * vec_a, minlength=n_block))
+        norm_b = np.sqrt(np.bincount(pair_of_peak, weights=vec_b * vec_b, minlength=n_block))
+        
+        valid = (block_shared >= min_shared_peaks) & (norm_a > 0.0) & (norm_b > 0.0)
+        block_scores = np.zeros(n_block, dtype=np.float64)
+        block_scores[valid] = dot_product[valid] / (norm_a[valid] * norm_b[valid])
+        
+        # Ensure result is between 0 and 1
+        scores[candidates[start:stop]] = np.clip(block_scores, 0.0, 1.0)
+        start = stop
+    
+    return scores, shared
+
+
+class CosineCache:
+    """
+    Bounded LRU cache of cosine scores keyed by spectrum content.
+    
+    Entries are keyed by (content hash a, content hash b, min_shared_peaks),
+    with the two hashes in ascending order because the score is symmetric.
+    Replicate and QC-pool injections contain many identical spectra, so the
+    same pair of spectra recurs across dataset pairs; each distinct pair is
+    scored once and later lookups are hits. Identical pairs within one batch
+    are also scored once.
+    
+    Entries live in parallel arrays sorted by a 64-bit digest of the key, so
+    a batch is looked up with one np.searchsorted; the full key is compared
+    as well, and pairs whose digest collides with a different key are simply
+    scored without the cache. Each entry records the batch that last used it;
+    when more than ``max_entries`` pairs are stored, the least recently used
+    entries are dropped until a quarter of the budget is free again.
+    """
+    
+    def __init__(self, max_entries: int = COSINE_CACHE_ENTRIES):
+        """
+        Create an empty cache.
+        
+        Inputs:
+            max_entries (int): Maximum number of spectrum pairs kept
+        """
+        self.max_entries = max_entries
+        self.digests = np.empty(0, dtype=np.uint64)
+        self.low = np.empty(0, dtype=np.uint64)
+        self.high = np.empty(0, dtype=np.uint64)
+        self.min_shared_peaks = np.empty(0, dtype=np.int64)
+        self.cosine = np.empty(0, dtype=np.float64)
+        self.shared = np.empty(0, dtype=np.int64)
+        self.last_used = np.empty(0, dtype=np.int64)
+        self.batches = 0
+        self.hits = 0
+        self.misses = 0
+    
+    def __len__(self) -> int:
+        return len(self.digests)
+    
+    def scores(self, store_a: SpectrumStore, indices_a: np.ndarray,
+               store_b: SpectrumStore, indices_b: np.ndarray,
+               min_shared_peaks: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Cosine scores of many pairs, computing only the pairs not in the cache.
+        
+        Every pair is counted as a hit when its score comes from the cache or
+        from an identical pair earlier in the batch, and as a miss otherwise.
+        
+        Inputs:
+            store_a (SpectrumStore): Decoded store holding the first spectrum of each pair
+            indices_a (np.ndarray): Rows in store_a
+            store_b (SpectrumStore): Decoded store holding the second spectrum of each pair
+            indices_b (np.ndarray): Rows in store_b
+            min_shared_peaks (int): Minimum number of shared peaks required
+            
+        Outputs:
+            Tuple[np.ndarray, np.ndarray]: (cosine scores, shared peak counts), one entry per pair
+        """
+        self.batches += 1
+        hashes_a = store_a.content_hashes()[indices_a]
+        hashes_b = store_b.content_hashes()[indices_b]
+        low, high = np.minimum(hashes_a, hashes_b), np.maximum(hashes_a, hashes_b)
+        digests = _mix64(_mix64(low ^ np.uint64(min_shared_peaks)) ^ high)
+        
+        # One representative per distinct digest; pairs that only share the
+        # digest with their representative (a collision) are scored directly
+        keys, first, inverse = np.unique(digests, return_index=True, return_inverse=True)
+        inverse = inverse.ravel()
+        key_low, key_high = low[first], high[first]
+        collided = np.flatnonzero((low != key_low[inverse]) | (high != key_high[inverse]))
+        
+        # Look the distinct keys up in the sorted entries
+        positions = np.minimum(np.searchsorted(self.digests, keys), max(len(self) - 1, 0))
+        found = np.zeros(len(keys), dtype=bool)
+        if len(self):
+            found = ((self.digests[positions] == keys) & (self.low[positions] == key_low) &
+                     (self.high[positions] == key_high) &
+                     (self.min_shared_peaks[positions] == min_shared_peaks))
+        scores = np.zeros(len(keys), dtype=np.float64)
+        shared = np.zeros(len(keys), dtype=np.int64)
+        scores[found] = self.cosine[positions[found]]
+        shared[found] = self.shared[positions[found]]
+        self.last_used[positions[found]] = self.batches
+        
+        missing = np.flatnonzero(~found)
+        if len(missing):
+            pairs = first[missing]
+            scores[missing], shared[missing] = _cosine_scores(
+                store_a, indices_a[pairs], store_b, indices_b[pairs], min_shared_peaks)
+            # Keys whose digest is already taken by a different entry are not stored
+            if len(self):
+                missing = missing[self.digests[positions[missing]] != keys[missing]]
+            self._insert(keys[missing], key_low[missing], key_high[missing], min_shared_peaks,
+                         scores[missing], shared[missing])
+        
+        scores, shared = scores[inverse], shared[inverse]
+        if len(collided):
+            scores[collided], shared[collided] = _cosine_scores(
+                store_a, indices_a[collided], store_b, indices_b[collided], min_shared_peaks)
+        
+        n_missing = int(np.count_nonzero(~found)) + len(collided)
+        self.misses += n_missing
+        self.hits += len(indices_a) - n_missing
+        return scores, shared
+    
+    def _insert(self, digests: np.ndarray, low: np.ndarray, high: np.ndarray, min_shared_peaks: int,
+                cosine: np.ndarray, shared: np.ndarray) -> None:
+        """Merge new entries (sorted digests not in the cache) and evict if over max_entries."""
+        new = {
+            'digests': digests,
+            'low': low,
+            'high': high,
+            'min_shared_peaks': np.full(len(digests), min_shared_peaks, dtype=np.int64),
+            'cosine': cosine,
+            'shared': shared,
+            'last_used': np.full(len(digests), self.batches, dtype=np.int64),
+        }
+        # Both sides are sorted by digest, so the merge needs no sort
+        positions = np.searchsorted(self.digests, digests)
+        for name, values in new.items():
+            setattr(self, name, np.insert(getattr(self, name), positions, values))
+        
+        if len(self) > self.max_entries:
+            # Drop the least recently used entries down to 3/4 of the budget, so
+            # the following batches can insert without evicting again
+            n_evict = len(self) - self.max_entries * 3 // 4
+            evicted = np.argpartition(self.last_used, n_evict - 1)[:n_evict]
+            keep = np.ones(len(self), dtype=bool)
+            keep[evicted] = False
+            for name in new:
+                setattr(self, name, getattr(self, name)[keep])
+
+
+def spectrum_store_for(features: list) -> SpectrumStore:
+    """
+    Return a SpectrumStore whose row k is the spectrum of ``features[k]``.
+    
+    Features read from one file already share a store in row order, which is
+    returned as-is. Otherwise (features assembled from several sources) the
+    referenced spectra are copied into a new store.
+    
+    Inputs:
+        features (list): Feature dictionaries with 'msms_store' and 'msms_index'
+        
+    Outputs:
+        SpectrumStore: Store with one row per feature
+    """
+    if features:
+        store = features[0].get('msms_store')
+        if (store is not None and len(store) == len(features) and
+                all(feature.get('msms_store') is store and feature.get('msms_index') == k
+                    for k, feature in enumerate(features))):
+            return store
+    
+    rows, mz_bins, intensities = [], [], []
+    for k, feature in enumerate(features):
+        if feature.get('msms_store') is None:
+            continue
+        mz_bin, intensity = feature['msms_store'].peaks(feature['msms_index'])
+        rows.append(np.full(len(mz_bin), k, dtype=np.int64))
+        mz_bins.append(mz_bin)
+        intensities.append(intensity)
+    
+    if not rows:
+        return SpectrumStore.empty(len(features))
+    return SpectrumStore.from_peaks(np.concatenate(rows), np.concatenate(mz_bins),
+                                    np.concatenate(intensities), len(features))
+
+
 def calculate_spectral_similarity(feature1: Dict[str, Any], 
                                  feature2: Dict[str, Any],
                                  min_shared_peaks: int = DEFAULT_MIN_SHARED_PEAKS,
-                                 cosine_threshold: float = DEFAULT_COSINE_THRESHOLD) -> float:
+                                 cosine_threshold: float = DEFAULT_COSINE_THRESHOLD,
+                                 cache: Optional[CosineCache] = None) -> float:
     """
     Calculate spectral similarity between two features with preprocessed MS/MS data.
     
@@ -111,10 +956,11 @@ def calculate_spectral_similarity(feature1: Dict[str, Any],
     and other modules for MS/MS similarity calculation.
     
     Inputs:
-        feature1 (Dict[str, Any]): First feature with 'msms_peaks' and 'msms_intensities'
-        feature2 (Dict[str, Any]): Second feature with 'msms_peaks' and 'msms_intensities'
+        feature1 (Dict[str, Any]): First feature with 'msms_store' and 'msms_index'
+        feature2 (Dict[str, Any]): Second feature with 'msms_store' and 'msms_index'
         min_shared_peaks (int): Minimum number of shared peaks required
         cosine_threshold (float): Minimum cosine similarity for valid match
+        cache (Optional[CosineCache]): Cache of scores by spectrum content
         
     Outputs:
         float: Cosine similarity score (0.0 to 1.0), 0.0 if below threshold or no MS/MS
@@ -123,16 +969,21 @@ def calculate_spectral_similarity(feature1: Dict[str, Any],
     if not (has_msms_data(feature1) and has_msms_data(feature2)):
         return 0.0
     
-    # Get precomputed arrays
-    peaks1 = feature1['msms_peaks']
-    intensities1 = feature1['msms_intensities']
-    peaks2 = feature2['msms_peaks']
-    intensities2 = feature2['msms_intensities']
-    
-    # Calculate fast cosine similarity
-    similarity, num_shared = fast_cosine_similarity(
-        peaks1, intensities1, peaks2, intensities2, min_shared_peaks
-    )
+    if cache is not None:
+        # Identical spectra compared before are answered from the cache
+        scores, shared = batch_cosine_similarity(
+            feature1['msms_store'], [feature1['msms_index']],
+            feature2['msms_store'], [feature2['msms_index']],
+            min_shared_peaks, cache
+        )
+        similarity, num_shared = float(scores[0]), int(shared[0])
+    else:
+        # Calculate fast cosine similarity on the stored spectra
+        similarity, num_shared = fast_cosine_similarity(
+            feature1['msms_store'], feature1['msms_index'],
+            feature2['msms_store'], feature2['msms_index'],
+            min_shared_peaks
+        )
     
     # Apply threshold filter
     if similarity < cosine_threshold:
@@ -164,12 +1015,8 @@ def get_msms_stats(feature: Dict[str, Any]) -> Dict[str, Any]:
             'max_intensity': 0.0
         }
     
-    peaks = feature['msms_peaks']
-    intensities = feature['msms_intensities']
-    
-    # Get peak positions where peaks exist
-    peak_positions = np.where(peaks)[0]
-    peak_intensities = intensities[peaks]
+    # Peak positions and intensities straight from the sparse store
+    peak_positions, peak_intensities = feature['msms_store'].peaks(feature['msms_index'])
     
     return {
         'has_msms': True,
@@ -188,11 +1035,10 @@ def batch_similarity_matrix(features: list,
     """
     Calculate pairwise similarity matrix for a batch of features (optional optimization).
     
-    This function is useful for calculating similarities between many features efficiently,
-    though for graph construction the pairwise approach is usually sufficient.
+    All pairs of features with MS/MS data are scored in one batch_cosine_similarity call.
     
     Inputs:
-        features (list): List of feature dictionaries with MS/MS arrays
+        features (list): List of feature dictionaries with stored MS/MS spectra
         min_shared_peaks (int): Minimum shared peaks requirement
         cosine_threshold (float): Minimum similarity threshold
         
@@ -202,54 +1048,59 @@ def batch_similarity_matrix(features: list,
     n_features = len(features)
     similarity_matrix = np.zeros((n_features, n_features), dtype=np.float32)
     
-    # Fill upper triangle of matrix
-    for i in range(n_features):
-        for j in range(i + 1, n_features):
-            sim = calculate_spectral_similarity(
-                features[i], features[j], min_shared_peaks, cosine_threshold
-            )
-            similarity_matrix[i, j] = sim
-            similarity_matrix[j, i] = sim  # Symmetric
+    # Score the upper triangle for features that have MS/MS data
+    with_msms = np.array([has_msms_data(feature) for feature in features], dtype=bool)
+    index_i, index_j = np.triu_indices(n_features, k=1)
+    both = with_msms[index_i] & with_msms[index_j]
+    index_i, index_j = index_i[both], index_j[both]
+    
+    store = spectrum_store_for(features)
+    scores, _ = batch_cosine_similarity(store, index_i, store, index_j, min_shared_peaks)
+    scores[scores < cosine_threshold] = 0.0
+    
+    similarity_matrix[index_i, index_j] = scores
+    similarity_matrix[index_j, index_i] = scores  # Symmetric
     
     # Diagonal is 1.0 for features that have MS/MS data
-    for i in range(n_features):
-        if has_msms_data(features[i]):
-            similarity_matrix[i, i] = 1.0
+    similarity_matrix[with_msms, with_msms] = 1.0
     
     return similarity_matrix
 
 
 def validate_feature_arrays(feature: Dict[str, Any]) -> bool:
     """
-    Validate that a feature has properly formatted MS/MS arrays.
+    Validate that a feature references a properly formatted MS/MS spectrum.
     
     Inputs:
         feature (Dict[str, Any]): Feature dictionary to validate
         
     Outputs:
-        bool: True if arrays are valid, False otherwise
+        bool: True if the stored spectrum is valid, False otherwise
     """
     try:
         # Check required fields exist
-        if 'msms_peaks' not in feature or 'msms_intensities' not in feature:
+        if 'msms_store' not in feature or 'msms_index' not in feature:
             return False
         
-        peaks = feature['msms_peaks']
-        intensities = feature['msms_intensities']
+        store = feature['msms_store']
+        index = feature['msms_index']
         
-        # Check array types and shapes
-        if not isinstance(peaks, np.ndarray) or not isinstance(intensities, np.ndarray):
+        # Check store type and row bounds
+        if not isinstance(store, SpectrumStore) or not 0 <= index < len(store):
             return False
         
-        if peaks.dtype != bool or intensities.dtype != np.float32:
+        mz_bin, intensities = store.peaks(index)
+        
+        if mz_bin.dtype != np.int32 or intensities.dtype != np.float32:
             return False
         
-        if peaks.shape != intensities.shape:
+        # Peaks must be sorted and unique within a spectrum
+        if len(mz_bin) > 1 and np.any(np.diff(mz_bin) <= 0):
             return False
         
         # Check has_msms flag consistency
         has_msms_flag = feature.get('has_msms', False)
-        actual_has_msms = np.any(peaks)
+        actual_has_msms = len(mz_bin) > 0
         
         if has_msms_flag != actual_has_msms:
             logger.warning(f"Inconsistent has_msms flag: {has_msms_flag} vs actual: {actual_has_msms}")
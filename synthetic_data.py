@@ -0,0 +1,303 @@
+"""
+Module for generating synthetic LC-MS feature tables with known alignments.
+
+Every dataset is a simulated injection of the same set of compounds. Each
+compound has a true m/z, retention time, abundance and (for most compounds)
+a fragment spectrum. An injection detects a compound with some probability
+(dropout) and reports it with random m/z and RT errors, a dataset-wide RT
+shift, intensity noise and a perturbed fragment spectrum (jittered fragment
+m/z, dropped fragments, added noise peaks). Unmatched noise features are
+mixed in. The compound of every feature is recorded, so alignment results
+can be scored against the true groups (see benchmark).
+
+Main functions/classes:
+    - generate_datasets: Simulates N datasets x M features as DataFrames
+    - write_datasets: Writes the datasets as .xlsx, .mgf and/or .msp files plus the true groups
+    - read_ground_truth: Reads the true groups written by write_datasets
+    - main: Command-line entry point (python synthetic_data.py)
+
+Inputs:
+    - Numbers of datasets and features and the noise settings below
+
+Outputs:
+    - <output_dir>/<prefix><d>.xlsx: Columns Peak ID, Scan, RT (min), Precursor m/z, Height, MSMS spectrum
+    - <output_dir>/<prefix><d>.mgf / .msp: The same features as MGF or MSP records
+    - <output_dir>/ground_truth.tsv: filename, feature_index and true_group (-1 for noise features)
+
+Important arguments:
+    - mz_error / rt_error: Standard deviation of the per-feature m/z (Da) and RT (min) errors
+    - rt_shift: Largest dataset-wide RT shift in minutes
+    - dropout: Probability that a dataset misses a compound
+    - msms_fraction: Fraction of compounds with a fragment spectrum
+    - mean_fragments: Mean number of fragments of a compound spectrum
+    - seed: Seed of the random generator (same seed, same files)
+"""
+import os
+import argparse
+import logging
+from typing import Dict, List, Sequence
+import numpy as np
+import pandas as pd
+
+# Configure logger for this module
+logger = logging.getLogger(__name__)
+
+GROUND_TRUTH_NAME = "ground_truth.tsv"
+
+# Columns read by read_files._parse_excel
+EXCEL_COLUMNS = ['Peak ID', 'Scan', 'RT (min)', 'Precursor m/z', 'Height', 'MSMS spectrum']
+
+FORMATS = ('xlsx', 'mgf', 'msp')
+
+
+def _compound_spectra(rng, precursor_mz, msms_fraction, mean_fragments):
+    """Fragment m/z and relative intensities of every compound (None without MS/MS)."""
+    spectra = []
+    for mz in precursor_mz.tolist():
+        if rng.random() >= msms_fraction:
+            spectra.append(None)
+            continue
+        n_fragments = 3 + rng.poisson(max(mean_fragments - 3, 0))
+        # Distinct nominal fragment masses below the precursor, with a mass defect
+        nominal = rng.choice(np.arange(50, max(int(mz), 60)), size=min(n_fragments, max(int(mz), 60) - 50),
+                             replace=False)
+        fragment_mz = np.sort(nominal + rng.uniform(-0.1, 0.3, len(nominal)))
+        intensity = rng.lognormal(0.0, 1.0, len(nominal))
+        spectra.append((fragment_mz, intensity / intensity.max()))
+    return spectra
+
+
+def _injection_spectrum(rng, spectrum, height, peak_dropout, fragment_error, noise_peaks, max_mz):
+    """MS/MS string of one detection of a compound spectrum."""
+    fragment_mz, relative = spectrum
+    keep = rng.random(len(fragment_mz)) >= peak_dropout
+    mz = fragment_mz[keep] + rng.normal(0.0, fragment_error, int(keep.sum()))
+    intensity = relative[keep] * rng.lognormal(0.0, 0.2, int(keep.sum()))
+
+    # Low-intensity noise peaks anywhere in the m/z range
+    n_noise = rng.poisson(noise_peaks)
+    mz = np.concatenate((mz, rng.uniform(50, max_mz, n_noise)))
+    intensity = np.concatenate((intensity, rng.uniform(0.001, 0.05, n_noise)))
+
+    order = np.argsort(mz)
+    scale = max(height / 10.0, 100.0)
+    return ';'.join(f"{m:.5f} {int(round(i * scale))}" for m, i in zip(mz[order], intensity[order]))
+
+
+def generate_datasets(n_datasets: int, n_features: int, mz_error: float = 0.002, rt_error: float = 0.05,
+                      rt_shift: float = 0.1, dropout: float = 0.1, noise_fraction: float = 0.05,
+                      msms_fraction: float = 0.6, msms_rate: float = 0.8, mean_fragments: float = 12.0,
+                      peak_dropout: float = 0.2, fragment_error: float = 0.005, noise_peaks: float = 2.0,
+                      mz_range=(100.0, 1000.0), rt_range=(0.5, 25.0), seed: int = 0) -> List[pd.DataFrame]:
+    """
+    Simulate LC-MS feature tables of several injections of the same compounds.
+
+    Parameters:
+    -----------
+    n_datasets : int
+        Number of datasets (injections)
+    n_features : int
+        Number of compounds; each dataset has about n_features * (1 - dropout + noise_fraction) features
+    mz_error : float
+        Standard deviation of the m/z error of a feature (in Da, default: 0.002)
+    rt_error : float
+        Standard deviation of the RT error of a feature (in minutes, default: 0.05)
+    rt_shift : float
+        Largest dataset-wide RT shift (in minutes, default: 0.1)
+    dropout : float
+        Probability that a dataset misses a compound (default: 0.1)
+    noise_fraction : float
+        Noise features per dataset, as a fraction of n_features (default: 0.05)
+    msms_fraction : float
+        Fraction of compounds with a fragment spectrum (default: 0.6)
+    msms_rate : float
+        Probability that a detection of such a compound has MS/MS (default: 0.8)
+    mean_fragments : float
+        Mean number of fragments of a compound spectrum (default: 12)
+    peak_dropout : float
+        Probability that a fragment is missing from one detection (default: 0.2)
+    fragment_error : float
+        Standard deviation of the fragment m/z error (in Da, default: 0.005)
+    noise_peaks : float
+        Mean number of noise peaks added to every spectrum (default: 2)
+    mz_range, rt_range : tuple
+        Ranges of the compound m/z and RT values
+    seed : int
+        Seed of the random generator (default: 0)
+
+    Returns:
+    --------
+    datasets : list
+        One DataFrame per dataset with the Excel columns (EXCEL_COLUMNS) and
+        'true_group' (compound id, -1 for noise features), sorted by RT
+    """
+    rng = np.random.default_rng(seed)
+    compound_mz = rng.uniform(*mz_range, n_features)
+    compound_rt = rng.uniform(*rt_range, n_features)
+    compound_abundance = rng.lognormal(11.0, 1.5, n_features)
+    compound_spectra = _compound_spectra(rng, compound_mz, msms_fraction, mean_fragments)
+    max_mz = float(mz_range[1])
+
+    datasets = []
+    for _ in range(n_datasets):
+        detected = np.flatnonzero(rng.random(n_features) >= dropout)
+        n_noise = int(round(noise_fraction * n_features))
+        groups = np.concatenate((detected, np.full(n_noise, -1, dtype=np.int64)))
+
+        shift = rng.uniform(-rt_shift, rt_shift)
+        mz = np.concatenate((compound_mz[detected] + rng.normal(0.0, mz_error, len(detected)),
+                             rng.uniform(*mz_range, n_noise)))
+        rt = np.concatenate((compound_rt[detected] + shift + rng.normal(0.0, rt_error, len(detected)),
+                             rng.uniform(*rt_range, n_noise)))
+        height = np.concatenate((compound_abundance[detected] * rng.lognormal(0.0, 0.3, len(detected)),
+                                 rng.lognormal(8.0, 1.0, n_noise)))
+
+        msms = []
+        for group, feature_height in zip(groups.tolist(), height.tolist()):
+            spectrum = compound_spectra[group] if group >= 0 else None
+            if spectrum is None or rng.random() >= msms_rate:
+                msms.append('')
+            else:
+                msms.append(_injection_spectrum(rng, spectrum, feature_height, peak_dropout,
+                                                fragment_error, noise_peaks, max_mz))
+
+        order = np.argsort(rt, kind='stable')
+        n_rows = len(order)
+        datasets.append(pd.DataFrame({
+            'Peak ID': np.arange(n_rows),
+            'Scan': np.arange(n_rows) * 3 + 1,
+            # Rounded like instrument exports, so every file format holds the same values
+            'RT (min)': np.round(np.maximum(rt[order], 0.0), 4),
+            'Precursor m/z': np.round(mz[order], 6),
+            'Height': np.round(height[order]),
+            'MSMS spectrum': [msms[k] for k in order.tolist()],
+            'true_group': groups[order],
+        }))
+    return datasets
+
+
+def _write_mgf(frame: pd.DataFrame, file_path: str) -> None:
+    """Write a dataset as MGF records (RT in seconds)."""
+    with open(file_path, 'w') as f:
+        for row in frame.itertuples(index=False):
+            f.write("BEGIN IONS\n")
+            f.write(f"TITLE=peak_{row[0]}\n")
+            f.write(f"RTINSECONDS={row[2] * 60.0:.4f}\n")
+            f.write(f"PEPMASS={row[3]:.6f}\n")
+            f.write("CHARGE=1+\n")
+            f.write(f"Signal_intensity={row[4]:.0f}\n")
+            if row[5]:
+                f.write(row[5].replace(';', '\n') + "\n")
+            f.write("END IONS\n\n")
+
+
+def _write_msp(frame: pd.DataFrame, file_path: str) -> None:
+    """Write a dataset as MSP records (RT in minutes)."""
+    with open(file_path, 'w') as f:
+        for row in frame.itertuples(index=False):
+            peaks = row[5].split(';') if row[5] else []
+            f.write(f"Name: peak_{row[0]}\n")
+            f.write(f"PrecursorMZ: {row[3]:.6f}\n")
+            f.write(f"RetentionTime: {row[2]:.4f}\n")
+            f.write(f"Signal_intensity: {row[4]:.0f}\n")
+            f.write(f"Num Peaks: {len(peaks)}\n")
+            for peak in peaks:
+                f.write(peak + "\n")
+            f.write("\n")
+
+
+def write_datasets(datasets: Sequence[pd.DataFrame], output_dir: str, formats: Sequence[str] = ('xlsx',),
+                   prefix: str = 'ds') -> Dict[str, List[str]]:
+    """
+    Write generated datasets and their true groups.
+
+    Parameters:
+    -----------
+    datasets : list
+        DataFrames from generate_datasets
+    output_dir : str
+        Directory for the files (created if needed)
+    formats : list
+        File formats to write: 'xlsx', 'mgf' and/or 'msp' (default: xlsx only)
+    prefix : str
+        File name prefix, followed by the dataset number (default: 'ds')
+
+    Returns:
+    --------
+    files : dict
+        Paths of the written files per format, in dataset order
+    """
+    unknown = set(formats) - set(FORMATS)
+    if unknown:
+        raise ValueError(f"Unknown formats {sorted(unknown)}; choose from {FORMATS}")
+    os.makedirs(output_dir, exist_ok=True)
+
+    files = {file_format: [] for file_format in formats}
+    truth = []
+    for dataset_id, frame in enumerate(datasets):
+        name = f"{prefix}{dataset_id}"
+        for file_format in formats:
+            file_path = os.path.join(output_dir, f"{name}.{file_format}")
+            if file_format == 'xlsx':
+                frame[EXCEL_COLUMNS].to_excel(file_path, index=False)
+            elif file_format == 'mgf':
+                _write_mgf(frame[EXCEL_COLUMNS], file_path)
+            else:
+                _write_msp(frame[EXCEL_COLUMNS], file_path)
+            files[file_format].append(file_path)
+        truth.append(pd.DataFrame({'filename': name, 'feature_index': np.arange(len(frame)),
+                                   'true_group': frame['true_group'].to_numpy()}))
+
+    pd.concat(truth, ignore_index=True).to_csv(os.path.join(output_dir, GROUND_TRUTH_NAME), sep='\t', index=False)
+    logger.info(f"Wrote {len(datasets)} datasets ({', '.join(formats)}) to {output_dir}")
+    return files
+
+
+def read_ground_truth(output_dir: str) -> pd.DataFrame:
+    """
+    Read the true groups written by write_datasets.
+
+    Parameters:
+    -----------
+    output_dir : str
+        Directory passed to write_datasets
+
+    Returns:
+    --------
+    truth : pandas.DataFrame
+        filename (without extension), feature_index and true_group of every feature
+    """
+    return pd.read_csv(os.path.join(output_dir, GROUND_TRUTH_NAME), sep='\t')
+
+
+def main():
+    """
+    Generate synthetic datasets from the command line.
+    """
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    parser = argparse.ArgumentParser(description='Generate synthetic LC-MS feature tables')
+    parser.add_argument('--output-dir', type=str, required=True, help='Directory for the generated files')
+    parser.add_argument('--datasets', type=int, default=4, help='Number of datasets')
+    parser.add_argument('--features', type=int, default=1000, help='Number of compounds (features per dataset before dropout)')
+    parser.add_argument('--formats', nargs='+', choices=FORMATS, default=['xlsx'], help='File formats to write')
+    parser.add_argument('--mz-error', type=float, default=0.002, help='Standard deviation of the m/z error (in Da)')
+    parser.add_argument('--rt-error', type=float, default=0.05, help='Standard deviation of the RT error (in minutes)')
+    parser.add_argument('--rt-shift', type=float, default=0.1, help='Largest dataset-wide RT shift (in minutes)')
+    parser.add_argument('--dropout', type=float, default=0.1, help='Probability that a dataset misses a compound')
+    parser.add_argument('--msms-fraction', type=float, default=0.6, help='Fraction of compounds with a fragment spectrum')
+    parser.add_argument('--mean-fragments', type=float, default=12.0, help='Mean number of fragments per compound spectrum')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the random generator')
+    args = parser.parse_args()
+
+    datasets = generate_datasets(args.datasets, args.features, mz_error=args.mz_error, rt_error=args.rt_error,
+                                 rt_shift=args.rt_shift, dropout=args.dropout, msms_fraction=args.msms_fraction,
+                                 mean_fragments=args.mean_fragments, seed=args.seed)
+    write_datasets(datasets, args.output_dir, formats=args.formats)
+
+
+if __name__ == "__main__":
+    main()
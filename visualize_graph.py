@@ -41,6 +41,8 @@ from matplotlib.colors import LinearSegmentedColormap
 from matplotlib.patches import Circle
 from matplotlib.collections import PatchCollection
 from collections import defaultdict
+from feature_table import node_feature
+from mass_feature_aligner import read_aligned_features
 
 # Global variable to store the initial layout
 initial_layout = None
@@ -416,7 +418,7 @@ def plot_community_graph(G, partition, output_dir, pos=None, max_nodes=1000, max
         for dataset_id, dataset_nodes in by_dataset.items():
             if dataset_nodes:
                 # Sort by intensity (descending)
-                best_node = max(dataset_nodes, key=lambda n: G.nodes[n].get('intensity', 0))
+                best_node = max(dataset_nodes, key=lambda n: node_feature(G, n).get('intensity', 0))
                 filtered_partition[best_node] = comm_id
     
     print(f"Filtered partition from {len(partition)} to {len(filtered_partition)} nodes")
@@ -594,7 +596,7 @@ def plot_clique_graph(G, cliques, output_dir, pos=None, max_nodes=1000, max_edge
         for dataset_id, dataset_nodes in by_dataset.items():
             if dataset_nodes:
                 # Sort by intensity (descending)
-                best_node = max(dataset_nodes, key=lambda n: G.nodes[n].get('intensity', 0))
+                best_node = max(dataset_nodes, key=lambda n: node_feature(G, n).get('intensity', 0))
                 filtered_clique.append(best_node)
         
         # Only keep cliques with at least 3 nodes
@@ -796,7 +798,7 @@ def create_intensity_heatmap(aligned_features_file, output_dir, max_groups=50):
     Parameters:
     -----------
     aligned_features_file : str
-        Path to the TSV file with aligned features
+        Path to the aligned features file (TSV, gzip-compressed TSV or Parquet)
     output_dir : str
         Directory to save the heatmap
     max_groups : int
@@ -805,7 +807,7 @@ def create_intensity_heatmap(aligned_features_file, output_dir, max_groups=50):
     print(f"Creating intensity heatmap from {aligned_features_file}...")
     
     # Read aligned features file
-    df = pd.read_csv(aligned_features_file, sep='\t')
+    df = read_aligned_features(aligned_features_file)
     
     # Check if intensity columns exist
     intensity_cols = [col for col in df.columns if 'intensity' in col.lower()]